@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import pytest
+from elasticsearch import Elasticsearch
+from elasticsearch.transport import Transport
+
+
+def pytest_configure():
+    import django
+    from django.conf import settings
+
+    if settings.configured:
+        return
+    settings.configure(
+        SECRET_KEY='not very secret in benchmarks',
+        INSTALLED_APPS=[
+            'rest_framework_elasticsearch',
+            'tests',
+        ],
+        DATABASES={'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}},
+        ALLOWED_HOSTS=['testserver'],
+        REST_FRAMEWORK={'UNAUTHENTICATED_USER': None},
+    )
+    django.setup()
+
+
+def make_hit(i):
+    return {
+        '_index': 'test',
+        '_type': 'doc',
+        '_id': '%d' % i,
+        '_score': 1.0,
+        '_source': {
+            'first_name': 'first %d' % i,
+            'last_name': 'last %d' % i,
+            'city': 'Warsaw',
+            'skills': ['python', 'sql', 'js'],
+            'birthday': '1985-03-17T12:20:09',
+            'is_active': i % 2 == 0,
+            'score': i,
+            'location': {'lat': 52.2297, 'lon': 21.0122},
+            'description': 'description of the document %d' % i,
+        },
+    }
+
+
+class StubTransport(Transport):
+    """
+    Transport which answers the requests with prepared responses, the
+    request bodies are serialized as they are sent to Elasticsearch.
+    """
+    total = 10000
+    _hits = None
+
+    @classmethod
+    def get_hits(cls):
+        # Prepared once, so the benchmarks measure the library
+        if cls._hits is None:
+            cls._hits = [make_hit(i) for i in range(cls.total)]
+        return cls._hits
+
+    def perform_request(self, method, url, headers=None, params=None, body=None):
+        if body is not None:
+            self.serializer.dumps(body)
+        if url.endswith('/_count'):
+            return {'count': self.total}
+        if url.endswith('/_search'):
+            body = body or {}
+            start = body.get('from', 0)
+            size = body.get('size', 10)
+            hits = self.get_hits()[start:start + size]
+            return {
+                'took': 1,
+                'timed_out': False,
+                '_shards': {'total': 1, 'successful': 1, 'failed': 0},
+                'hits': {'total': self.total, 'max_score': 1.0, 'hits': hits},
+            }
+        raise ValueError('Unexpected request %s %s' % (method, url))
+
+
+@pytest.fixture(scope='session')
+def es_stub():
+    StubTransport.get_hits()
+    return Elasticsearch(transport_class=StubTransport)
+
+
+@pytest.fixture(scope='session')
+def es_memory():
+    """Client of an in-memory engine with `StubTransport.total` documents"""
+    from elasticsearch.helpers import bulk
+    from rest_framework_elasticsearch.testing.es_memory import get_in_memory_client
+    from tests.test_data import DataDocType
+
+    client = get_in_memory_client()
+    DataDocType.init(using=client)
+    bulk(client, StubTransport.get_hits(), refresh=True)
+    return client
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import pytest
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from rest_framework_elasticsearch.es_filters import (
+    ESFieldFilter, ElasticFieldsFilter, ElasticFieldsRangeFilter,
+    ElasticOrderingFilter, ElasticSearchFilter)
+from rest_framework_elasticsearch.es_views import ElasticAPIView
+from tests.test_data import DataDocType
+
+FIELDS = ('first_name', 'last_name', 'skills', 'is_active', 'score')
+# Many filters of the same fields, like a view of a large document
+FILTER_FIELDS = tuple(ESFieldFilter('%s_%d' % (name, i), name)
+                      for i in range(10) for name in FIELDS)
+
+rf = APIRequestFactory()
+
+
+class View(ElasticAPIView):
+    es_model = DataDocType
+    es_filter_fields = FILTER_FIELDS
+    es_range_filter_fields = (ESFieldFilter('score'), ESFieldFilter('birthday'))
+    es_search_fields = ('first_name', 'last_name', 'city', 'description')
+    es_ordering_fields = tuple(('%s_%d' % (name, i), name)
+                               for i in range(10) for name in FIELDS) + ('score',)
+
+
+def get_request(params):
+    return Request(rf.get('/test/', params))
+
+
+@pytest.fixture
+def view(es_stub):
+    view = View()
+    view.es_client = es_stub
+    return view
+
+
+def test_fields_filter(benchmark, view):
+    params = dict((item.label, 'python,sql,js') for item in FILTER_FIELDS)
+    request = get_request(params)
+    search = view.get_es_search()
+    result = benchmark(ElasticFieldsFilter().filter_search, request, search, view)
+    assert result.to_dict()['query']['bool']['filter']
+
+
+def test_range_filter(benchmark, view):
+    request = get_request({'from_score': '10', 'to_score': '100',
+                           'from_birthday': '2000-01-01'})
+    search = view.get_es_search()
+    benchmark(ElasticFieldsRangeFilter().filter_search, request, search, view)
+
+
+def test_search_filter(benchmark, view):
+    request = get_request({'search': 'first name words of a query'})
+    search = view.get_es_search()
+    benchmark(ElasticSearchFilter().filter_search, request, search, view)
+
+
+def test_ordering_filter(benchmark, view):
+    ordering = ','.join('-%s_%d' % (name, i) for i in range(10) for name in FIELDS)
+    request = get_request({'ordering': ordering + ',unknown,score'})
+    search = view.get_es_search()
+    result = benchmark(ElasticOrderingFilter().filter_search, request, search, view)
+    assert result.to_dict()['sort']
+
+
+def test_do_search(benchmark, view):
+    view.es_filter_backends = (ElasticFieldsFilter, ElasticFieldsRangeFilter,
+                               ElasticSearchFilter, ElasticOrderingFilter)
+    params = dict((item.label, 'python') for item in FILTER_FIELDS[:10])
+    params.update({'search': 'query', 'ordering': '-score', 'from_score': '1'})
+    view.request = get_request(params)
+    benchmark(lambda: view.do_search().to_dict())
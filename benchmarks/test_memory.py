@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from rest_framework_elasticsearch.es_filters import (
+    ESFieldFilter, ElasticFieldsFilter, ElasticFieldsRangeFilter,
+    ElasticOrderingFilter, ElasticSearchFilter)
+from rest_framework_elasticsearch.es_views import ElasticAPIView
+from tests.test_data import DataDocType
+
+rf = APIRequestFactory()
+
+
+class View(ElasticAPIView):
+    es_model = DataDocType
+    es_filter_backends = (ElasticFieldsFilter, ElasticFieldsRangeFilter,
+                          ElasticSearchFilter, ElasticOrderingFilter)
+    es_filter_fields = (ESFieldFilter('is_active'), ESFieldFilter('skills'))
+    es_range_filter_fields = (ESFieldFilter('score'),)
+    es_search_fields = ('first_name', 'description')
+    es_ordering_fields = ('score', 'first_name')
+
+
+def test_view_search(benchmark, es_memory):
+    view = View()
+    view.es_client = es_memory
+    view.request = Request(rf.get('/test/', {
+        'is_active': 'true', 'from_score': '100', 'to_score': '9000',
+        'search': 'document', 'ordering': '-score',
+    }))
+
+    def search():
+        return view.do_search()[:20].execute()
+
+    response = benchmark(search)
+    assert response.hits.total == 4451
+    assert response.hits[0].score == 9000
+
+
+def test_count(benchmark, es_memory):
+    search = DataDocType.search(using=es_memory).filter('term', skills='python')
+    assert benchmark(search.count) == 10000
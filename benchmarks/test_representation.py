@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import pytest
+from rest_framework import serializers
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from rest_framework_elasticsearch.es_pagination import ElasticLimitOffsetPagination
+from rest_framework_elasticsearch.es_queryset import ElasticQuerySet
+from rest_framework_elasticsearch.es_serializer import ElasticHitSerializer
+from rest_framework_elasticsearch.es_views import ListElasticAPIView
+from tests.test_data import DataDocType
+
+rf = APIRequestFactory()
+
+PAGE_SIZE = 1000
+
+
+class HitSerializer(ElasticHitSerializer):
+    name = serializers.CharField(source='first_name')
+    last_name = serializers.CharField()
+    skills = serializers.ReadOnlyField()
+    score = serializers.IntegerField()
+    birthday = serializers.DateTimeField(format='%Y-%m-%d')
+
+
+class View(ListElasticAPIView):
+    es_model = DataDocType
+    es_server_timing = False
+
+
+@pytest.fixture
+def view(es_stub):
+    view = View()
+    view.es_client = es_stub
+    view.request = Request(rf.get('/test/'))
+    return view
+
+
+@pytest.fixture
+def hits(view):
+    return list(view.get_es_search()[:PAGE_SIZE].execute())
+
+
+def test_representation(benchmark, view, hits):
+    data = benchmark(view.es_representation, hits)
+    assert len(data) == PAGE_SIZE
+
+
+def test_representation_with_serializer(benchmark, view, hits):
+    view.es_serializer_class = HitSerializer
+    data = benchmark(view.es_representation, hits)
+    assert data[0]['name'] == 'first 0'
+
+
+def test_execute_page(benchmark, view):
+    """Request, response parsing and hydration of a large page."""
+    search = view.get_es_search()[:PAGE_SIZE]
+    response = benchmark(lambda: search.execute(ignore_cache=True))
+    assert len(response.hits) == PAGE_SIZE
+
+
+def test_limit_offset_pagination(benchmark, view):
+    request = Request(rf.get('/test/', {'limit': 100, 'offset': 500}))
+
+    def paginate():
+        paginator = ElasticLimitOffsetPagination()
+        page = paginator.paginate_search(view.do_search(), request, view)
+        return paginator.get_paginated_response(view.es_representation(page))
+
+    response = benchmark(paginate)
+    assert len(response.data['results']) == 100
+
+
+def test_queryset_windows(benchmark, view):
+    def slices():
+        queryset = ElasticQuerySet(view.do_search(), view.es_representation)
+        queryset.prefetch(0, 100)
+        queryset.count()
+        # Served from the fetched window
+        return queryset[10:20]
+
+    assert len(benchmark(slices)) == 10
+
+
+def test_list_view(benchmark, es_stub):
+    class PaginatedView(View):
+        es_client = es_stub
+        es_serializer_class = HitSerializer
+
+    view = PaginatedView.as_view()
+    request = rf.get('/test/', {'limit': 100})
+    response = benchmark(lambda: view(request).render())
+    assert response.status_code == 200
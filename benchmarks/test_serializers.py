@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from rest_framework import serializers
+
+from rest_framework_elasticsearch.es_serializer import (
+    ElasticModelSerializer, ElasticSerializer)
+from tests.models import Person
+from tests.test_data import DataDocType
+
+SIZE = 1000
+
+
+class PersonSerializer(ElasticModelSerializer):
+    class Meta:
+        model = Person
+        es_model = DataDocType
+        fields = ('first_name', 'last_name', 'score')
+
+
+class DocumentSerializer(ElasticSerializer):
+    id = serializers.IntegerField()
+    first_name = serializers.CharField()
+    last_name = serializers.CharField()
+    skills = serializers.ListField(child=serializers.CharField())
+    score = serializers.IntegerField()
+
+    class Meta:
+        es_model = DataDocType
+
+
+def test_model_es_repr(benchmark):
+    people = [Person(pk=i, first_name='first %d' % i, last_name='last', score=i)
+              for i in range(SIZE)]
+    serializer = PersonSerializer(many=True)
+
+    def es_repr():
+        return [serializer.child.es_repr(person).to_dict() for person in people]
+
+    documents = benchmark(es_repr)
+    assert len(documents) == SIZE
+
+
+def test_es_repr(benchmark):
+    data = [{'id': i, 'first_name': 'first %d' % i, 'last_name': 'last',
+             'skills': ['python', 'sql'], 'score': i} for i in range(SIZE)]
+    serializer = DocumentSerializer(many=True)
+
+    def es_repr():
+        return [serializer.child.es_repr(item).to_dict() for item in data]
+
+    documents = benchmark(es_repr)
+    assert documents[0]['first_name'] == 'first 0'
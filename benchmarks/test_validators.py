@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from rest_framework_elasticsearch.es_validators import field_validator
+
+VALUES = [
+    ('boolean', 'true'), ('boolean', '0'), ('boolean', 'maybe'),
+    ('integer', '42'), ('long', '-7'), ('short', 'x'),
+    ('float', '3.14'), ('double', '1e10'), ('float', ''),
+    ('keyword', 'python'), ('text', 'some words'), ('date', '2018-01-01'),
+] * 100
+
+
+def test_validate(benchmark):
+    def validate():
+        return [field_validator.validate(field_type, value) for field_type, value in VALUES]
+
+    result = benchmark(validate)
+    assert result[:4] == [True, False, None, 42]
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import time
+from itertools import islice
+
+from django.utils import six
+from django.utils.encoding import force_text
+from elasticsearch.helpers import BulkIndexError, streaming_bulk
+from elasticsearch_dsl.connections import connections
+from elasticsearch_dsl.utils import DOC_META_FIELDS
+
+from .es_options import set_options
+from .es_signals import es_bulk_executed
+
+
+class BulkResult(object):
+    """Summary of a bulk request with the list of failed items."""
+
+    def __init__(self):
+        self.success = 0
+        self.errors = []
+        # Ids of the skipped documents which have a newer version
+        self.conflicts = []
+
+    def __repr__(self):
+        return '<%s: success=%d, errors=%d>' % (
+            self.__class__.__name__, self.success, len(self.errors))
+
+
+class ElasticBulkIndexer(object):
+    """
+    Send documents to Elasticsearch with the `streaming_bulk` helper.
+
+    Chunks are limited by the number of documents (`chunk_size`) and by
+    bytes (`max_chunk_bytes`), documents rejected with `429` are retried
+    with the exponential backoff. With `adaptive` set the chunk size is
+    adjusted after each chunk to keep its latency near `target_latency`.
+    """
+    chunk_size = 500
+    max_chunk_bytes = 100 * 1024 * 1024
+    max_retries = 3
+    initial_backoff = 2
+    max_backoff = 600
+    adaptive = False
+    # Desired chunk latency in seconds
+    target_latency = 1.0
+    min_chunk_size = 50
+    max_chunk_size = 10000
+    raise_on_error = True
+    # Count version conflicts as successful, a newer version is indexed
+    skip_conflicts = False
+
+    def __init__(self, using=None, **options):
+        self.using = using
+        set_options(self, options)
+
+    @classmethod
+    def get_option_names(cls):
+        return [name for name in dir(cls)
+                if not name.startswith('_') and
+                not callable(getattr(cls, name))]
+
+    def get_client(self):
+        return connections.get_connection(self.using or 'default')
+
+    def is_ok(self, op_type, item):
+        """Return `True` if the failed item should not be reported."""
+        if self.skip_conflicts and item.get('status') == 409:
+            return True
+        # The document is already deleted
+        return op_type == 'delete' and item.get('status') == 404
+
+    def adapt_chunk_size(self, elapsed):
+        if elapsed > self.target_latency * 1.5:
+            self.chunk_size = max(self.min_chunk_size, self.chunk_size // 2)
+        elif elapsed < self.target_latency / 2.0:
+            self.chunk_size = min(self.max_chunk_size, int(self.chunk_size * 1.5))
+
+    def streaming(self, client, actions, **kwargs):
+        """
+        Yield the (ok, item) result of each action, the failures which
+        should not be reported are `ok`. Keyword arguments override the
+        options of the `streaming_bulk` helper.
+        """
+        options = dict(chunk_size=self.chunk_size,
+                       max_chunk_bytes=self.max_chunk_bytes,
+                       max_retries=self.max_retries,
+                       initial_backoff=self.initial_backoff,
+                       max_backoff=self.max_backoff)
+        options.update(kwargs)
+        for ok, item in streaming_bulk(client, actions, raise_on_error=False, **options):
+            op_type, info = next(iter(item.items()))
+            yield ok or self.is_ok(op_type, info), item
+
+    def _streaming_bulk(self, client, actions, result, **kwargs):
+        for ok, item in self.streaming(client, actions, **kwargs):
+            if ok:
+                result.success += 1
+                info = next(iter(item.values()))
+                if info.get('status') == 409:
+                    result.conflicts.append(info.get('_id'))
+            else:
+                result.errors.append(item)
+
+    def send(self, actions, **kwargs):
+        """Execute bulk actions and return the `BulkResult` without raising."""
+        client = self.get_client()
+        result = BulkResult()
+        start = time.time()
+        error = None
+        try:
+            self._send(client, actions, result, **kwargs)
+        except Exception as exc:
+            error = exc
+            raise
+        finally:
+            es_bulk_executed.send(sender=self.__class__, indexer=self,
+                                  duration=(time.time() - start) * 1000,
+                                  success=result.success, errors=len(result.errors),
+                                  error=error)
+        return result
+
+    def _send(self, client, actions, result, **kwargs):
+        if not self.adaptive:
+            self._streaming_bulk(client, actions, result, **kwargs)
+        else:
+            actions = iter(actions)
+            while True:
+                chunk = list(islice(actions, self.chunk_size))
+                if not chunk:
+                    break
+                start = time.time()
+                self._streaming_bulk(client, chunk, result, **kwargs)
+                self.adapt_chunk_size(time.time() - start)
+
+    def check(self, result):
+        if result.errors and self.raise_on_error:
+            raise BulkIndexError(
+                '%i document(s) failed to index.' % len(result.errors),
+                result.errors
+            )
+        return result
+
+    def bulk(self, actions, **kwargs):
+        """
+        Execute bulk actions and return the `BulkResult`.
+        Extra keyword arguments are passed to `Elasticsearch.bulk`.
+        """
+        return self.check(self.send(actions, **kwargs))
+
+    def get_meta(self, document, index=None):
+        meta = dict(('_' + k, document.meta[k])
+                    for k in DOC_META_FIELDS if k in document.meta)
+        meta['_index'] = document._get_index(index)
+        meta['_type'] = document._doc_type.name
+        return meta
+
+    def index_action(self, document, index=None):
+        action = self.get_meta(document, index)
+        action['_source'] = document.to_dict()
+        return action
+
+    def update_action(self, document, fields, source=None, index=None):
+        """Partial update of the `fields`, the missing fields are set to `None`."""
+        if source is None:
+            source = document.to_dict()
+        action = self.get_meta(document, index)
+        action['_op_type'] = 'update'
+        action['doc'] = dict((field, source.get(field)) for field in fields)
+        return action
+
+    def delete_action(self, document, index=None):
+        action = self.get_meta(document, index)
+        # The version of a deleted object is not newer than the indexed one
+        action.pop('_version', None)
+        action.pop('_version_type', None)
+        action['_op_type'] = 'delete'
+        return action
+
+    def index(self, documents, index=None, validate=True, **kwargs):
+        """Index or replace the `Document` instances."""
+        def actions():
+            for document in documents:
+                if validate:
+                    document.full_clean()
+                yield self.index_action(document, index)
+        return self.bulk(actions(), **kwargs)
+
+    def index_changes(self, documents, tracker, index=None, validate=True, **kwargs):
+        """
+        Write only the changed documents with the `ElasticChangeTracker`,
+        unchanged documents are skipped and partially changed ones are
+        updated. An update of a missing document is retried as the index.
+        Versioned documents are always indexed in full, partial updates
+        don't support the external versioning.
+        """
+        states = {}
+        updated = {}
+
+        def actions():
+            for document, source, fields, digests in tracker.changes(documents):
+                if validate:
+                    document.full_clean()
+                pk = force_text(document.meta.id)
+                states[pk] = digests
+                if fields is None or 'version' in document.meta:
+                    yield self.index_action(document, index)
+                else:
+                    updated[pk] = document
+                    yield self.update_action(document, fields, source, index)
+
+        result = self.send(actions(), **kwargs)
+        missing = []
+        errors = []
+        for item in result.errors:
+            op_type, info = next(iter(item.items()))
+            if op_type == 'update' and info.get('status') == 404 and \
+                    info.get('_id') in updated:
+                missing.append(updated[info['_id']])
+            else:
+                errors.append(item)
+        result.errors = errors
+        if missing:
+            retry = self.send((self.index_action(document, index) for document in missing),
+                              **kwargs)
+            result.success += retry.success
+            result.errors.extend(retry.errors)
+            result.conflicts.extend(retry.conflicts)
+
+        # The states of the conflicting documents are unknown
+        failed = set(force_text(next(iter(item.values())).get('_id'))
+                     for item in result.errors)
+        failed.update(force_text(pk) for pk in result.conflicts)
+        tracker.store(dict((pk, digests) for pk, digests in six.iteritems(states)
+                           if pk not in failed))
+        return self.check(result)
+
+    def delete(self, documents, index=None, **kwargs):
+        """Delete the `Document` instances."""
+        return self.bulk(
+            (self.delete_action(document, index) for document in documents),
+            **kwargs
+        )
+
+    def delete_ids(self, es_model, ids, index=None, **kwargs):
+        """Delete documents of the `es_model` by ids."""
+        index = es_model()._get_index(index)
+        doc_type = es_model._doc_type.name
+        return self.bulk(
+            ({'_op_type': 'delete', '_index': index, '_type': doc_type, '_id': pk}
+             for pk in ids),
+            **kwargs
+        )
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import hashlib
+import json
+from itertools import islice
+
+from django.apps import apps
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.utils import six
+from django.utils.encoding import force_text
+
+
+def get_state_model():
+    return apps.get_model('rest_framework_elasticsearch', 'ElasticDocumentState')
+
+
+class ElasticChangeTracker(object):
+    """
+    Detect the changed fields of documents before they are written.
+
+    A hash of each field of the written source is stored in the
+    `ElasticDocumentState` table. A document is indexed in full when
+    there is no stored state, skipped when no field changed or only
+    the `ignore_fields` changed, otherwise only the changed fields are
+    sent with a partial update. A partial update merges the object fields
+    with the indexed ones, so a document with a changed object field is
+    indexed in full.
+    """
+    # Number of documents which states are loaded with one query
+    batch_size = 500
+
+    def __init__(self, index, ignore_fields=(), using=DEFAULT_DB_ALIAS):
+        self.index = index
+        self.ignore_fields = frozenset(ignore_fields)
+        # Database alias of the state table
+        self.using = using
+
+    def get_queryset(self):
+        return get_state_model().objects.using(self.using).filter(index=self.index)
+
+    @staticmethod
+    def get_digest(value):
+        data = json.dumps(value, sort_keys=True, cls=DjangoJSONEncoder)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def get_digests(self, source):
+        return dict((key, self.get_digest(value)) for key, value in six.iteritems(source))
+
+    def load(self, ids):
+        """Return {document_id: digests} of the stored documents."""
+        queryset = self.get_queryset().filter(
+            document_id__in=[force_text(pk) for pk in ids])
+        return dict((document_id, json.loads(digests)) for document_id, digests
+                    in queryset.values_list('document_id', 'digests'))
+
+    def get_changed_fields(self, old, new):
+        """
+        Return the sorted list of the changed fields, an empty list if
+        nothing relevant changed and `None` if the document is not stored.
+        """
+        if old is None:
+            return None
+        changed = [key for key in set(old) | set(new) if old.get(key) != new.get(key)]
+        if self.ignore_fields.issuperset(changed):
+            return []
+        return sorted(changed)
+
+    def changes(self, documents):
+        """
+        Yield (document, source, fields, digests) of the documents which
+        should be written, `fields` is `None` for a full write.
+        """
+        documents = iter(documents)
+        while True:
+            batch = [(document, document.to_dict())
+                     for document in islice(documents, self.batch_size)]
+            if not batch:
+                break
+            states = self.load(document.meta.id for document, _ in batch)
+            for document, source in batch:
+                digests = self.get_digests(source)
+                fields = self.get_changed_fields(
+                    states.get(force_text(document.meta.id)), digests)
+                if fields and any(isinstance(source.get(field), dict) for field in fields):
+                    fields = None
+                if fields != []:
+                    yield document, source, fields, digests
+
+    def store(self, states):
+        """Save the {document_id: digests} states of the written documents."""
+        if not states:
+            return
+        model = get_state_model()
+        rows = dict((force_text(pk), json.dumps(digests, sort_keys=True))
+                    for pk, digests in six.iteritems(states))
+        try:
+            with transaction.atomic(using=self.using):
+                self.get_queryset().filter(document_id__in=list(rows)).delete()
+                model.objects.using(self.using).bulk_create([
+                    model(index=self.index, document_id=document_id, digests=digests)
+                    for document_id, digests in six.iteritems(rows)
+                ])
+        except IntegrityError:
+            # A state was created by a concurrent write
+            for document_id, digests in six.iteritems(rows):
+                model.objects.using(self.using).update_or_create(
+                    index=self.index, document_id=document_id,
+                    defaults={'digests': digests})
+
+    def forget(self, ids):
+        """Remove the states of the deleted documents."""
+        ids = [force_text(pk) for pk in ids]
+        if ids:
+            self.get_queryset().filter(document_id__in=ids).delete()
+
+    def clear(self):
+        """Remove the states of the index, e.g. after it was recreated."""
+        self.get_queryset().delete()
+
+
+def forget_index_states(index=None, ids=None, using=DEFAULT_DB_ALIAS):
+    """
+    Remove the stored states of the documents written without the tracker,
+    e.g. by a reindex, a script or `_update_by_query`, so their next write
+    is not compared with an outdated state. All states of the index are
+    removed when `ids` is `None`, and of all indices when `index` is `None`.
+    """
+    if not apps.is_installed('rest_framework_elasticsearch'):
+        return
+    if index is None:
+        get_state_model().objects.using(using).all().delete()
+        return
+    tracker = ElasticChangeTracker(index, using=using)
+    if ids is None:
+        tracker.clear()
+    else:
+        tracker.forget(ids)
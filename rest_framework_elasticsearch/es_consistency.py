@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+import hashlib
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Case, Count, Max, Min, Q, Sum, When
+from django.utils import six
+from django.utils.encoding import force_text
+from elasticsearch.helpers import scan
+from elasticsearch_dsl import A
+from elasticsearch_dsl.connections import connections
+
+from .es_options import set_options
+
+
+def get_source_digest(source):
+    """Return the digest of a document source, the keys order is ignored."""
+    data = json.dumps(source, sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+class ConsistencyReport(object):
+    """Result of a consistency check."""
+
+    def __init__(self):
+        self.ranges = 0
+        # Leaf ranges which were compared document by document
+        self.mismatched_ranges = []
+        # Ids of the documents missing in the index
+        self.missing = []
+        # Ids of the documents which differ from the database
+        self.stale = []
+        # Ids of the documents which don't exist in the database
+        self.extra = []
+        self.repaired = 0
+
+    @property
+    def consistent(self):
+        return not (self.missing or self.stale or self.extra)
+
+    def __str__(self):
+        return '%d ranges checked, %d missing, %d stale, %d extra, %d repaired' % (
+            self.ranges, len(self.missing), len(self.stale), len(self.extra),
+            self.repaired
+        )
+
+
+class ElasticConsistencyChecker(object):
+    """
+    Find and repair the documents which differ from the database.
+
+    The pk space is split into `branching` ranges and a checksum of each
+    range is computed on both sides with one request: the number of rows,
+    the sum of pks and the sums of the `checksum_fields` by SQL aggregates,
+    the same values by Elasticsearch aggregations of the `pk_field` and
+    the mapped fields. Only the mismatched ranges are split further, when
+    a range is not larger than `leaf_size` the documents are compared by
+    the digests of their sources and the differing ones are repaired.
+
+    The index must contain the pk as the numeric `pk_field`. The checksums
+    detect the changes of the `checksum_fields` only, e.g. a version
+    number updated on each change. Without `checksum_fields` the sums
+    can't detect a changed content, so all ranges are compared by the
+    digests of the document sources, which reads every document.
+    """
+    # Elasticsearch field with the pk of the object
+    pk_field = 'id'
+    # Numeric {model field: Elasticsearch field} summed in the checksums
+    checksum_fields = {}
+    # Number of subranges of a mismatched range
+    branching = 10
+    # Ranges which are compared document by document
+    leaf_size = 1000
+    # Index the missing and stale documents, delete the extra ones
+    repair = False
+
+    def __init__(self, serializer_class, using=None, index=None,
+                 database=DEFAULT_DB_ALIAS, **options):
+        self.serializer_class = serializer_class
+        # Elasticsearch connection alias
+        self.using = using
+        self.index = index
+        self.database = database
+        set_options(self, options)
+        if self.branching < 2:
+            raise ValueError('branching must be at least 2')
+
+    @property
+    def model(self):
+        return self.serializer_class.Meta.model
+
+    @property
+    def es_model(self):
+        return self.serializer_class.Meta.es_model
+
+    def get_queryset(self):
+        return self.model._default_manager.using(self.database).all()
+
+    def get_search(self):
+        return self.es_model.search(using=self.using, index=self.index)
+
+    def get_client(self):
+        return connections.get_connection(self.get_search()._using)
+
+    def get_bounds(self):
+        """Return the (start, stop) range which covers pks of both sides."""
+        db_bounds = self.get_queryset().aggregate(min=Min('pk'), max=Max('pk'))
+        search = self.get_search()[:0]
+        search.aggs.metric('min', 'min', field=self.pk_field)
+        search.aggs.metric('max', 'max', field=self.pk_field)
+        aggs = search.execute().aggregations
+        values = [value for value in (db_bounds['min'], db_bounds['max'],
+                                      aggs.min.value, aggs.max.value)
+                  if value is not None]
+        if not values:
+            return None
+        if not all(isinstance(value, six.integer_types + (float,)) for value in values):
+            raise ValueError('Consistency check requires an integer primary key')
+        return int(min(values)), int(max(values)) + 1
+
+    def split(self, start, stop):
+        """Split a range into at most `branching` ranges."""
+        size = max(1, -(-(stop - start) // self.branching))
+        return [(low, min(low + size, stop)) for low in range(start, stop, size)]
+
+    def get_db_checksums(self, ranges):
+        """Return the list of (count, sums) of the ranges, one query for all."""
+        aggregates = {}
+        for i, (start, stop) in enumerate(ranges):
+            # Case/When instead of the `filter` argument, which needs Django 2.0
+            condition = Q(pk__gte=start, pk__lt=stop)
+            aggregates['count_%d' % i] = Count(Case(When(condition, then='pk')))
+            aggregates['pk_%d' % i] = Sum(Case(When(condition, then='pk')))
+            for j, field in enumerate(sorted(self.checksum_fields)):
+                aggregates['field_%d_%d' % (i, j)] = Sum(Case(When(condition, then=field)))
+        values = self.get_queryset().aggregate(**aggregates)
+
+        checksums = []
+        for i in range(len(ranges)):
+            sums = [values['pk_%d' % i]]
+            sums.extend(values['field_%d_%d' % (i, j)]
+                        for j in range(len(self.checksum_fields)))
+            checksums.append((values['count_%d' % i],
+                              tuple(int(round(value or 0)) for value in sums)))
+        return checksums
+
+    def get_es_checksums(self, ranges):
+        """Return the list of (count, sums) of the ranges, one request for all."""
+        search = self.get_search()[:0]
+        agg = A('range', field=self.pk_field, keyed=True, ranges=[
+            {'key': '%d' % i, 'from': start, 'to': stop}
+            for i, (start, stop) in enumerate(ranges)
+        ])
+        agg.metric('pk', 'sum', field=self.pk_field)
+        for j, field in enumerate(sorted(self.checksum_fields)):
+            agg.metric('field_%d' % j, 'sum', field=self.checksum_fields[field])
+        search.aggs.bucket('ranges', agg)
+        buckets = search.execute().aggregations.ranges.buckets
+
+        checksums = []
+        for i in range(len(ranges)):
+            bucket = buckets['%d' % i]
+            sums = [bucket.pk.value]
+            sums.extend(bucket['field_%d' % j].value
+                        for j in range(len(self.checksum_fields)))
+            checksums.append((bucket.doc_count,
+                              tuple(int(round(value or 0)) for value in sums)))
+        return checksums
+
+    def get_db_documents(self, start, stop):
+        """Return {id: document} of the objects in the range."""
+        queryset = self.serializer_class.get_es_queryset(
+            self.get_queryset().filter(pk__gte=start, pk__lt=stop))
+        serializer = self.serializer_class(many=True)
+        documents = {}
+        for instance in queryset:
+            document = serializer.child.es_repr(instance)
+            documents[force_text(document.meta.id)] = document
+        return documents
+
+    def get_source(self, document):
+        """Return the `_source` which is indexed for the document."""
+        document.full_clean()
+        serializer = self.get_client().transport.serializer
+        return json.loads(serializer.dumps(document.to_dict()))
+
+    def get_es_digests(self, start, stop):
+        """Return {id: source digest} of the documents in the range."""
+        search = self.get_search().filter(
+            'range', **{self.pk_field: {'gte': start, 'lt': stop}})
+        # The raw sources, the documents would parse the dates
+        hits = scan(self.get_client(), query=search.to_dict(),
+                    index=search._index, **search._params)
+        return dict((force_text(hit['_id']), get_source_digest(hit['_source']))
+                    for hit in hits)
+
+    def compare(self, start, stop, report):
+        """
+        Compare the documents of a leaf range and repair the differences,
+        return whether the range differs.
+        """
+        documents = self.get_db_documents(start, stop)
+        digests = self.get_es_digests(start, stop)
+        changed = []
+        for pk, document in six.iteritems(documents):
+            if pk not in digests:
+                report.missing.append(pk)
+                changed.append(document)
+            elif digests[pk] != get_source_digest(self.get_source(document)):
+                report.stale.append(pk)
+                changed.append(document)
+        extra = [pk for pk in digests if pk not in documents]
+        report.extra.extend(extra)
+
+        if self.repair and (changed or extra):
+            report.repaired += self.send(changed, extra)
+        return bool(changed or extra)
+
+    def send(self, documents, delete_ids):
+        indexer = self.serializer_class(many=True).get_bulk_indexer(self.using)
+        # The repaired documents replace the indexed ones
+        for document in documents:
+            for key in ('version', 'version_type'):
+                if key in document.meta:
+                    del document.meta[key]
+        success = 0
+        if documents:
+            success += indexer.index(documents, self.index).success
+        if delete_ids:
+            success += indexer.delete_ids(self.es_model, delete_ids, self.index).success
+        return success
+
+    def check_documents(self, ranges, report):
+        """Compare all documents of the ranges in the leaf ranges."""
+        for start, stop in ranges:
+            for low in range(start, stop, self.leaf_size):
+                high = min(low + self.leaf_size, stop)
+                report.ranges += 1
+                if self.compare(low, high, report):
+                    report.mismatched_ranges.append((low, high))
+
+    def check(self, ranges, report):
+        if not self.checksum_fields:
+            # The count and the sum of pks miss the changed documents
+            self.check_documents(ranges, report)
+            return
+
+        db_checksums = self.get_db_checksums(ranges)
+        es_checksums = self.get_es_checksums(ranges)
+        report.ranges += len(ranges)
+        for (start, stop), db_checksum, es_checksum in zip(ranges, db_checksums,
+                                                           es_checksums):
+            if db_checksum == es_checksum:
+                continue
+            if stop - start <= self.leaf_size:
+                report.mismatched_ranges.append((start, stop))
+                self.compare(start, stop, report)
+            else:
+                self.check(self.split(start, stop), report)
+
+    def run(self):
+        """Check the whole pk space and return the `ConsistencyReport`."""
+        report = ConsistencyReport()
+        bounds = self.get_bounds()
+        if bounds is not None:
+            self.check(self.split(*bounds), report)
+        return report
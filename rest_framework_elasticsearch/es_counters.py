@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+
+from django.utils import six
+from django.utils.encoding import force_text
+
+from .es_bulk import BulkResult
+from .es_options import set_options
+
+logger = logging.getLogger(__name__)
+
+# Statuses of the failed updates which are retried with the next flush
+RETRY_STATUSES = (409, 429)
+
+# The source is constant, so the script is compiled once by Elasticsearch
+COUNTERS_SCRIPT = (
+    'for (entry in params.counters.entrySet()) {'
+    ' def value = ctx._source[entry.getKey()];'
+    ' ctx._source[entry.getKey()] = (value == null ? 0 : value) + entry.getValue();'
+    ' }'
+)
+
+
+class ElasticCounterBuffer(object):
+    """
+    Aggregate increments of counter fields in memory and send them as
+    bulk scripted updates.
+
+    Increments are summed per (document, field), the buffer is flushed
+    when it holds `max_size` documents and every `interval` seconds by
+    a daemon thread started with `start()`. `close()` stops the thread
+    and flushes the rest, it's registered to be called at exit.
+
+    Updates rejected with a conflict, `429` or a server error are retried
+    with the next flush, the other failures, e.g. a missing document, are
+    logged and counted in `dropped`. When the bulk raises, the updates
+    without a result are kept, the ones of a request which failed after
+    Elasticsearch applied it are sent again, so the counts are at least once.
+
+        views = ElasticCounterBuffer(ElasticBlogSerializer).start()
+        views.incr(blog.pk, 'views')
+    """
+    # Number of documents which triggers a flush
+    max_size = 1000
+    # Seconds between the flushes of the background thread
+    interval = 5.0
+    retry_on_conflict = 5
+
+    def __init__(self, serializer_class, using=None, index=None, **options):
+        self.serializer_class = serializer_class
+        self.using = using
+        self.index = index
+        set_options(self, options)
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._atexit = False
+        # Number of the document updates which failed and were not retried
+        self.dropped = 0
+
+    def incr(self, pk, field, value=1):
+        """Add `value` to the `field` of the document."""
+        with self._lock:
+            self._add(pk, field, value)
+            full = len(self._pending) >= self.max_size
+        if full:
+            if self._thread is not None:
+                self._wakeup.set()
+            else:
+                self.flush()
+
+    def decr(self, pk, field, value=1):
+        self.incr(pk, field, -value)
+
+    def _add(self, pk, field, value):
+        counters = self._pending.setdefault(pk, {})
+        counters[field] = counters.get(field, 0) + value
+
+    def __len__(self):
+        return len(self._pending)
+
+    def get_bulk_indexer(self):
+        serializer = self.serializer_class([], many=True)
+        return serializer.get_bulk_indexer(self.using, raise_on_error=False)
+
+    def get_actions(self, pending):
+        es_model = self.serializer_class([], many=True).child.get_es_model()
+        index = es_model()._get_index(self.index)
+        doc_type = es_model._doc_type.name
+        for pk, counters in six.iteritems(pending):
+            counters = dict((field, value) for field, value in six.iteritems(counters)
+                            if value)
+            if not counters:
+                continue
+            yield {
+                '_op_type': 'update',
+                '_index': index,
+                '_type': doc_type,
+                '_id': pk,
+                'retry_on_conflict': self.retry_on_conflict,
+                'script': {
+                    'source': COUNTERS_SCRIPT,
+                    'lang': 'painless',
+                    'params': {'counters': counters},
+                },
+            }
+
+    def flush(self):
+        """Send the buffered increments and return the `BulkResult`."""
+        with self._lock:
+            pending, self._pending = self._pending, OrderedDict()
+        if not pending:
+            return BulkResult()
+        indexer = self.get_bulk_indexer()
+        acknowledged = set()
+        self.track_acknowledged(indexer, acknowledged)
+        try:
+            result = indexer.bulk(self.get_actions(pending))
+        except Exception:
+            # Keep the increments which were not applied for the next flush,
+            # the chunks sent before the error are not counted twice
+            self.requeue(OrderedDict(
+                (pk, counters) for pk, counters in six.iteritems(pending)
+                if force_text(pk) not in acknowledged))
+            raise
+        finally:
+            self.forget_change_states(pending)
+
+        pks = dict((force_text(pk), pk) for pk in pending)
+        retried = OrderedDict()
+        for item in result.errors:
+            info = next(iter(item.values()))
+            pk = pks.get(force_text(info.get('_id')))
+            if pk is not None and self.is_retryable(info.get('status')):
+                retried[pk] = pending[pk]
+                continue
+            with self._lock:
+                self.dropped += 1
+            logger.error('Failed to update counters: %s', item)
+        self.requeue(retried)
+        return result
+
+    def track_acknowledged(self, indexer, acknowledged):
+        """Add the ids of the applied updates to `acknowledged` as the results are streamed."""
+        streaming = indexer.streaming
+
+        def tracked(client, actions, **kwargs):
+            for ok, item in streaming(client, actions, **kwargs):
+                if ok:
+                    acknowledged.add(force_text(next(iter(item.values())).get('_id')))
+                yield ok, item
+
+        indexer.streaming = tracked
+
+    def is_retryable(self, status):
+        """Return `True` if the failed increments should be sent again."""
+        return status in RETRY_STATUSES or (status or 0) >= 500
+
+    def requeue(self, pending):
+        with self._lock:
+            for pk, counters in six.iteritems(pending):
+                for field, value in six.iteritems(counters):
+                    self._add(pk, field, value)
+
+    def forget_change_states(self, pks):
+        """Remove the states of the `ElasticChangeTracker`, the scripts change the documents."""
+        tracker = self.serializer_class([], many=True).child.get_change_tracker(self.index)
+        if tracker is not None:
+            tracker.forget(pks)
+
+    def run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Failed to flush counters')
+
+    def start(self):
+        """Start the background flushes, the buffer is closed at exit."""
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self.run, name='es-counters')
+            self._thread.daemon = True
+            self._thread.start()
+            if not self._atexit:
+                atexit.register(self.close)
+                self._atexit = True
+        return self
+
+    def close(self):
+        """Stop the background thread and flush the buffer."""
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopped.set()
+            self._wakeup.set()
+            thread.join()
+        return self.flush()
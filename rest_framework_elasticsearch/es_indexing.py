@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import partial
+
+from django.apps import apps
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.utils import six
+from django.utils.encoding import force_text
+from elasticsearch.helpers import BulkIndexError
+
+INDEX = 'index'
+DELETE = 'delete'
+# Reindex the objects which depend on the changed object
+DEPENDENTS = 'dependents'
+
+logger = logging.getLogger(__name__)
+
+
+def merge_op(queued, op):
+    """Return the operation of an object queued with `queued` and then with `op`."""
+    # INDEX and DELETE of a related object reindex its dependents as well,
+    # DEPENDENTS must not replace them when the model is also indexed itself
+    if op == DEPENDENTS and queued is not None:
+        return queued
+    return op
+
+
+class ElasticSyncError(BulkIndexError):
+    """
+    Documents of a flush failed to sync, `items` are the flushed
+    (model, pk) keys whose documents or dependent documents failed.
+    """
+
+    def __init__(self, message, errors, items):
+        super(ElasticSyncError, self).__init__(message, errors)
+        self.items = items
+
+
+def get_failed_pks(errors, pks_by_id):
+    """Return the pks of the failed bulk items, None if one is unknown."""
+    failed = set()
+    for error in errors:
+        for info in error.values():
+            pk = pks_by_id.get(force_text(info.get('_id')))
+            if pk is None:
+                return None
+            failed.add(pk)
+    return failed
+
+
+class ElasticIndexDispatcher(object):
+    """
+    Keep Elasticsearch documents in sync with Django models.
+
+    Changes of the registered models are queued per database transaction
+    as (model, pk) -> operation, so the repeated saves of an object are
+    coalesced. The queue is sent with the bulk API when the transaction
+    is committed and is dropped when it's rolled back. Outside of
+    a transaction a change is sent immediately.
+
+    A flush syncs the queued objects with the database: the objects are
+    re-read and indexed, the ones which do not exist anymore are deleted.
+
+    Documents which embed data of related models declare them in the
+    serializer `Meta.es_dependencies` as {related model: lookup path from
+    the indexed model}. The objects which depend on the changed related
+    objects are resolved with one query per dependency when the queue is
+    flushed and are indexed with the other queued objects.
+
+    An error of the flush on commit is passed to `handle_flush_error`,
+    which logs it, since raising it after the commit would skip the other
+    on-commit callbacks. Set `raise_on_error` to raise it instead.
+    """
+    raise_on_error = False
+
+    def __init__(self, using=None):
+        # Elasticsearch connection alias or client
+        self.using = using
+        self._registry = OrderedDict()
+        # {related model: [(model, lookup path)]}
+        self._dependencies = OrderedDict()
+        self._local = threading.local()
+
+    def get_dispatch_uid(self, model, signal_name):
+        return 'es_indexing_%s_%s_%s' % (id(self), model._meta.label, signal_name)
+
+    def get_serializer_dependencies(self, serializer_class):
+        dependencies = getattr(getattr(serializer_class, 'Meta', None),
+                               'es_dependencies', {})
+        for related_model, path in six.iteritems(dependencies):
+            if isinstance(related_model, six.string_types):
+                related_model = apps.get_model(related_model)
+            yield related_model, path
+
+    def register(self, model, serializer_class, connect=True):
+        """Sync the `model` changes using the `ElasticModelSerializer` class."""
+        self._registry[model] = serializer_class
+        if connect:
+            post_save.connect(self.handle_save, sender=model, weak=False,
+                              dispatch_uid=self.get_dispatch_uid(model, 'save'))
+            post_delete.connect(self.handle_delete, sender=model, weak=False,
+                                dispatch_uid=self.get_dispatch_uid(model, 'delete'))
+
+        for related_model, path in self.get_serializer_dependencies(serializer_class):
+            self._dependencies.setdefault(related_model, []).append((model, path))
+            if connect:
+                post_save.connect(
+                    self.handle_dependency_save, sender=related_model, weak=False,
+                    dispatch_uid=self.get_dispatch_uid(related_model, 'dependency_save'))
+                pre_delete.connect(
+                    self.handle_dependency_delete, sender=related_model, weak=False,
+                    dispatch_uid=self.get_dispatch_uid(related_model, 'dependency_delete'))
+
+    def unregister(self, model):
+        self._registry.pop(model, None)
+        post_save.disconnect(sender=model,
+                             dispatch_uid=self.get_dispatch_uid(model, 'save'))
+        post_delete.disconnect(sender=model,
+                               dispatch_uid=self.get_dispatch_uid(model, 'delete'))
+
+        for related_model in list(self._dependencies):
+            dependencies = [item for item in self._dependencies[related_model]
+                            if item[0] is not model]
+            if dependencies:
+                self._dependencies[related_model] = dependencies
+                continue
+            del self._dependencies[related_model]
+            post_save.disconnect(
+                sender=related_model,
+                dispatch_uid=self.get_dispatch_uid(related_model, 'dependency_save'))
+            pre_delete.disconnect(
+                sender=related_model,
+                dispatch_uid=self.get_dispatch_uid(related_model, 'dependency_delete'))
+
+    def get_serializer_class(self, model):
+        try:
+            return self._registry[model]
+        except KeyError:
+            raise ValueError(
+                "Model '%s' is not registered" % model._meta.label
+            )
+
+    def handle_save(self, sender, instance, raw=False, using=None, **kwargs):
+        # Skip fixtures loading
+        if raw:
+            return
+        self.enqueue(sender, instance.pk, INDEX, using)
+
+    def handle_delete(self, sender, instance, using=None, **kwargs):
+        self.enqueue(sender, instance.pk, DELETE, using)
+
+    def handle_dependency_save(self, sender, instance, raw=False, using=None, **kwargs):
+        if raw:
+            return
+        self.enqueue(sender, instance.pk, DEPENDENTS, using)
+
+    def handle_dependency_delete(self, sender, instance, using=None, **kwargs):
+        # The relations are removed by the deletion, the dependent objects
+        # are resolved before it
+        items = OrderedDict()
+        for model, pks in six.iteritems(self.get_dependent_pks(sender, [instance.pk], using)):
+            for pk in pks:
+                items[(model, pk)] = INDEX
+        if items:
+            self.enqueue_many(items, using)
+
+    def enqueue(self, model, pk, op, using=None):
+        self.enqueue_many({(model, pk): op}, using)
+
+    def reindex(self, model, pks, using=None):
+        """Queue objects changed without signals, e.g. by `QuerySet.update()`."""
+        self.enqueue_many(OrderedDict(((model, pk), INDEX) for pk in pks), using)
+
+    def enqueue_many(self, items, using=None):
+        using = using or DEFAULT_DB_ALIAS
+        suspended = getattr(self._local, 'suspended', None)
+        if suspended is not None:
+            for key, op in six.iteritems(items):
+                suspended[(using, key)] = merge_op(suspended.get((using, key)), op)
+            return
+
+        connection = transaction.get_connection(using)
+        if not connection.in_atomic_block:
+            self.flush_items(items, using)
+            return
+
+        queue = self.get_queue(using)
+        callback = self.get_flush_callback(using)
+        if not any(entry[1] is callback for entry in connection.run_on_commit):
+            # A new transaction, the items of a rolled back one are dropped
+            queue.clear()
+            transaction.on_commit(callback, using=using)
+        for key, op in six.iteritems(items):
+            queue[key] = merge_op(queue.pop(key, None), op)
+
+    def get_queue(self, using):
+        queues = self._local.__dict__.setdefault('queues', {})
+        return queues.setdefault(using, OrderedDict())
+
+    def get_flush_callback(self, using):
+        callbacks = self._local.__dict__.setdefault('callbacks', {})
+        if using not in callbacks:
+            callbacks[using] = partial(self.flush, using)
+        return callbacks[using]
+
+    def flush(self, using=DEFAULT_DB_ALIAS):
+        """Send the queue of the database connection."""
+        queue = self.get_queue(using)
+        items = OrderedDict(queue)
+        queue.clear()
+        if not items:
+            return
+        try:
+            self.flush_items(items, using)
+        except Exception as exc:
+            if self.raise_on_error:
+                raise
+            self.handle_flush_error(items, exc, using)
+
+    def handle_flush_error(self, items, exc, using=DEFAULT_DB_ALIAS):
+        """
+        Handle an error of the flushed {(model, pk): op} items, override to
+        retry them, e.g. by writing them into the outbox.
+        """
+        logger.exception('Failed to sync %i object(s) on commit', len(items))
+
+    def get_queryset(self, model):
+        return self.get_serializer_class(model).get_es_queryset(
+            model._default_manager.all())
+
+    def get_dependent_pks(self, related_model, related_pks, using=DEFAULT_DB_ALIAS):
+        """Return {model: pks} of the objects which depend on the related objects."""
+        dependent = OrderedDict()
+        for model, path in self._dependencies.get(related_model, []):
+            pks = model._default_manager.using(using).filter(
+                **{'%s__in' % path: related_pks}
+            ).values_list('pk', flat=True).distinct()
+            dependent.setdefault(model, []).extend(pks)
+        return dependent
+
+    def flush_items(self, items, using=DEFAULT_DB_ALIAS):
+        """
+        Sync the {(model, pk): op} items with the database in bulk.
+
+        `ElasticSyncError` is raised after all documents are sent when some
+        of them failed, with the items they were synced for. A failed
+        dependent document fails all the items of its related model.
+        """
+        grouped = OrderedDict()
+        related = OrderedDict()
+        # {(model, pk): [item keys]} of the synced documents
+        sources = {}
+        for key, op in six.iteritems(items):
+            model, pk = key
+            if model in self._dependencies:
+                related.setdefault(model, []).append(pk)
+            if op != DEPENDENTS:
+                grouped.setdefault(model, OrderedDict())[pk] = op
+                sources.setdefault(key, []).append(key)
+
+        for related_model, related_pks in six.iteritems(related):
+            related_keys = [(related_model, pk) for pk in related_pks]
+            dependent = self.get_dependent_pks(related_model, related_pks, using)
+            for model, pks in six.iteritems(dependent):
+                ops = grouped.setdefault(model, OrderedDict())
+                for pk in pks:
+                    ops.setdefault(pk, INDEX)
+                    sources.setdefault((model, pk), []).extend(related_keys)
+
+        errors = []
+        failed = set()
+        for model, ops in six.iteritems(grouped):
+            serializer_class = self.get_serializer_class(model)
+            index_pks = [pk for pk, op in six.iteritems(ops) if op == INDEX]
+            delete_pks = set(pk for pk, op in six.iteritems(ops) if op == DELETE)
+            failed_pks = set()
+
+            try:
+                if index_pks:
+                    indexed = {}
+                    serializer = serializer_class()
+
+                    def instances(queryset):
+                        if not queryset._prefetch_related_lookups:
+                            queryset = queryset.iterator()
+                        for instance in queryset:
+                            document_id = serializer.get_es_instace_pk(instance)
+                            indexed[force_text(document_id)] = instance.pk
+                            yield instance
+
+                    queryset = self.get_queryset(model).using(using).filter(pk__in=index_pks)
+                    try:
+                        serializer_class(instances(queryset), many=True).save(using=self.using)
+                    except BulkIndexError as exc:
+                        # The errors are raised after all documents are sent
+                        errors.extend(exc.errors)
+                        pks = get_failed_pks(exc.errors, indexed)
+                        failed_pks.update(index_pks if pks is None else pks)
+                    # Objects removed after the change was queued
+                    delete_pks.update(set(index_pks) - set(indexed.values()))
+            finally:
+                # The deletes are sent even if the index failed
+                if delete_pks:
+                    try:
+                        serializer_class([], many=True).delete_ids(delete_pks, using=self.using)
+                    except BulkIndexError as exc:
+                        errors.extend(exc.errors)
+                        pks = get_failed_pks(
+                            exc.errors, dict((force_text(pk), pk) for pk in delete_pks))
+                        failed_pks.update(delete_pks if pks is None else pks)
+            for pk in failed_pks:
+                failed.update(sources[(model, pk)])
+
+        if errors:
+            raise ElasticSyncError('%i document(s) failed to sync.' % len(errors), errors,
+                                   [key for key in items if key in failed])
+
+    @contextmanager
+    def suspended(self):
+        """
+        Suspend per-object indexing during mass operations, the touched
+        objects are sent in bulk on exit, or on commit of the transaction.
+        """
+        if getattr(self._local, 'suspended', None) is not None:
+            # Nested block
+            yield
+            return
+
+        touched = self._local.suspended = OrderedDict()
+        try:
+            yield
+        finally:
+            self._local.suspended = None
+            by_database = OrderedDict()
+            for (using, key), op in six.iteritems(touched):
+                by_database.setdefault(using, OrderedDict())[key] = op
+            for using, items in six.iteritems(by_database):
+                self.enqueue_many(items, using)
+
+
+index_dispatcher = ElasticIndexDispatcher()
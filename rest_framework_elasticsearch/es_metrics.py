@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import re
+import socket
+import threading
+from collections import OrderedDict
+
+from django.http import HttpResponse
+from django.utils import six
+from elasticsearch.connection import Urllib3HttpConnection
+from elasticsearch.exceptions import ConnectionTimeout
+
+from .es_signals import es_bulk_executed, es_cache_accessed, es_query_executed
+
+# Seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric(object):
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_key(self, labels):
+        return tuple(six.text_type(labels.get(name, '')) for name in self.labelnames)
+
+
+class Counter(Metric):
+    """Monotonic counter with labels."""
+    type = 'counter'
+
+    def inc(self, value=1, **labels):
+        key = self.get_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def get(self, **labels):
+        return self._values.get(self.get_key(labels), 0)
+
+    def samples(self):
+        """Yield the (suffix, labels, value) samples."""
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield '', OrderedDict(zip(self.labelnames, key)), value
+
+
+class Histogram(Metric):
+    """Distribution of the observed values in cumulative buckets."""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.get_key(labels)
+        with self._lock:
+            # [bucket counts, sum, count]
+            state = self._values.setdefault(key, [[0] * len(self.buckets), 0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def get(self, **labels):
+        """Return the (sum, count) of the observed values."""
+        state = self._values.get(self.get_key(labels))
+        return (state[1], state[2]) if state else (0, 0)
+
+    def samples(self):
+        with self._lock:
+            values = [(key, (list(state[0]), state[1], state[2]))
+                      for key, state in self._values.items()]
+        for key, (counts, total, count) in values:
+            labels = OrderedDict(zip(self.labelnames, key))
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield '_bucket', OrderedDict(labels, le='%g' % bound), bucket_count
+            yield '_bucket', OrderedDict(labels, le='+Inf'), count
+            yield '_sum', labels, total
+            yield '_count', labels, count
+
+
+class MetricsRegistry(object):
+    """
+    Process-level metrics, the observations are forwarded to the `sinks`,
+    e.g. the `StatsdSink`, and the current values are exported in the
+    Prometheus text format by `prometheus_text`.
+    """
+
+    def __init__(self, sinks=()):
+        self.sinks = list(sinks)
+        self._metrics = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _register(self, metric_class, name, *args, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = metric_class(name, *args, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def get_metric(self, name):
+        return self._metrics[name]
+
+    def inc(self, name, value=1, **labels):
+        self._metrics[name].inc(value, **labels)
+        for sink in self.sinks:
+            sink.inc(name, value, labels)
+
+    def observe(self, name, value, **labels):
+        self._metrics[name].observe(value, **labels)
+        for sink in self.sinks:
+            sink.observe(name, value, labels)
+
+    def collect(self):
+        return list(self._metrics.values())
+
+    def clear(self):
+        """Reset the values of the metrics."""
+        for metric in self.collect():
+            with metric._lock:
+                metric._values.clear()
+
+
+def escape_label_value(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def prometheus_text(registry):
+    """Return the metrics of the registry in the Prometheus text format."""
+    lines = []
+    for metric in registry.collect():
+        lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+        lines.append('# TYPE %s %s' % (metric.name, metric.type))
+        for suffix, labels, value in metric.samples():
+            if labels:
+                label_text = '{%s}' % ','.join(
+                    '%s="%s"' % (name, escape_label_value(label))
+                    for name, label in labels.items()
+                )
+            else:
+                label_text = ''
+            lines.append('%s%s%s %s' % (metric.name, suffix, label_text, repr(float(value))))
+    return '\n'.join(lines) + '\n'
+
+
+class StatsdSink(object):
+    """
+    Send the observations to statsd over UDP, the label values are appended
+    to the metric name, e.g. `es.es_requests_total.BlogView.search:1|c`.
+    """
+
+    def __init__(self, host='localhost', port=8125, prefix='es'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def get_name(self, name, labels):
+        parts = [self.prefix, name] if self.prefix else [name]
+        parts.extend(re.sub(r'[^\w-]', '_', six.text_type(labels[key]))
+                     for key in sorted(labels) if labels[key] not in (None, ''))
+        return '.'.join(parts)
+
+    def send(self, data):
+        try:
+            self._socket.sendto(data.encode('utf-8'), self.address)
+        except socket.error:
+            # Metrics must not break the requests
+            pass
+
+    def inc(self, name, value, labels):
+        self.send('%s:%g|c' % (self.get_name(name, labels), value))
+
+    def observe(self, name, value, labels):
+        self.send('%s:%g|h' % (self.get_name(name, labels), value))
+
+
+def get_error_label(error):
+    if isinstance(error, ConnectionTimeout):
+        return 'timeout'
+    return error.__class__.__name__
+
+
+class ElasticMetricsCollector(object):
+    """
+    Record the Elasticsearch requests of the library into the registry:
+    searches, counts and scans of the `TimedSearch` per view, the bulk
+    requests, and the hits and misses of the library caches.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        registry.counter('es_requests_total', 'Number of Elasticsearch requests.',
+                         ('view', 'operation'))
+        registry.counter('es_request_errors_total', 'Number of failed Elasticsearch requests.',
+                         ('view', 'operation', 'error'))
+        registry.histogram('es_request_duration_seconds', 'Latency of Elasticsearch requests.',
+                           ('view', 'operation'))
+        registry.histogram('es_took_seconds', 'Search time reported by Elasticsearch.',
+                           ('view', 'operation'))
+        registry.counter('es_hits_total', 'Number of the matched documents.',
+                         ('view', 'operation'))
+        registry.counter('es_bulk_documents_total', 'Number of the documents sent in bulk.',
+                         ('result',))
+        registry.counter('es_response_bytes_total', 'Size of Elasticsearch responses.',
+                         ('operation',))
+        registry.counter('es_cache_requests_total', 'Lookups in the library caches.',
+                         ('cache', 'result'))
+
+    def connect(self):
+        es_query_executed.connect(self.handle_query, weak=False,
+                                  dispatch_uid='es_metrics_query_%s' % id(self))
+        es_bulk_executed.connect(self.handle_bulk, weak=False,
+                                 dispatch_uid='es_metrics_bulk_%s' % id(self))
+        es_cache_accessed.connect(self.handle_cache, weak=False,
+                                  dispatch_uid='es_metrics_cache_%s' % id(self))
+
+    def disconnect(self):
+        es_query_executed.disconnect(dispatch_uid='es_metrics_query_%s' % id(self))
+        es_bulk_executed.disconnect(dispatch_uid='es_metrics_bulk_%s' % id(self))
+        es_cache_accessed.disconnect(dispatch_uid='es_metrics_cache_%s' % id(self))
+
+    def record_request(self, view, operation, duration, error=None):
+        labels = {'view': view or '', 'operation': operation}
+        self.registry.inc('es_requests_total', **labels)
+        self.registry.observe('es_request_duration_seconds', duration / 1000.0, **labels)
+        if error is not None:
+            self.registry.inc('es_request_errors_total', error=get_error_label(error), **labels)
+
+    def handle_query(self, sender, method, duration, took=None, hits=None, view=None,
+                     error=None, **kwargs):
+        self.record_request(view, method, duration, error)
+        labels = {'view': view or '', 'operation': method}
+        if took is not None:
+            self.registry.observe('es_took_seconds', took / 1000.0, **labels)
+        if hits:
+            self.registry.inc('es_hits_total', hits, **labels)
+
+    def handle_bulk(self, sender, duration, success, errors, error=None, **kwargs):
+        self.record_request(None, 'bulk', duration, error)
+        if success:
+            self.registry.inc('es_bulk_documents_total', success, result='success')
+        if errors:
+            self.registry.inc('es_bulk_documents_total', errors, result='error')
+
+    def handle_cache(self, sender, cache, hit, **kwargs):
+        self.registry.inc('es_cache_requests_total', cache=cache,
+                          result='hit' if hit else 'miss')
+
+
+def get_operation(method, path):
+    """Return the operation of a request path, e.g. 'search' of '/blog/_search'."""
+    for part in reversed(path.split('?', 1)[0].strip('/').split('/')):
+        if part.startswith('_') and part not in ('_doc', '_all'):
+            return part[1:]
+    return method.lower()
+
+
+registry = MetricsRegistry()
+collector = ElasticMetricsCollector(registry)
+
+
+class ElasticMetricsConnection(Urllib3HttpConnection):
+    """
+    Connection class which counts the bytes of the responses per operation,
+    pass it to the client with `connection_class`.
+    """
+    metrics_registry = registry
+
+    def log_request_success(self, method, full_url, path, body, status_code,
+                            response, duration):
+        if response is not None:
+            self.metrics_registry.inc('es_response_bytes_total',
+                                      len(response.encode('utf-8')),
+                                      operation=get_operation(method, path))
+        super(ElasticMetricsConnection, self).log_request_success(
+            method, full_url, path, body, status_code, response, duration)
+
+    def log_request_fail(self, method, full_url, path, body, duration,
+                         status_code=None, response=None, exception=None):
+        if response is not None:
+            self.metrics_registry.inc('es_response_bytes_total',
+                                      len(response.encode('utf-8')),
+                                      operation=get_operation(method, path))
+        super(ElasticMetricsConnection, self).log_request_fail(
+            method, full_url, path, body, duration, status_code, response, exception)
+
+
+def metrics_view(request):
+    """Export the metrics in the Prometheus text format."""
+    return HttpResponse(prometheus_text(registry),
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
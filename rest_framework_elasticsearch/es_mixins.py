@@ -1,7 +1,19 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, unicode_literals
 
+import json
+import logging
+import time
+from collections import OrderedDict
+from itertools import chain, islice
+
+from django.http import StreamingHttpResponse
+from django.utils.encoding import force_text
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.utils import encoders
+
+logger = logging.getLogger(__name__)
 
 
 class ListElasticMixin(object):
@@ -40,3 +52,146 @@ class ListElasticMixin(object):
             return self.get_paginated_response(self.es_representation(page))
 
         return Response(self.es_representation(search.scan()))
+
+
+class ReadYourWritesElasticMixin(object):
+    """
+    Patch the hits with the recent writes of the user,
+    `es_overlay` is the `ElasticWriteOverlay` used by the writes.
+    """
+    es_overlay = None
+
+    def get_es_overlay(self):
+        return self.es_overlay
+
+    def es_representation(self, iterable):
+        overlay = self.get_es_overlay()
+        if overlay is not None:
+            iterable = overlay.patch(self.request, iterable, self.es_model,
+                                     using=self.get_es_client(),
+                                     excludes=self.get_es_excludes_fields())
+        return super(ReadYourWritesElasticMixin, self).es_representation(iterable)
+
+
+class BulkIngestElasticMixin(object):
+    """
+    Index the documents of a NDJSON request body in bulk.
+
+    Each line is validated with the `ingest_serializer_class`, an
+    `ElasticSerializer`, and the valid documents are sent in chunks with
+    the bulk API. The next chunk is read from the request only when the
+    previous one is indexed, so the body is never held in memory and a slow
+    cluster slows the client down. The response is a NDJSON stream with
+    the result of each line.
+    """
+    ingest_serializer_class = None
+    # Options of the `ElasticBulkIndexer`
+    ingest_bulk_options = {}
+
+    def get_ingest_serializer_class(self):
+        assert self.ingest_serializer_class is not None, (
+            "'%s' should either include a `ingest_serializer_class` attribute, "
+            "or override the `get_ingest_serializer_class()` method."
+            % self.__class__.__name__
+        )
+        return self.ingest_serializer_class
+
+    def get_ingest_serializer(self, *args, **kwargs):
+        serializer_class = self.get_ingest_serializer_class()
+        kwargs['context'] = self.get_es_serializer_context()
+        return serializer_class(*args, **kwargs)
+
+    def get_ingest_bulk_indexer(self):
+        serializer = self.get_ingest_serializer([], many=True)
+        options = dict(self.ingest_bulk_options, raise_on_error=False)
+        return serializer.get_bulk_indexer(self.get_es_client(), **options)
+
+    def get_line_action(self, indexer, data):
+        """Return the bulk action of a line, `ValueError` is raised for invalid data."""
+        serializer = self.get_ingest_serializer(data=data)
+        document = serializer.es_instance()
+        document.full_clean()
+        return indexer.index_action(document)
+
+    def ingest(self, lines):
+        """Index the parsed (line_number, data, error) lines and yield the results."""
+        indexer = self.get_ingest_bulk_indexer()
+        client = indexer.get_client()
+        lines = iter(lines)
+        while True:
+            batch = list(islice(lines, indexer.chunk_size))
+            if not batch:
+                break
+            results = OrderedDict()
+            actions = []
+            for number, data, error in batch:
+                if error is None:
+                    try:
+                        actions.append(self.get_line_action(indexer, data))
+                        results[number] = None
+                        continue
+                    except ValidationError as exc:
+                        error = exc.detail
+                    except ValueError as exc:
+                        error = force_text(exc)
+                results[number] = {'line': number, 'status': 400, 'error': error}
+
+            sent = [number for number, result in results.items() if result is None]
+            for number, ok, info in self.send_actions(indexer, client, zip(sent, actions)):
+                result = results[number] = {
+                    'line': number, 'status': info.get('status'), '_id': info.get('_id')}
+                if not ok:
+                    result['error'] = info.get('error')
+            for result in results.values():
+                yield result
+
+    def send_actions(self, indexer, client, actions):
+        """
+        Send the (line_number, action) actions and yield the (line_number, ok, info)
+        results. The helper yields the retried actions after the others, so the
+        rejected actions are retried here and the results keep the order.
+        """
+        actions = list(actions)
+        attempt = 0
+        while actions:
+            retry = []
+            results = indexer.streaming(client, [action for _, action in actions], max_retries=0)
+            for (number, action), (ok, item) in zip(actions, results):
+                info = next(iter(item.values()))
+                if not ok and info.get('status') == 429 and attempt < indexer.max_retries:
+                    retry.append((number, action))
+                    continue
+                yield number, ok, info
+            actions = retry
+            if actions:
+                time.sleep(min(indexer.max_backoff, indexer.initial_backoff * 2 ** attempt))
+                attempt += 1
+
+    def stream_results(self, results):
+        """
+        Yield the NDJSON lines of the results and the final summary line, a
+        failure in the middle of the stream is reported in the summary.
+        """
+        summary = OrderedDict([('lines', 0), ('indexed', 0), ('failed', 0)])
+        record = {'summary': summary}
+        try:
+            for result in results:
+                summary['lines'] += 1
+                if result.get('error') is None:
+                    summary['indexed'] += 1
+                else:
+                    summary['failed'] += 1
+                yield json.dumps(result, cls=encoders.JSONEncoder) + '\n'
+        except Exception as exc:
+            # The status of the response is already sent
+            logger.exception('Bulk ingestion failed')
+            record['error'] = force_text(exc) or exc.__class__.__name__
+        yield json.dumps(record, cls=encoders.JSONEncoder) + '\n'
+
+    def create_bulk(self, request, *args, **kwargs):
+        results = self.ingest(request.data)
+        # The first chunk is indexed before the response is started, so the
+        # errors of the request or the cluster are handled by the view
+        first = list(islice(results, 1))
+        return StreamingHttpResponse(self.stream_results(chain(first, results)),
+                                     content_type='application/x-ndjson')
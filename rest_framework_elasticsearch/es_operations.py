@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import post_delete
+from django.utils import six
+from elasticsearch_dsl.connections import connections
+
+from .es_changes import forget_index_states
+from .es_indexing import ElasticIndexDispatcher
+
+
+class ElasticTaskError(Exception):
+    """A task of Elasticsearch failed."""
+
+    def __init__(self, task_id, error):
+        super(ElasticTaskError, self).__init__(
+            'Task %s failed: %s' % (task_id, error))
+        self.task_id = task_id
+        self.error = error
+
+
+def get_search_request(search):
+    """Return the (client, index, body) of the by-query request of the search."""
+    client = connections.get_connection(search._using or 'default')
+    index = ','.join(search._index) if search._index else '_all'
+    query = search.to_dict().get('query')
+    body = {'query': query} if query else {}
+    return client, index, body
+
+
+def wait_for_task(client, task_id, poll_interval=1.0, callback=None):
+    """
+    Poll the task until it's completed and return its response,
+    `callback(status)` is called with the task status after each poll.
+    """
+    while True:
+        task = client.tasks.get(task_id=task_id)
+        if callback is not None:
+            callback(task['task'].get('status', {}))
+        if task.get('completed'):
+            if 'error' in task:
+                raise ElasticTaskError(task_id, task['error'])
+            return task.get('response', {})
+        time.sleep(poll_interval)
+
+
+def run_by_query(method_name, search, body=None, wait_for_completion=False,
+                 poll_interval=1.0, callback=None, **params):
+    """
+    Execute the `*_by_query` API of the client for the search.
+
+    By default the request is started as a task which is polled every
+    `poll_interval` seconds, so a long operation does not hit the request
+    timeout. With `poll_interval=None` the task id is returned without
+    waiting, with `wait_for_completion=True` the request is synchronous.
+    """
+    client, index, request_body = get_search_request(search)
+    request_body.update(body or {})
+    method = getattr(client, method_name)
+    if wait_for_completion:
+        return method(index=index, body=request_body, wait_for_completion=True, **params)
+
+    task_id = method(index=index, body=request_body, wait_for_completion=False,
+                     **params)['task']
+    if poll_interval is None:
+        return task_id
+    return wait_for_task(client, task_id, poll_interval, callback)
+
+
+def delete_by_query(search, slices='auto', conflicts='proceed', **kwargs):
+    """
+    Delete the documents matched by the search with `_delete_by_query`,
+    the deletion is split into `slices` executed in parallel. Return the
+    response with the number of `deleted` documents and the `failures`.
+    Other keyword arguments are described in `run_by_query`.
+    """
+    return run_by_query('delete_by_query', search, slices=slices,
+                        conflicts=conflicts, **kwargs)
+
+
+class ElasticDeleteCollector(ElasticIndexDispatcher):
+    """
+    Dispatcher of `collect_deletes`, only the deletes of the thread which
+    is in its `suspended()` block are queued, keyword arguments are passed
+    to `ElasticListSerializer.delete_ids`.
+    """
+
+    def __init__(self, serializer_class, using=None, **delete_options):
+        super(ElasticDeleteCollector, self).__init__(using)
+        self.delete_options = delete_options
+        self.register(serializer_class.Meta.model, serializer_class, connect=False)
+
+    def handle_delete(self, sender, instance, using=None, **kwargs):
+        # The queue of the suspended block is local to its thread
+        if getattr(self._local, 'suspended', None) is not None:
+            super(ElasticDeleteCollector, self).handle_delete(sender, instance, using, **kwargs)
+
+    def flush_items(self, items, using=DEFAULT_DB_ALIAS):
+        by_model = OrderedDict()
+        for (model, pk), op in six.iteritems(items):
+            by_model.setdefault(model, []).append(pk)
+        for model, pks in six.iteritems(by_model):
+            self.get_serializer_class(model)([], many=True).delete_ids(
+                pks, using=self.using, **self.delete_options)
+
+
+@contextmanager
+def collect_deletes(serializer_class, using=None, **kwargs):
+    """
+    Collect the pks of the objects of the serializer model deleted by the
+    current thread and delete their documents with one bulk request when
+    the block exits, or when the transaction is committed, the deletes
+    of a rolled back transaction are dropped. Keyword arguments are passed
+    to `ElasticListSerializer.delete_ids`.
+
+        with collect_deletes(ElasticBlogSerializer):
+            Blog.objects.filter(is_published=False).delete()
+    """
+    model = serializer_class.Meta.model
+    collector = ElasticDeleteCollector(serializer_class, using, **kwargs)
+    dispatch_uid = 'es_collect_deletes_%s' % id(collector)
+    post_delete.connect(collector.handle_delete, sender=model, weak=False,
+                        dispatch_uid=dispatch_uid)
+    try:
+        with collector.suspended():
+            yield collector
+    finally:
+        post_delete.disconnect(sender=model, dispatch_uid=dispatch_uid)
+
+
+def update_by_query(search, script, params=None, lang='painless', slices='auto',
+                    conflicts='proceed', requests_per_second=None, **kwargs):
+    """
+    Update the documents matched by the search with a script of
+    `_update_by_query`, e.g. to rename a tag without re-serializing the
+    objects. The update is split into `slices` executed in parallel and
+    throttled to `requests_per_second`, the documents changed during
+    the update are skipped and counted in `version_conflicts`. The states
+    of the `ElasticChangeTracker` of the updated indices are removed when
+    the task is completed. With `poll_interval=None` they are removed when
+    the task is submitted, so the tracked writes during the task may store
+    states outdated by the script, remove them with `forget_index_states`
+    after `wait_for_task`. Other keyword arguments are described in
+    `run_by_query`.
+
+        update_by_query(
+            BlogIndex.search().filter('term', tags='django'),
+            'ctx._source.tags.removeIf(tag -> tag == params.old); '
+            'ctx._source.tags.add(params.new)',
+            params={'old': 'django', 'new': 'Django'}
+        )
+    """
+    body = {'script': {'source': script, 'lang': lang, 'params': params or {}}}
+    if requests_per_second is not None:
+        kwargs['requests_per_second'] = requests_per_second
+    try:
+        return run_by_query('update_by_query', search, body=body, slices=slices,
+                            conflicts=conflicts, **kwargs)
+    finally:
+        # A polled task is completed here, a fire-and-forget one was just submitted
+        for index in search._index or [None]:
+            forget_index_states(index)
@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+
+def set_options(instance, options):
+    """
+    Set the keyword arguments of a constructor as the attributes of the
+    instance, only the names of the class attributes are accepted.
+    """
+    for key, value in options.items():
+        if not hasattr(instance.__class__, key):
+            raise TypeError(
+                "%s() got an unexpected keyword argument '%s'" %
+                (instance.__class__.__name__, key)
+            )
+        setattr(instance, key, value)
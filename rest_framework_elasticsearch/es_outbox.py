@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import datetime
+import logging
+from collections import OrderedDict
+from functools import reduce
+from multiprocessing.pool import ThreadPool
+
+from django.apps import apps
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import six, timezone
+from django.utils.encoding import force_text
+from elasticsearch.helpers import BulkIndexError
+
+from .es_indexing import ElasticIndexDispatcher, ElasticSyncError, merge_op
+from .es_options import set_options
+
+logger = logging.getLogger(__name__)
+
+
+def get_outbox_model():
+    return apps.get_model('rest_framework_elasticsearch', 'ElasticOutbox')
+
+
+class ElasticOutboxDispatcher(ElasticIndexDispatcher):
+    """
+    Write changes of the registered models into the `ElasticOutbox` table
+    in the same transaction as the change. The rows are sent to
+    Elasticsearch by the `ElasticOutboxWorker`, so the writes don't wait
+    on Elasticsearch and the updates are not lost when it's unavailable.
+    """
+
+    def enqueue_many(self, items, using=None):
+        using = using or DEFAULT_DB_ALIAS
+        if getattr(self._local, 'suspended', None) is not None:
+            return super(ElasticOutboxDispatcher, self).enqueue_many(items, using)
+
+        outbox_model = get_outbox_model()
+        outbox_model.objects.using(using).bulk_create([
+            outbox_model(model=model._meta.label, object_pk=force_text(pk), op=op)
+            for (model, pk), op in six.iteritems(items)
+        ])
+
+
+class ElasticOutboxWorker(object):
+    """
+    Send the outbox rows to Elasticsearch in bulk.
+
+    A batch of available rows is leased for `lease` seconds, the rows are
+    coalesced per document and partitioned by the document between
+    `workers` threads, so the operations of a document are never sent
+    concurrently. Failed documents are retried with the exponential backoff.
+    """
+    batch_size = 500
+    workers = 4
+    # Seconds
+    lease = 300
+    backoff = 1
+    max_backoff = 600
+    # Drop the rows after the number of attempts, `None` to retry forever
+    max_attempts = None
+
+    def __init__(self, dispatcher, using=DEFAULT_DB_ALIAS, **options):
+        self.dispatcher = dispatcher
+        self.using = using
+        set_options(self, options)
+        self._pool = None
+
+    def get_pool(self):
+        if self._pool is None:
+            self._pool = ThreadPool(self.workers)
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def get_queryset(self):
+        return get_outbox_model().objects.using(self.using)
+
+    def claim(self):
+        """Lease and return a batch of the available rows."""
+        now = timezone.now()
+        with transaction.atomic(using=self.using):
+            queryset = self.get_queryset().filter(available_at__lte=now).order_by('id')
+            if connections[self.using].features.has_select_for_update_skip_locked:
+                queryset = queryset.select_for_update(skip_locked=True)
+            rows = list(queryset[:self.batch_size])
+            self.get_queryset().filter(id__in=[row.id for row in rows]).update(
+                available_at=now + datetime.timedelta(seconds=self.lease))
+        return rows
+
+    def coalesce(self, rows):
+        """Return {(model, object_pk): [rows]} in the order of the operations."""
+        documents = OrderedDict()
+        for row in rows:
+            documents.setdefault((row.model, row.object_pk), []).append(row)
+        return documents
+
+    def partition(self, documents):
+        partitions = [OrderedDict() for _ in range(self.workers)]
+        for key, rows in six.iteritems(documents):
+            partitions[hash(key) % self.workers][key] = rows
+        return [partition for partition in partitions if partition]
+
+    def process_batch(self):
+        """Process a batch of rows and return the number of the rows."""
+        rows = self.claim()
+        if not rows:
+            return 0
+
+        partitions = self.partition(self.coalesce(rows))
+        if len(partitions) == 1:
+            self.process_partition(partitions[0])
+        else:
+            self.get_pool().map(self.process_partition_in_thread, partitions)
+        return len(rows)
+
+    def process_partition_in_thread(self, documents):
+        try:
+            self.process_partition(documents)
+        finally:
+            # Database connections are opened per thread
+            connections.close_all()
+
+    def process_partition(self, documents):
+        by_model = OrderedDict()
+        for key, rows in six.iteritems(documents):
+            by_model.setdefault(key[0], OrderedDict())[key] = rows
+
+        for label, model_documents in six.iteritems(by_model):
+            model = apps.get_model(label)
+            items = OrderedDict()
+            for (_, object_pk), rows in six.iteritems(model_documents):
+                key = (model, model._meta.pk.to_python(object_pk))
+                items[key] = reduce(merge_op, [row.op for row in rows], None)
+            self.send(items, model_documents)
+
+    def send(self, items, documents):
+        """
+        Flush the {(model, pk): op} items of the {(label, object_pk): rows}
+        documents, the rows of the failed items are retried.
+        """
+        # The items are built in the order of the documents
+        keys = dict(zip(items, documents))
+        failed = {}
+        try:
+            self.dispatcher.flush_items(items, self.using)
+        except ElasticSyncError as exc:
+            info = next(iter(exc.errors[0].values()), {})
+            error = force_text(info.get('error'))
+            failed = dict((keys[key], error) for key in exc.items)
+        except BulkIndexError as exc:
+            # The failed items are unknown
+            failed = dict((key, force_text(exc)) for key in documents)
+        except Exception as exc:
+            logger.exception('Failed to send the outbox rows')
+            failed = dict((key, force_text(exc)) for key in documents)
+
+        done = [row.id for key, rows in six.iteritems(documents)
+                if key not in failed for row in rows]
+        self.get_queryset().filter(id__in=done).delete()
+        for key, rows in six.iteritems(documents):
+            if key in failed:
+                self.retry(rows, failed[key])
+
+    def retry(self, rows, error):
+        attempts = max(row.attempts for row in rows) + 1
+        ids = [row.id for row in rows]
+        if self.max_attempts is not None and attempts >= self.max_attempts:
+            logger.error('Drop outbox rows %s after %d attempts: %s', ids, attempts, error)
+            self.get_queryset().filter(id__in=ids).delete()
+            return
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempts - 1))
+        self.get_queryset().filter(id__in=ids).update(
+            attempts=attempts,
+            last_error=error,
+            available_at=timezone.now() + datetime.timedelta(seconds=delay)
+        )
+
+
+outbox_dispatcher = ElasticOutboxDispatcher()
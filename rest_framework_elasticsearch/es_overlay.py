@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import time
+
+from django.core.cache import caches
+from django.utils import six
+from django.utils.encoding import force_text
+
+from .es_options import set_options
+
+
+class ElasticWriteOverlay(object):
+    """
+    Show the recent writes of a user before the index is refreshed.
+
+    The ids of the documents written by a request are remembered in the
+    Django cache for `timeout` seconds per user, or per session for the
+    anonymous users. The hits of the remembered documents in the list
+    responses of that user are replaced by the realtime `mget` results and
+    the deleted ones are removed, so the index keeps a long refresh interval.
+    With `wait_for` set the writes of the overlay are sent with
+    `refresh='wait_for'` instead, they wait for the next refresh.
+
+    Only the hits are patched, a created document which is not refreshed
+    yet is not found by the search and the total is not changed.
+    """
+    # Seconds, longer than the refresh interval of the index
+    timeout = 30
+    cache_alias = 'default'
+    key_prefix = 'es_overlay'
+    wait_for = False
+
+    def __init__(self, **options):
+        set_options(self, options)
+
+    def get_cache(self):
+        return caches[self.cache_alias]
+
+    def get_key(self, request):
+        """Return the cache key of the writer, `None` when it's unknown."""
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return '%s:user:%s' % (self.key_prefix, user.pk)
+        session = getattr(request, 'session', None)
+        if session is not None and session.session_key:
+            return '%s:session:%s' % (self.key_prefix, session.session_key)
+        return None
+
+    def get_writes(self, request):
+        """Return {index: {id: (expires_at, deleted)}} of the unexpired writes."""
+        key = self.get_key(request)
+        if key is None:
+            return {}
+        now = time.time()
+        writes = self.get_cache().get(key) or {}
+        return dict(
+            (index, dict((pk, value) for pk, value in six.iteritems(ids) if value[0] > now))
+            for index, ids in six.iteritems(writes)
+        )
+
+    def remember(self, request, index, ids, deleted=False):
+        """Remember the written document ids of the index."""
+        key = self.get_key(request)
+        if key is None:
+            return
+        writes = self.get_writes(request)
+        expires_at = time.time() + self.timeout
+        written = writes.setdefault(index, {})
+        for pk in ids:
+            written[force_text(pk)] = (expires_at, deleted)
+        self.get_cache().set(key, writes, self.timeout)
+
+    def get_save_options(self):
+        return {'refresh': 'wait_for'} if self.wait_for else {}
+
+    def save(self, request, serializer, using=None, index=None, **kwargs):
+        """Save the document of the `ElasticSerializer` and remember it."""
+        kwargs = dict(self.get_save_options(), **kwargs)
+        serializer.save(using=using, index=index, **kwargs)
+        if not self.wait_for:
+            document = serializer.es_instance()
+            self.remember(request, document._get_index(index), [document.meta.id])
+
+    def delete(self, request, serializer, using=None, index=None, **kwargs):
+        """Delete the document of the `ElasticSerializer` and remember it."""
+        kwargs = dict(self.get_save_options(), **kwargs)
+        serializer.delete(using=using, index=index, **kwargs)
+        if not self.wait_for:
+            document = serializer.es_instance()
+            self.remember(request, document._get_index(index), [document.meta.id],
+                          deleted=True)
+
+    def patch(self, request, hits, es_model, using=None, index=None, excludes=None):
+        """
+        Return the hits with the recently written documents replaced
+        by their realtime versions, the deleted documents are removed.
+        The `excludes` fields are removed from the sources like by the search.
+        """
+        index = es_model()._get_index(index)
+        written = self.get_writes(request).get(index)
+        if not written:
+            return hits
+
+        hits = list(hits)
+        ids = [force_text(hit.meta.id) for hit in hits
+               if force_text(hit.meta.id) in written and
+               not written[force_text(hit.meta.id)][1]]
+        current = {}
+        if ids:
+            options = {'_source_excludes': list(excludes)} if excludes else {}
+            documents = es_model.mget(ids, using=using, index=index, missing='none', **options)
+            current = dict(zip(ids, documents))
+
+        patched = []
+        for hit in hits:
+            pk = force_text(hit.meta.id)
+            if pk not in written:
+                patched.append(hit)
+            elif current.get(pk) is not None:
+                patched.append(current[pk])
+        return patched
@@ -7,6 +7,33 @@ from rest_framework.exceptions import NotFound
 from rest_framework.pagination import LimitOffsetPagination, PageNumberPagination
 
 
+def get_page_window(paginator, request):
+    """
+    Return the (start, stop) window of hits requested from the DRF paginator,
+    or `None` if it can't be determined before the pagination.
+    """
+    if isinstance(paginator, LimitOffsetPagination):
+        limit = paginator.get_limit(request)
+        if limit is None:
+            return None
+        offset = paginator.get_offset(request)
+        return offset, offset + limit
+
+    if isinstance(paginator, PageNumberPagination):
+        page_size = paginator.get_page_size(request)
+        if not page_size:
+            return None
+        try:
+            page_number = int(request.query_params.get(paginator.page_query_param, 1))
+        except (TypeError, ValueError):
+            return None
+        if page_number < 1:
+            return None
+        return (page_number - 1) * page_size, page_number * page_size
+
+    return None
+
+
 class ElasticLimitOffsetPagination(LimitOffsetPagination):
     default_limit = 10
 
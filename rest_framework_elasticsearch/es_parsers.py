@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import json
+
+from django.conf import settings
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    """
+    Parse a newline delimited JSON request body lazily.
+
+    The parsed data is a generator of (line_number, data, error) tuples
+    which reads the stream line by line, so the body is never loaded
+    into memory as a whole. `error` is set for the lines which are not
+    JSON objects, blank lines are skipped.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        return self.parse_lines(stream, encoding)
+
+    def parse_lines(self, stream, encoding):
+        for number, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                data = json.loads(line.decode(encoding))
+            except ValueError as exc:
+                yield number, None, 'JSON parse error - %s' % exc
+                continue
+            if not isinstance(data, dict):
+                yield number, None, 'Expected a JSON object'
+                continue
+            yield number, data, None
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from django.utils import six
+
+from .es_signals import es_cache_accessed
+
+
+def get_hits_total(response):
+    """Return the total number of hits of the search response."""
+    total = response.hits.total
+    # Elasticsearch 7 returns an object with `value` and `relation` keys
+    if not isinstance(total, six.integer_types):
+        total = total['value']
+    return total
+
+
+def default_representation(iterable):
+    return [item.to_dict() for item in iterable]
+
+
+class ElasticQuerySet(object):
+    """
+    A lazy wrapper of the `Search` object with the QuerySet-like interface.
+
+    Slicing is mapped to the from/size parameters, so the search is executed
+    only for the requested window. Executed windows and the total number
+    of hits are memoized, a window which is inside of a fetched one
+    does not hit Elasticsearch again.
+    """
+    batch_size = 500
+
+    def __init__(self, search, representation=None, batch_size=None):
+        self.search = search
+        self.representation = representation or default_representation
+        if batch_size is not None:
+            self.batch_size = batch_size
+        self._windows = {}
+        self._count = None
+        self._prefetch = None
+
+    def prefetch(self, start, stop):
+        """
+        Set the window fetched by `count()` when the total is unknown,
+        it allows to answer count and the following slice with one request.
+        """
+        self._prefetch = (start, stop)
+        return self
+
+    def _fetch(self, start, stop):
+        window = self._windows.get((start, stop))
+        if window is not None:
+            es_cache_accessed.send(sender=self.__class__, cache='queryset', hit=True)
+            return window
+
+        for (w_start, w_stop), items in six.iteritems(self._windows):
+            if w_start <= start and stop <= w_stop:
+                es_cache_accessed.send(sender=self.__class__, cache='queryset', hit=True)
+                return items[start - w_start:stop - w_start]
+
+        es_cache_accessed.send(sender=self.__class__, cache='queryset', hit=False)
+        response = self.search[start:stop].execute()
+        self._count = get_hits_total(response)
+        window = self._windows[(start, stop)] = self.representation(response)
+        return window
+
+    def count(self):
+        """Return the number of hits, the cached total is used if exists."""
+        es_cache_accessed.send(sender=self.__class__, cache='queryset_count',
+                               hit=self._count is not None)
+        if self._count is None:
+            if self._prefetch is not None:
+                self._fetch(*self._prefetch)
+            else:
+                self._count = self.search.count()
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            if k.step is not None:
+                raise ValueError("ElasticQuerySet does not support slicing with a step.")
+            if (k.start or 0) < 0 or (k.stop is not None and k.stop < 0):
+                raise ValueError("ElasticQuerySet does not support negative slicing.")
+            start = k.start or 0
+            stop = k.stop if k.stop is not None else self.count()
+            if stop <= start:
+                return []
+            return self._fetch(start, stop)
+
+        if k < 0:
+            raise ValueError("ElasticQuerySet does not support negative indexing.")
+        items = self._fetch(k, k + 1)
+        if not items:
+            raise IndexError('ElasticQuerySet index out of range')
+        return items[0]
+
+    def __iter__(self):
+        """Iterate over all hits, fetching them by `batch_size` windows."""
+        start = 0
+        while True:
+            items = self._fetch(start, start + self.batch_size)
+            for item in items:
+                yield item
+            start += self.batch_size
+            if len(items) < self.batch_size or start >= self.count():
+                break
+
+    def iterator(self):
+        """
+        Iterate over all hits using the scroll API, unlike the iteration
+        over the ElasticQuerySet the hits are not cached and the number
+        of hits is not limited by the `index.max_result_window` setting.
+        """
+        batch = []
+        for hit in self.search.params(size=self.batch_size).scan():
+            batch.append(hit)
+            if len(batch) == self.batch_size:
+                for item in self.representation(batch):
+                    yield item
+                batch = []
+        for item in self.representation(batch):
+            yield item
+
+    def __repr__(self):
+        return '<%s: %r>' % (self.__class__.__name__, self.search.to_dict())
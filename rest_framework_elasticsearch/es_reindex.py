@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import re
+import time
+
+from django.db import connections as db_connections
+from django.db.models import Max, Min
+from django.utils import six
+from elasticsearch.exceptions import NotFoundError
+from elasticsearch.helpers import parallel_bulk
+from elasticsearch_dsl.connections import connections
+
+from .es_options import set_options
+
+
+def init_worker():
+    """Prepare a worker process of the reindex pool."""
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+    # Connections inherited from the parent process can't be shared
+    db_connections.close_all()
+
+
+def index_range(args):
+    """Index the objects with `start <= pk < stop`, executed in a worker process."""
+    reindexer, start, stop = args
+    result = reindexer.index_range(start, stop)
+    return start, stop, result
+
+
+class ReindexProgress(object):
+    """Throughput and ETA of a reindex."""
+
+    def __init__(self, total, done=0):
+        self.total = total
+        self.done = done
+        self.initial = done
+        self.errors = 0
+        self.started_at = time.time()
+
+    def add(self, success, errors):
+        self.done += success + errors
+        self.errors += errors
+
+    @property
+    def rate(self):
+        elapsed = time.time() - self.started_at
+        return (self.done - self.initial) / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        rate = self.rate
+        if not rate:
+            return None
+        return max(self.total - self.done, 0) / rate
+
+    def __str__(self):
+        eta = self.eta
+        return '%d/%d documents, %d errors, %.1f docs/s, ETA %s' % (
+            self.done, self.total, self.errors, self.rate,
+            '%.0fs' % eta if eta is not None else '-'
+        )
+
+
+class ElasticReindexer(object):
+    """
+    Rebuild an index from the database in parallel.
+
+    The queryset of the `ElasticModelSerializer` model is split into pk
+    ranges which are indexed by a process pool. Each process iterates its
+    range in chunks and sends the documents with `parallel_bulk`. Completed
+    ranges are stored in the `state_file`, so a reindex can be resumed.
+    """
+    # Number of pks in a range processed by one task
+    range_size = 10000
+    # Number of documents sent in one bulk request
+    chunk_size = 500
+    # Number of processes, `None` to use the number of CPUs
+    processes = None
+    # Number of bulk threads per process
+    thread_count = 2
+
+    def __init__(self, serializer_class, using=None, index=None, state_file=None,
+                 **options):
+        self.serializer_class = serializer_class
+        # Elasticsearch connection alias, the clients can't be passed to processes
+        self.using = using
+        self.index = index
+        self.state_file = state_file
+        set_options(self, options)
+
+    def get_queryset(self):
+        return self.serializer_class.Meta.model._default_manager.all()
+
+    def get_ranges(self):
+        """
+        Return the list of (start, stop) pk ranges, the ranges are aligned
+        to `range_size` so they don't change when new objects are added.
+        """
+        bounds = self.get_queryset().aggregate(min=Min('pk'), max=Max('pk'))
+        if bounds['min'] is None:
+            return []
+        if not isinstance(bounds['min'], six.integer_types):
+            raise ValueError('Reindex by ranges requires an integer primary key')
+        first = bounds['min'] - bounds['min'] % self.range_size
+        return [(start, start + self.range_size)
+                for start in range(first, bounds['max'] + 1, self.range_size)]
+
+    def read_state(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return {}
+        with io.open(self.state_file, encoding='utf-8') as f:
+            return json.load(f)
+
+    def load_state(self):
+        return [tuple(item) for item in self.read_state().get('completed', [])]
+
+    def save_state(self, completed):
+        if not self.state_file:
+            return
+        state = {'completed': sorted(completed), 'index': self.index}
+        tmp_file = self.state_file + '.tmp'
+        with io.open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(state, ensure_ascii=False))
+        os.rename(tmp_file, self.state_file)
+
+    def clear_state(self):
+        if self.state_file and os.path.exists(self.state_file):
+            os.remove(self.state_file)
+
+    def get_actions(self, queryset, indexer):
+        serializer = self.serializer_class(many=True)
+        if not queryset._prefetch_related_lookups:
+            queryset = queryset.iterator()
+        for instance in queryset:
+            yield indexer.index_action(serializer.child.es_repr(instance), self.index)
+
+    def index_range(self, start, stop):
+        """Index a range and return the (success, errors) tuple."""
+        queryset = self.serializer_class.get_es_queryset(
+            self.get_queryset().filter(pk__gte=start, pk__lt=stop).order_by('pk'))
+        indexer = self.serializer_class(many=True).get_bulk_indexer(self.using)
+        success = errors = 0
+        client = connections.get_connection(self.using or 'default')
+        for ok, item in parallel_bulk(client, self.get_actions(queryset, indexer),
+                                      thread_count=self.thread_count,
+                                      chunk_size=self.chunk_size,
+                                      raise_on_error=False):
+            op_type, info = next(iter(item.items()))
+            if ok or indexer.is_ok(op_type, info):
+                success += 1
+            else:
+                errors += 1
+        return success, errors
+
+    def run(self, resume=False, callback=None):
+        """
+        Reindex all ranges and return the `ReindexProgress`,
+        `callback(progress)` is called after each completed range.
+        """
+        completed = set(self.load_state()) if resume else set()
+        if not resume:
+            self.save_state(completed)
+
+        ranges = [item for item in self.get_ranges() if item not in completed]
+        queryset = self.get_queryset()
+        total = queryset.count()
+        done = sum(queryset.filter(pk__gte=start, pk__lt=stop).count()
+                   for start, stop in completed) if completed else 0
+        progress = ReindexProgress(total, done)
+        if not ranges:
+            return progress
+
+        pool = self.get_pool()
+        try:
+            tasks = [(self, start, stop) for start, stop in ranges]
+            for start, stop, (success, errors) in pool.imap_unordered(index_range, tasks):
+                progress.add(success, errors)
+                completed.add((start, stop))
+                self.save_state(completed)
+                if callback is not None:
+                    callback(progress)
+        finally:
+            pool.close()
+            pool.join()
+        self.forget_change_states()
+        return progress
+
+    def get_pool(self):
+        """Return the pool of the worker processes which index the ranges."""
+        # Forked processes must not share database connections
+        db_connections.close_all()
+        return multiprocessing.Pool(self.processes, initializer=init_worker)
+
+    def forget_change_states(self):
+        """
+        Remove the states of the `ElasticChangeTracker`, the documents are
+        rewritten without it, so the states may not match them anymore.
+        """
+        tracker = self.serializer_class(many=True).child.get_change_tracker(self.index)
+        if tracker is not None:
+            tracker.clear()
+
+
+class ElasticAliasReindexer(ElasticReindexer):
+    """
+    Rebuild an index without downtime.
+
+    The documents are loaded into a new versioned index `<alias>-<timestamp>`,
+    the alias is the index name of the `es_model`. The new index is created
+    without replicas and refreshes, when it's loaded the settings are
+    restored, the index is force merged, refreshed and warmed up, then the
+    alias is moved to it in one atomic request. Only `keep` previous
+    versions are retained, they allow to roll back the swap.
+
+    The changes written to the alias during the rebuild are not in the new
+    index, they should be replayed after the swap, e.g. by the outbox.
+    """
+    # Alias name, by default the index name of the `es_model`
+    alias = None
+    # Number of the previous indices retained after the swap
+    keep = 1
+    # Settings of the index while it's loaded, restored before the swap
+    load_settings = {'number_of_replicas': 0, 'refresh_interval': '-1'}
+    max_num_segments = 1
+    # Timeout of the force merge in seconds
+    request_timeout = 3600
+    # Swap the alias when the number of failed documents is not above it
+    max_errors = 0
+    # Delete the index named as the alias, it is replaced by the alias
+    replace_index = False
+
+    def get_es_model(self):
+        return self.serializer_class.Meta.es_model
+
+    def get_alias(self):
+        return self.alias or self.get_es_model()._index._name
+
+    def get_client(self):
+        return connections.get_connection(self.using or 'default')
+
+    def get_index_name(self, alias):
+        return '%s-%s' % (alias, datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S%f'))
+
+    def get_index(self, name):
+        return self.get_es_model()._index.clone(name, using=self.using)
+
+    def get_versioned_indices(self, alias):
+        """Return the versioned indices of the alias from the oldest."""
+        pattern = re.compile(r'^%s-\d{20}$' % re.escape(alias))
+        indices = self.get_client().indices.get(index='%s-*' % alias)
+        return sorted(name for name in indices if pattern.match(name))
+
+    def get_alias_indices(self, alias):
+        try:
+            return list(self.get_client().indices.get_alias(name=alias))
+        except NotFoundError:
+            return []
+
+    def is_concrete_index(self, alias):
+        client = self.get_client()
+        return (client.indices.exists(index=alias) and
+                not client.indices.exists_alias(name=alias))
+
+    def create_index(self, name):
+        index = self.get_index(name)
+        index.settings(**self.load_settings)
+        index.create()
+        return index
+
+    def restore_settings(self, name):
+        # `None` resets a setting to the default value
+        defaults = self.get_es_model()._index._settings
+        settings = dict((key, defaults.get(key)) for key in self.load_settings)
+        self.get_index(name).put_settings(body={'index': settings})
+
+    def get_warmup_searches(self, name):
+        """Return the searches executed on the new index before the swap."""
+        return [self.get_es_model().search(using=self.using, index=name)[:0]]
+
+    def warm_up(self, name):
+        for search in self.get_warmup_searches(name):
+            search.execute()
+
+    def swap(self, alias, name):
+        """Point the alias to the `name` index in one atomic request."""
+        actions = [{'remove': {'index': index, 'alias': alias}}
+                   for index in self.get_alias_indices(alias) if index != name]
+        if self.is_concrete_index(alias):
+            actions.append({'remove_index': {'index': alias}})
+        actions.append({'add': {'index': name, 'alias': alias}})
+        self.get_client().indices.update_aliases(body={'actions': actions})
+
+    def prune(self, alias):
+        """Delete the previous indices except the last `keep` ones."""
+        live = set(self.get_alias_indices(alias))
+        previous = [index for index in self.get_versioned_indices(alias)
+                    if index not in live]
+        deleted = previous[:-self.keep] if self.keep else previous
+        for index in deleted:
+            self.get_client().indices.delete(index=index)
+        return deleted
+
+    def forget_change_states(self):
+        # The tracked writes use the alias
+        tracker = self.serializer_class(many=True).child.get_change_tracker(self.get_alias())
+        if tracker is not None:
+            tracker.clear()
+
+    def finalize(self, alias, name):
+        self.restore_settings(name)
+        index = self.get_index(name)
+        index.forcemerge(max_num_segments=self.max_num_segments,
+                         request_timeout=self.request_timeout)
+        index.refresh()
+        self.warm_up(name)
+        self.swap(alias, name)
+        self.prune(alias)
+
+    def run(self, resume=False, callback=None):
+        """Load a new index, swap the alias and return the `ReindexProgress`."""
+        alias = self.get_alias()
+        if self.is_concrete_index(alias) and not self.replace_index:
+            raise ValueError(
+                "'%s' is an index, set replace_index to replace it "
+                "with the alias" % alias
+            )
+
+        name = self.read_state().get('index') if resume else None
+        if not name or not self.get_client().indices.exists(index=name):
+            name = self.get_index_name(alias)
+            self.create_index(name)
+            resume = False
+        self.index = name
+
+        progress = super(ElasticAliasReindexer, self).run(resume, callback)
+        if progress.errors > self.max_errors:
+            raise ValueError(
+                "%d documents failed to index, the alias '%s' is not swapped "
+                "to '%s'" % (progress.errors, alias, name)
+            )
+        self.finalize(alias, name)
+        # The writes between the load and the swap stored the states of the old index
+        self.forget_change_states()
+        self.clear_state()
+        return progress
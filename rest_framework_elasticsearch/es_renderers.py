@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from django.utils.timezone import utc
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+def to_columnar(items):
+    """Convert a list of hits into a columnar structure.
+
+    Field names are listed once and the values are stored as parallel
+    arrays, so ``columns[i][n]`` is the value of ``fields[i]`` for the
+    n-th hit. Missing values are filled with ``None``.
+    """
+    fields = []
+    columns = []
+    positions = {}
+    for row, item in enumerate(items):
+        for key, value in item.items():
+            position = positions.get(key)
+            if position is None:
+                position = positions[key] = len(fields)
+                fields.append(key)
+                columns.append([None] * row)
+            columns[position].append(value)
+        size = row + 1
+        for column in columns:
+            if len(column) < size:
+                column.append(None)
+    return {'fields': fields, 'columns': columns}
+
+
+class ColumnarRendererMixin(object):
+    """
+    Render a list of hits, or the `results` of a paginated
+    envelope, as columns.
+    """
+    results_field = 'results'
+
+    def get_columnar_data(self, data):
+        if isinstance(data, list):
+            return to_columnar(data)
+        if isinstance(data, dict) and isinstance(data.get(self.results_field), list):
+            data = data.copy()
+            data[self.results_field] = to_columnar(data[self.results_field])
+        return data
+
+
+class ColumnarJSONRenderer(ColumnarRendererMixin, JSONRenderer):
+    """
+    Renderer which serializes hits to JSON columns, ``?format=columnar``.
+    """
+    media_type = 'application/vnd.columnar+json'
+    format = 'columnar'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return super(ColumnarJSONRenderer, self).render(
+            self.get_columnar_data(data), accepted_media_type, renderer_context
+        )
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Renderer which serializes to MessagePack, ``?format=msgpack``.
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+    encoder_class = encoders.JSONEncoder
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        assert msgpack is not None, 'msgpack must be installed to use `MessagePackRenderer`'
+        if data is None:
+            return bytes()
+        return msgpack.packb(data, default=self.encoder_class().default,
+                             use_bin_type=True)
+
+
+class CBORRenderer(BaseRenderer):
+    """
+    Renderer which serializes to CBOR, ``?format=cbor``.
+    """
+    media_type = 'application/cbor'
+    format = 'cbor'
+    charset = None
+    render_style = 'binary'
+    encoder_class = encoders.JSONEncoder
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        assert cbor2 is not None, 'cbor2 must be installed to use `CBORRenderer`'
+        if data is None:
+            return bytes()
+        default = self.encoder_class().default
+        return cbor2.dumps(
+            data, timezone=utc,
+            default=lambda encoder, value: encoder.encode(default(value))
+        )
+
+
+# Extra renderers for list views, the binary ones are
+# available only when their packages are installed.
+ES_RENDERER_CLASSES = (ColumnarJSONRenderer,)
+if msgpack is not None:
+    ES_RENDERER_CLASSES += (MessagePackRenderer,)
+if cbor2 is not None:
+    ES_RENDERER_CLASSES += (CBORRenderer,)
@@ -1,10 +1,66 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, unicode_literals
 
+import calendar
+import datetime
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+from collections import OrderedDict
+
+from django.utils import six, timezone
+from django.utils.dateparse import parse_datetime
+from elasticsearch.exceptions import ConflictError
 from rest_framework import serializers
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject
+from rest_framework.serializers import LIST_SERIALIZER_KWARGS
+
+from .es_bulk import ElasticBulkIndexer
+from .es_changes import ElasticChangeTracker
+
+
+def get_version_number(value):
+    """
+    Convert the value of a version field to the integer version,
+    datetimes are converted to microseconds since the epoch.
+    """
+    if isinstance(value, six.string_types):
+        value = parse_datetime(value) or value
+    if isinstance(value, datetime.datetime):
+        if timezone.is_aware(value):
+            value = timezone.make_naive(value, timezone.utc)
+        return calendar.timegm(value.timetuple()) * 1000000 + value.microsecond
+    if isinstance(value, datetime.date):
+        return calendar.timegm(value.timetuple()) * 1000000
+    return int(value)
 
 
 class BaseElasticSerializer(object):
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        """
+        Create the `ElasticListSerializer` parent class when `many=True`
+        is used, unless `Meta.list_serializer_class` is set.
+        """
+        allow_empty = kwargs.pop('allow_empty', None)
+        child_serializer = cls(*args, **kwargs)
+        list_kwargs = {
+            'child': child_serializer,
+        }
+        if allow_empty is not None:
+            list_kwargs['allow_empty'] = allow_empty
+        list_kwargs.update({
+            key: value for key, value in kwargs.items()
+            if key in LIST_SERIALIZER_KWARGS
+        })
+        meta = getattr(cls, 'Meta', None)
+        list_serializer_class = getattr(meta, 'list_serializer_class',
+                                        ElasticListSerializer)
+        return list_serializer_class(*args, **list_kwargs)
+
     def es_instance(self):
         raise NotImplementedError
 
@@ -15,13 +71,144 @@ class BaseElasticSerializer(object):
             )
         return self.Meta.es_model
 
+    def get_es_meta(self, pk, obj):
+        """
+        Return the document meta, with `Meta.es_version_field` set the
+        version of the object is indexed with the `Meta.es_version_type`
+        ('external' by default or 'external_gte'), so a stale write never
+        overwrites a newer one.
+        """
+        meta = dict(id=pk)
+        field = getattr(getattr(self, 'Meta', None), 'es_version_field', None)
+        if field is None:
+            return meta
+        value = obj.get(field) if isinstance(obj, Mapping) else getattr(obj, field)
+        if value is not None:
+            meta['version'] = get_version_number(value)
+            meta['version_type'] = getattr(self.Meta, 'es_version_type', 'external')
+        return meta
+
+    def get_bulk_options(self):
+        """Return the options of the `ElasticBulkIndexer`."""
+        meta = getattr(self, 'Meta', None)
+        options = {}
+        if getattr(meta, 'es_version_field', None) is not None:
+            # A newer version is already indexed
+            options['skip_conflicts'] = True
+        options.update(getattr(meta, 'es_bulk_options', {}))
+        return options
+
+    def get_change_tracker(self, index=None):
+        """
+        Return the `ElasticChangeTracker` if `Meta.es_track_changes` is set,
+        changes of the `Meta.es_ignore_change_fields` alone are not written.
+        """
+        meta = getattr(self, 'Meta', None)
+        if not getattr(meta, 'es_track_changes', False):
+            return None
+        return ElasticChangeTracker(
+            self.get_es_model()()._get_index(index),
+            ignore_fields=getattr(meta, 'es_ignore_change_fields', ())
+        )
+
     def save(self, using=None, index=None, validate=True, **kwargs):
         instance = self.es_instance()
-        instance.save(using=using, index=index, validate=validate, **kwargs)
+        tracker = self.get_change_tracker(index)
+        if tracker is not None:
+            ElasticBulkIndexer(using, **self.get_bulk_options()).index_changes(
+                [instance], tracker, index=index, validate=validate, **kwargs)
+            return
+        try:
+            instance.save(using=using, index=index, validate=validate, **kwargs)
+        except ConflictError:
+            # A newer version is already indexed
+            if 'version' not in instance.meta:
+                raise
 
     def delete(self, using=None, index=None, **kwargs):
         instance = self.es_instance()
+        # The version of a deleted object is not newer than the indexed one
+        for key in ('version', 'version_type'):
+            if key in instance.meta:
+                del instance.meta[key]
         instance.delete(using=using, index=index, **kwargs)
+        tracker = self.get_change_tracker(index)
+        if tracker is not None:
+            tracker.forget([instance.meta.id])
+
+
+class ElasticListSerializer(serializers.ListSerializer):
+    """
+    Save and delete a list of documents with the bulk API.
+
+    Options of the `ElasticBulkIndexer` are taken from the `es_bulk_options`
+    dict of the child serializer Meta and the keyword arguments of `save`
+    and `delete`, other keyword arguments are passed to `Elasticsearch.bulk`.
+    """
+    bulk_indexer_class = ElasticBulkIndexer
+
+    def get_bulk_indexer(self, using=None, **options):
+        bulk_options = self.child.get_bulk_options()
+        bulk_options.update(options)
+        return self.bulk_indexer_class(using=using, **bulk_options)
+
+    def pop_bulk_options(self, kwargs):
+        names = self.bulk_indexer_class.get_option_names()
+        return dict((key, kwargs.pop(key)) for key in list(kwargs) if key in names)
+
+    def es_instances(self):
+        """Return a generator of the documents."""
+        if self.instance is not None:
+            instances = self.instance
+            # Iterate over a queryset without caching of the whole result
+            if hasattr(instances, 'iterator') and \
+                    not getattr(instances, '_prefetch_related_lookups', None):
+                instances = instances.iterator()
+            for instance in instances:
+                yield self.child.es_repr(instance)
+        else:
+            if not self.is_valid():
+                raise serializers.ValidationError(self.errors)
+            for data in self.data:
+                yield self.child.es_repr(dict(data))
+
+    def save(self, using=None, index=None, validate=True, **kwargs):
+        indexer = self.get_bulk_indexer(using, **self.pop_bulk_options(kwargs))
+        tracker = self.child.get_change_tracker(index)
+        if tracker is not None:
+            return indexer.index_changes(self.es_instances(), tracker, index=index,
+                                         validate=validate, **kwargs)
+        return indexer.index(self.es_instances(), index=index,
+                             validate=validate, **kwargs)
+
+    def delete(self, using=None, index=None, **kwargs):
+        indexer = self.get_bulk_indexer(using, **self.pop_bulk_options(kwargs))
+        tracker = self.child.get_change_tracker(index)
+        if tracker is None:
+            return indexer.delete(self.es_instances(), index=index, **kwargs)
+
+        deleted = []
+
+        def documents():
+            for document in self.es_instances():
+                deleted.append(document.meta.id)
+                yield document
+
+        try:
+            return indexer.delete(documents(), index=index, **kwargs)
+        finally:
+            tracker.forget(deleted)
+
+    def delete_ids(self, ids, using=None, index=None, **kwargs):
+        """Delete the documents by ids."""
+        indexer = self.get_bulk_indexer(using, **self.pop_bulk_options(kwargs))
+        tracker = self.child.get_change_tracker(index)
+        try:
+            return indexer.delete_ids(self.child.get_es_model(), ids,
+                                      index=index, **kwargs)
+        finally:
+            if tracker is not None:
+                tracker.forget(ids)
 
 
 class ElasticSerializer(BaseElasticSerializer,
@@ -35,7 +222,7 @@ class ElasticSerializer(BaseElasticSerializer,
             )
 
     def es_repr(self, data):
-        data['meta'] = dict(id=self.get_es_instace_pk(data))
+        data['meta'] = self.get_es_meta(self.get_es_instace_pk(data), data)
         model = self.get_es_model()
         return model(**data)
 
@@ -47,12 +234,28 @@ class ElasticSerializer(BaseElasticSerializer,
 
 class ElasticModelSerializer(BaseElasticSerializer,
                              serializers.ModelSerializer):
+    @classmethod
+    def get_es_queryset(cls, queryset):
+        """
+        Return the queryset of the indexed objects, related objects listed in
+        `Meta.es_select_related` and `Meta.es_prefetch_related` are loaded
+        with the objects instead of a query per object.
+        """
+        meta = getattr(cls, 'Meta', None)
+        select_related = getattr(meta, 'es_select_related', ())
+        prefetch_related = getattr(meta, 'es_prefetch_related', ())
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        return queryset
+
     def get_es_instace_pk(self, instance):
         return instance.pk
 
     def es_repr(self, instance):
         data = self.to_representation(instance)
-        data['meta'] = dict(id=self.get_es_instace_pk(instance))
+        data['meta'] = self.get_es_meta(self.get_es_instace_pk(instance), instance)
         model = self.get_es_model()
         return model(**data)
 
@@ -60,3 +263,86 @@ class ElasticModelSerializer(BaseElasticSerializer,
         if not self.instance:
             raise ValueError("Can't reproduce object")
         return self.es_repr(self.instance)
+
+
+# Converters of the field types which `to_representation` can be called
+# without the field instance, `None` means that the value is returned as is.
+FAST_CONVERTERS = {
+    serializers.CharField: six.text_type,
+    serializers.IntegerField: int,
+    serializers.FloatField: float,
+    serializers.ReadOnlyField: None,
+}
+# A marker of the fields represented by the bound field instance
+BOUND_FIELD = object()
+_missing = object()
+
+
+class ElasticHitSerializer(serializers.Serializer):
+    """
+    A read-only serializer of Elasticsearch hits.
+
+    The fields are declared as in a DRF `Serializer`, but the field list
+    is compiled once per class into a flat list of (name, key, converter)
+    items. The top-level keys of a hit dictionary are read directly and
+    the simple field types are converted without the `Field` machinery,
+    other fields fall back to the DRF behavior, so the output is
+    identical to the equivalent `Serializer`.
+    """
+
+    @classmethod
+    def compile_fields(cls, fields):
+        compiled = []
+        for field in fields:
+            if field.write_only:
+                continue
+            key = None
+            if len(field.source_attrs) == 1 and not isinstance(
+                    field, serializers.SerializerMethodField):
+                key = field.source_attrs[0]
+            converter = FAST_CONVERTERS.get(type(field), BOUND_FIELD)
+            compiled.append((field.field_name, key, converter))
+        return tuple(compiled)
+
+    def get_compiled_fields(self):
+        cls = self.__class__
+        if '_compiled_fields' not in cls.__dict__:
+            cls._compiled_fields = cls.compile_fields(self.fields.values())
+        return cls._compiled_fields
+
+    @property
+    def compiled_plan(self):
+        if not hasattr(self, '_compiled_plan'):
+            fields = self.fields
+            plan = []
+            for field_name, key, converter in self.get_compiled_fields():
+                field = fields[field_name]
+                if converter is BOUND_FIELD:
+                    converter = field.to_representation
+                plan.append((field_name, key, converter, field))
+            self._compiled_plan = plan
+        return self._compiled_plan
+
+    def to_representation(self, instance):
+        if not isinstance(instance, Mapping):
+            return super(ElasticHitSerializer, self).to_representation(instance)
+
+        ret = OrderedDict()
+        for field_name, key, converter, field in self.compiled_plan:
+            attribute = _missing if key is None else instance.get(key, _missing)
+            if attribute is _missing:
+                # Nested sources, method fields, defaults and missing values
+                try:
+                    attribute = field.get_attribute(instance)
+                except SkipField:
+                    continue
+                if isinstance(attribute, PKOnlyObject) and attribute.pk is None:
+                    attribute = None
+
+            if attribute is None:
+                ret[field_name] = None
+            elif converter is None:
+                ret[field_name] = attribute
+            else:
+                ret[field_name] = converter(attribute)
+        return ret
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from django.dispatch import Signal
+
+# Sent after each request of a `TimedSearch` to Elasticsearch, `method` is
+# one of 'search', 'count' and 'scan', `duration` and `took` are milliseconds,
+# `view` is the name of the view and `params` are the query parameters of
+# its request, `error` is the raised exception or `None`
+es_query_executed = Signal(providing_args=['search', 'method', 'duration', 'took',
+                                           'hits', 'view', 'params', 'error'])
+
+# Sent after each bulk request of an `ElasticBulkIndexer`, `duration`
+# is milliseconds, `success` and `errors` are numbers of the documents,
+# `error` is the raised exception or `None`
+es_bulk_executed = Signal(providing_args=['indexer', 'duration', 'success', 'errors',
+                                          'error'])
+
+# Sent on each lookup in a cache of the library, e.g. the fetched windows
+# of the `ElasticQuerySet`, `hit` is `True` when the value was cached
+es_cache_accessed = Signal(providing_args=['cache', 'hit'])
+
+# Sent by `ElasticAPIView` when the response is finalized, `timings` is
+# the `RequestTimer.to_dict()` payload
+es_request_timed = Signal(providing_args=['view', 'request', 'response', 'timings'])
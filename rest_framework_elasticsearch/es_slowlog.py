@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import hashlib
+import json
+import logging
+import time
+
+from django.core.cache import caches
+from django.utils import six
+
+from .es_options import set_options
+from .es_signals import es_query_executed
+
+logger = logging.getLogger(__name__)
+
+# Keys with the values which are the structure of the query, not literals
+STRUCTURAL_KEYS = frozenset([
+    '_source', 'distance_type', 'excludes', 'field', 'fields', 'includes',
+    'mode', 'operator', 'order', 'path', 'sort', 'type', 'unit',
+])
+
+PLACEHOLDER = '?'
+
+
+def normalize_query(value, key=None):
+    """
+    Replace the literals of a query body by placeholders, the lists of
+    literals are replaced by one placeholder, so the queries which differ
+    only by the values or the number of the filtered values are the same.
+    """
+    if key in STRUCTURAL_KEYS:
+        return value
+    if isinstance(value, dict):
+        return dict((k, normalize_query(v, k)) for k, v in six.iteritems(value))
+    if isinstance(value, (list, tuple)):
+        items = [normalize_query(item) for item in value]
+        if all(item == PLACEHOLDER for item in items):
+            return [PLACEHOLDER] if items else []
+        return items
+    return PLACEHOLDER
+
+
+def get_fingerprint(body):
+    """Return the (fingerprint, normalized body) of a search body."""
+    normalized = normalize_query(body)
+    data = json.dumps(normalized, sort_keys=True)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()[:16], normalized
+
+
+class ElasticSlowQueryLog(object):
+    """
+    Log the requests of a `TimedSearch` slower than `threshold`.
+
+    A slow request is logged with the view, the fingerprint of its body,
+    the duration, the `took`, the number of hits and the query parameters
+    of the view request. The `top_size` slowest fingerprints are kept in
+    the Django cache with their counts and durations, the cache must be
+    shared by the processes to list them with the `es_slow_queries` command.
+    """
+    # Milliseconds
+    threshold = 500
+    top_size = 50
+    cache_alias = 'default'
+    cache_key = 'es_slowlog:top'
+
+    def __init__(self, **options):
+        set_options(self, options)
+
+    def get_cache(self):
+        return caches[self.cache_alias]
+
+    def connect(self):
+        es_query_executed.connect(self.handle_query, weak=False,
+                                  dispatch_uid='es_slowlog_%s' % id(self))
+
+    def disconnect(self):
+        es_query_executed.disconnect(dispatch_uid='es_slowlog_%s' % id(self))
+
+    def handle_query(self, sender, search, method, duration, took=None, hits=None,
+                     view=None, params=None, error=None, **kwargs):
+        if duration < self.threshold:
+            return
+        fingerprint, normalized = get_fingerprint(search.to_dict())
+        logger.warning(
+            'Slow Elasticsearch %s %.1fms (took %sms) view=%s hits=%s fingerprint=%s '
+            'params=%s query=%s',
+            method, duration, took, view, hits, fingerprint,
+            json.dumps(params or {}, sort_keys=True), json.dumps(normalized, sort_keys=True),
+            extra={'es_slow_query': {
+                'method': method, 'duration': duration, 'took': took, 'hits': hits,
+                'view': view, 'params': params, 'fingerprint': fingerprint,
+                'query': normalized,
+            }}
+        )
+        self.record(fingerprint, normalized, method, duration, view, params)
+
+    def record(self, fingerprint, query, method, duration, view=None, params=None):
+        """Add a slow request to the top table."""
+        cache = self.get_cache()
+        top = cache.get(self.cache_key) or {}
+        entry = top.get(fingerprint)
+        if entry is None:
+            entry = top[fingerprint] = {
+                'fingerprint': fingerprint, 'method': method, 'query': query,
+                'views': [], 'params': [], 'count': 0, 'total': 0, 'max': 0,
+            }
+        entry['count'] += 1
+        entry['total'] += duration
+        entry['max'] = max(entry['max'], duration)
+        entry['last_seen'] = time.time()
+        if view and view not in entry['views']:
+            entry['views'].append(view)
+        names = sorted(params or ())
+        if names and names not in entry['params']:
+            # Names of the parameters, e.g. the combination of the filters
+            entry['params'].append(names)
+
+        if len(top) > self.top_size:
+            for key in sorted(top, key=lambda key: top[key]['max'])[:len(top) - self.top_size]:
+                del top[key]
+        cache.set(self.cache_key, top, None)
+
+    def get_top(self, sort='max', limit=None):
+        """Return the slowest fingerprints ordered by 'max', 'total' or 'count'."""
+        top = sorted((self.get_cache().get(self.cache_key) or {}).values(),
+                     key=lambda entry: entry[sort], reverse=True)
+        return top[:limit] if limit else top
+
+    def clear(self):
+        self.get_cache().delete(self.cache_key)
+
+
+slow_query_log = ElasticSlowQueryLog()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import datetime
+import json
+
+from django.apps import apps
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import DateTimeField, Q
+from django.utils import timezone
+from django.utils.encoding import force_text
+
+from .es_options import set_options
+
+
+def get_watermark_model():
+    return apps.get_model('rest_framework_elasticsearch', 'ElasticSyncWatermark')
+
+
+class WatermarkEncoder(DjangoJSONEncoder):
+    """JSON encoder which keeps microseconds, the value is compared exactly."""
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super(WatermarkEncoder, self).default(o)
+
+
+class ElasticWatermarkSync(object):
+    """
+    Index the objects changed since the last run.
+
+    Objects are read in chunks ordered by the watermark `field`, e.g.
+    `updated_at`, and the pk, the position after the last indexed object
+    is stored in the `ElasticSyncWatermark` table when the chunk is sent.
+    A failed run is continued from the last stored position and indexing
+    a chunk again is harmless, so the sync can be executed any number of
+    times. It catches the changes made without signals, but not deletions.
+    """
+    chunk_size = 1000
+    # Seconds, the objects changed later than `now - lag` are synced by
+    # the next run. `auto_now` values are set before the commit, so a row
+    # committed more than `lag` seconds after its value was set is skipped
+    lag = 5
+
+    def __init__(self, serializer_class, field='updated_at', name=None,
+                 using=None, index=None, database=DEFAULT_DB_ALIAS, **options):
+        self.serializer_class = serializer_class
+        self.field = field
+        self.name = name or '%s.%s:%s' % (serializer_class.__module__,
+                                          serializer_class.__name__, field)
+        # Elasticsearch connection alias
+        self.using = using
+        self.index = index
+        self.database = database
+        set_options(self, options)
+
+    @property
+    def model(self):
+        return self.serializer_class.Meta.model
+
+    def get_queryset(self):
+        return self.model._default_manager.using(self.database).all()
+
+    def get_watermark_queryset(self):
+        return get_watermark_model().objects.using(self.database).filter(name=self.name)
+
+    def get_watermark(self):
+        """Return the (value, pk) of the last indexed object, or `(None, None)`."""
+        watermark = self.get_watermark_queryset().first()
+        if watermark is None:
+            return None, None
+        field = self.model._meta.get_field(self.field)
+        return (field.to_python(json.loads(watermark.value)),
+                self.model._meta.pk.to_python(watermark.last_pk))
+
+    def set_watermark(self, value, pk):
+        get_watermark_model().objects.using(self.database).update_or_create(
+            name=self.name,
+            defaults={'value': json.dumps(value, cls=WatermarkEncoder),
+                      'last_pk': force_text(pk)}
+        )
+
+    def reset(self):
+        """Sync all objects on the next run."""
+        self.get_watermark_queryset().delete()
+
+    def get_chunk(self, value, pk):
+        queryset = self.get_queryset()
+        if value is not None:
+            queryset = queryset.filter(
+                Q(**{'%s__gt' % self.field: value}) |
+                Q(**{self.field: value, 'pk__gt': pk})
+            )
+        if self.lag and isinstance(self.model._meta.get_field(self.field), DateTimeField):
+            until = timezone.now() - datetime.timedelta(seconds=self.lag)
+            queryset = queryset.filter(**{'%s__lte' % self.field: until})
+        queryset = self.serializer_class.get_es_queryset(queryset)
+        return list(queryset.order_by(self.field, 'pk')[:self.chunk_size])
+
+    def sync_chunk(self):
+        """Index the next chunk and return the number of objects."""
+        value, pk = self.get_watermark()
+        instances = self.get_chunk(value, pk)
+        if not instances:
+            return 0
+        self.serializer_class(instances, many=True).save(using=self.using, index=self.index)
+        last = instances[-1]
+        self.set_watermark(getattr(last, self.field), last.pk)
+        return len(instances)
+
+    def run(self, callback=None):
+        """
+        Index all changed objects and return their number,
+        `callback(count)` is called after each chunk.
+        """
+        total = 0
+        while True:
+            count = self.sync_chunk()
+            if not count:
+                return total
+            total += count
+            if callback is not None:
+                callback(total)
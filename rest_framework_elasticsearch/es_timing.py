@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.utils import six
+from elasticsearch_dsl import Search
+
+from .es_signals import es_query_executed
+
+
+class RequestTimer(object):
+    """Durations of the phases of a request in milliseconds."""
+
+    def __init__(self, name=None, params=None):
+        # Name of the view, e.g. the label of the metrics
+        self.name = name
+        # Query parameters of the request
+        self.params = params
+        self.started_at = time.time()
+        self.phases = []
+        # The last executed `TimedSearch`
+        self.last_search = None
+
+    def add(self, name, duration, **info):
+        phase = OrderedDict([('name', name), ('duration', duration)])
+        phase.update(info)
+        self.phases.append(phase)
+        return phase
+
+    @contextmanager
+    def phase(self, name, **info):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, (time.time() - start) * 1000, **info)
+
+    def get_totals(self):
+        """Return {name: total duration} of the phases in order."""
+        totals = OrderedDict()
+        for phase in self.phases:
+            totals[phase['name']] = totals.get(phase['name'], 0) + phase['duration']
+            if phase.get('took') is not None:
+                totals['es-took'] = totals.get('es-took', 0) + phase['took']
+        return totals
+
+    def get_total(self):
+        return (time.time() - self.started_at) * 1000
+
+    def to_header(self):
+        """Return the value of the `Server-Timing` header."""
+        metrics = ['%s;dur=%.1f' % (name, duration)
+                   for name, duration in self.get_totals().items()]
+        metrics.append('total;dur=%.1f' % self.get_total())
+        return ', '.join(metrics)
+
+    def to_dict(self):
+        return {
+            'total': self.get_total(),
+            'phases': [dict(phase) for phase in self.phases],
+        }
+
+
+class TimedSearch(Search):
+    """
+    `Search` which measures its requests to Elasticsearch.
+
+    Each request is added to the `timer` as the 'es' phase with the `took`
+    reported by Elasticsearch, parsing of the hits into documents as the
+    'hydrate' phase, and the `es_query_executed` signal is sent.
+    """
+
+    def __init__(self, timer=None, **kwargs):
+        super(TimedSearch, self).__init__(**kwargs)
+        self._timer = timer
+
+    def _clone(self):
+        s = super(TimedSearch, self)._clone()
+        s._timer = self._timer
+        return s
+
+    def timer(self, timer):
+        s = self._clone()
+        s._timer = timer
+        return s
+
+    def _record(self, method, duration, took=None, hits=None, error=None):
+        if self._timer is not None:
+            self._timer.add('es', duration, method=method, took=took)
+        es_query_executed.send(sender=self.__class__, search=self, method=method,
+                               duration=duration, took=took, hits=hits,
+                               view=getattr(self._timer, 'name', None),
+                               params=getattr(self._timer, 'params', None), error=error)
+
+    @contextmanager
+    def _record_error(self, method):
+        start = time.time()
+        try:
+            yield
+        except Exception as exc:
+            self._record(method, (time.time() - start) * 1000, error=exc)
+            raise
+
+    def execute(self, ignore_cache=False):
+        if not ignore_cache and hasattr(self, '_response'):
+            return self._response
+        start = time.time()
+        with self._record_error('search'):
+            response = super(TimedSearch, self).execute(ignore_cache)
+        if self._timer is not None:
+            self._timer.last_search = self
+        total = response.hits.total if 'hits' in response else None
+        if total is not None and not isinstance(total, six.integer_types):
+            total = total['value']
+        self._record('search', (time.time() - start) * 1000, response.took, total)
+        start = time.time()
+        # Hits are parsed on the first access
+        response.hits
+        if self._timer is not None:
+            self._timer.add('hydrate', (time.time() - start) * 1000)
+        return response
+
+    def count(self):
+        if hasattr(self, '_response'):
+            return super(TimedSearch, self).count()
+        start = time.time()
+        with self._record_error('count'):
+            count = super(TimedSearch, self).count()
+        self._record('count', (time.time() - start) * 1000, hits=count)
+        return count
+
+    def scan(self):
+        """Iterate over the hits, only the time spent in the scroll requests is measured."""
+        hits = super(TimedSearch, self).scan()
+        duration = 0
+        count = 0
+        error = None
+        try:
+            while True:
+                start = time.time()
+                try:
+                    hit = next(hits)
+                except StopIteration:
+                    break
+                except Exception as exc:
+                    error = exc
+                    raise
+                finally:
+                    duration += time.time() - start
+                count += 1
+                yield hit
+        finally:
+            self._record('scan', duration * 1000, hits=count, error=error)
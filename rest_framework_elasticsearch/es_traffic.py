@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import io
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter
+from multiprocessing.pool import ThreadPool
+
+from django.utils import six
+from django.utils.module_loading import import_string
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from .es_options import set_options
+from .es_signals import es_cache_accessed, es_query_executed, es_request_timed
+
+REDACTED = 'redacted'
+
+# Header of the replayed requests, they are not recorded again
+REPLAY_HEADER = 'HTTP_X_ES_TRAFFIC_REPLAY'
+
+# Values which look like the personal data
+REDACT_PATTERNS = (
+    # Emails
+    r'[\w.+-]+@[\w-]+\.[\w.-]+',
+    # Card and phone numbers, 9 digits and more, so the dates are kept
+    r'\+?\d(?:[ ()-]?\d){8,}',
+)
+
+
+class ElasticTrafficRecorder(object):
+    """
+    Write the requests of the `ElasticAPIView` views to an NDJSON file,
+    one line per request with the dotted path of the view, the path, the
+    URL kwargs and the query parameters, the status and the duration.
+
+    A `sample_rate` part of the requests is recorded. The parameters
+    whose names contain one of `exclude_params` are dropped, only
+    `include_params` are kept when it is set, and the matches of
+    `redact_patterns` in the values are replaced by `REDACTED`. The
+    patterns are applied to the path and the URL kwargs as well, the
+    kwargs named like `exclude_params` are replaced whole.
+    """
+    path = 'es_traffic.ndjson'
+    sample_rate = 1.0
+    methods = ('GET',)
+    # Names of the view classes, all views are recorded when it is `None`
+    views = None
+    include_params = None
+    exclude_params = ('password', 'token', 'secret', 'api_key', 'apikey', 'auth',
+                      'session', 'email', 'phone')
+    redact_patterns = REDACT_PATTERNS
+
+    def __init__(self, **options):
+        set_options(self, options)
+        self._lock = threading.Lock()
+
+    def connect(self):
+        es_request_timed.connect(self.handle_request, weak=False,
+                                 dispatch_uid='es_traffic_%s' % id(self))
+
+    def disconnect(self):
+        es_request_timed.disconnect(dispatch_uid='es_traffic_%s' % id(self))
+
+    def is_excluded(self, name):
+        lower = name.lower()
+        return any(part in lower for part in self.exclude_params)
+
+    def redact(self, value):
+        for pattern in self.redact_patterns:
+            value = re.sub(pattern, REDACTED, value)
+        return value
+
+    def strip_params(self, params):
+        """Return the query parameters {name: [values]} without the personal data."""
+        stripped = {}
+        for name, values in six.iteritems(params):
+            if self.include_params is not None and name not in self.include_params:
+                continue
+            if self.is_excluded(name):
+                continue
+            stripped[name] = [self.redact(value) for value in values]
+        return stripped
+
+    def strip_kwargs(self, kwargs):
+        """Return the URL kwargs without the personal data."""
+        stripped = {}
+        for name, value in six.iteritems(kwargs):
+            if self.is_excluded(name):
+                value = REDACTED
+            elif isinstance(value, six.string_types):
+                value = self.redact(value)
+            stripped[name] = value
+        return stripped
+
+    def should_record(self, view, request):
+        if request.method not in self.methods or request.META.get(REPLAY_HEADER):
+            return False
+        if self.views is not None and view.__class__.__name__ not in self.views:
+            return False
+        return random.random() < self.sample_rate
+
+    def handle_request(self, sender, view, request, response, timings, **kwargs):
+        if not self.should_record(view, request):
+            return
+        self.write({
+            'view': '%s.%s' % (view.__class__.__module__, view.__class__.__name__),
+            'path': self.redact(request.path),
+            'kwargs': self.strip_kwargs(getattr(view, 'kwargs', None) or {}),
+            'params': self.strip_params(dict(request.query_params.lists())),
+            'status': response.status_code,
+            'duration': timings['total'],
+            'timestamp': time.time(),
+        })
+
+    def write(self, entry):
+        line = json.dumps(entry, sort_keys=True)
+        with self._lock:
+            with io.open(self.path, 'a', encoding='utf-8') as f:
+                f.write(six.text_type(line) + '\n')
+
+
+def load_traffic(path):
+    """Return the entries of a file written by `ElasticTrafficRecorder`."""
+    with io.open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def get_percentile(values, percent):
+    """Return the nearest-rank percentile of the sorted values."""
+    if not values:
+        return None
+    index = int(math.ceil(percent / 100.0 * len(values))) - 1
+    return values[min(max(index, 0), len(values) - 1)]
+
+
+class TrafficReport(object):
+    """Results of a replay, the durations are milliseconds."""
+
+    def __init__(self):
+        self.durations = []
+        self.statuses = Counter()
+        self.errors = Counter()
+        self.es_queries = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.elapsed = 0
+
+    def add(self, duration, status=None, error=None):
+        self.durations.append(duration)
+        if error is not None:
+            self.errors[error.__class__.__name__] += 1
+        else:
+            self.statuses[status] += 1
+
+    @property
+    def requests(self):
+        return len(self.durations)
+
+    @property
+    def throughput(self):
+        """Requests per second."""
+        return self.requests / self.elapsed if self.elapsed else 0
+
+    def to_dict(self):
+        durations = sorted(self.durations)
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            'requests': self.requests,
+            'errors': sum(self.errors.values()) + sum(
+                count for status, count in self.statuses.items() if status >= 400),
+            'elapsed': self.elapsed,
+            'throughput': self.throughput,
+            'latency': {
+                'mean': sum(durations) / len(durations) if durations else None,
+                'p50': get_percentile(durations, 50),
+                'p90': get_percentile(durations, 90),
+                'p99': get_percentile(durations, 99),
+                'max': durations[-1] if durations else None,
+            },
+            'statuses': dict(self.statuses),
+            'exceptions': dict(self.errors),
+            'es_queries': self.es_queries,
+            'cache_hit_ratio': float(self.cache_hits) / lookups if lookups else None,
+        }
+
+
+class ElasticTrafficReplayer(object):
+    """
+    Replay the recorded requests against the views with `concurrency` threads.
+
+    `es_client` replaces the client of the views, e.g. a client of another
+    cluster or of the in-memory engine, `view_options` overrides the
+    attributes of the views, e.g. `es_pagination_class`, and `params`
+    overrides the query parameters, e.g. `{'limit': '50'}`, to compare
+    the settings with the same traffic.
+    """
+    concurrency = 4
+    repeat = 1
+    es_client = None
+    view_options = {}
+    params = {}
+    # Authenticated user of the requests, anonymous when it is `None`
+    user = None
+
+    def __init__(self, **options):
+        set_options(self, options)
+        self.factory = APIRequestFactory()
+        self._views = {}
+        self._lock = threading.Lock()
+
+    def get_view(self, name):
+        """Return the view function of the dotted path of a view class."""
+        if name not in self._views:
+            initkwargs = dict(self.view_options)
+            if self.es_client is not None:
+                initkwargs['es_client'] = self.es_client
+            self._views[name] = import_string(name).as_view(**initkwargs)
+        return self._views[name]
+
+    def get_request(self, entry):
+        params = dict(entry.get('params') or {})
+        params.update(self.params)
+        request = self.factory.get(entry['path'], params, **{REPLAY_HEADER: '1'})
+        if self.user is not None:
+            force_authenticate(request, self.user)
+        return request
+
+    def replay(self, entry):
+        """Execute one entry, return the (duration, status, error)."""
+        view = self.get_view(entry['view'])
+        request = self.get_request(entry)
+        start = time.time()
+        try:
+            response = view(request, **(entry.get('kwargs') or {}))
+            render = getattr(response, 'render', None)
+            if callable(render) and not getattr(response, 'is_rendered', True):
+                response.render()
+        except Exception as e:
+            return (time.time() - start) * 1000, None, e
+        return (time.time() - start) * 1000, response.status_code, None
+
+    def handle_query(self, sender, **kwargs):
+        with self._lock:
+            self._report.es_queries += 1
+
+    def handle_cache(self, sender, hit, **kwargs):
+        with self._lock:
+            if hit:
+                self._report.cache_hits += 1
+            else:
+                self._report.cache_misses += 1
+
+    def run(self, entries):
+        """Replay the entries `repeat` times and return the `TrafficReport`."""
+        report = self._report = TrafficReport()
+        uid = 'es_traffic_replay_%s' % id(self)
+        es_query_executed.connect(self.handle_query, weak=False, dispatch_uid=uid)
+        es_cache_accessed.connect(self.handle_cache, weak=False, dispatch_uid=uid)
+        pool = ThreadPool(self.concurrency)
+        start = time.time()
+        try:
+            for result in pool.imap_unordered(self.replay, list(entries) * self.repeat):
+                report.add(*result)
+        finally:
+            report.elapsed = time.time() - start
+            pool.close()
+            pool.join()
+            es_query_executed.disconnect(dispatch_uid=uid)
+            es_cache_accessed.disconnect(dispatch_uid=uid)
+        return report
+
+
+traffic_recorder = ElasticTrafficRecorder()
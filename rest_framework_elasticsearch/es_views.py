@@ -4,12 +4,18 @@ from __future__ import absolute_import, unicode_literals
 from django.core.exceptions import ImproperlyConfigured
 from elasticsearch import Elasticsearch
 from elasticsearch_dsl import Search
-from rest_framework import views
+from rest_framework import permissions, views
+from rest_framework.settings import api_settings
 
 from .es_filters import ElasticSearchFilter
 from .es_inspector import EsAutoSchema
-from .es_mixins import ListElasticMixin
-from .es_pagination import ElasticLimitOffsetPagination
+from .es_mixins import BulkIngestElasticMixin, ListElasticMixin
+from .es_pagination import ElasticLimitOffsetPagination, get_page_window
+from .es_parsers import NDJSONParser
+from .es_queryset import ElasticQuerySet
+from .es_renderers import ES_RENDERER_CLASSES
+from .es_signals import es_request_timed
+from .es_timing import RequestTimer, TimedSearch
 
 
 class ElasticAPIView(views.APIView):
@@ -17,9 +23,91 @@ class ElasticAPIView(views.APIView):
     es_client = None
     es_model = None
     es_filter_backends = (ElasticSearchFilter,)
+    es_serializer_class = None
+    es_search_class = TimedSearch
+    # Add the `Server-Timing` header with the durations of the phases,
+    # it exposes the internal timings to the clients
+    es_server_timing = False
+    # Allow the authorized users to profile the search with `?__profile=1`
+    es_profile = False
+    es_profile_param = '__profile'
+    es_profile_permission_classes = (permissions.IsAdminUser,)
 
     schema = EsAutoSchema()
 
+    def get_es_timer(self):
+        """Return the `RequestTimer` of the current request."""
+        if getattr(self, '_es_timer', None) is None:
+            self._es_timer = RequestTimer(self.__class__.__name__)
+        return self._es_timer
+
+    def initial(self, request, *args, **kwargs):
+        self._es_timer = RequestTimer(self.__class__.__name__,
+                                      dict(request.query_params.items()))
+        super(ElasticAPIView, self).initial(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(ElasticAPIView, self).finalize_response(
+            request, response, *args, **kwargs)
+        timer = self.get_es_timer()
+        if timer.last_search is not None and self.is_es_profile_requested(request):
+            self.add_es_profile(response, timer.last_search)
+        if getattr(response, 'is_rendered', True):
+            self.send_es_timings(request, response, timer)
+        else:
+            self.time_es_render(request, response, timer)
+        return response
+
+    def time_es_render(self, request, response, timer):
+        """
+        Measure the rendering of the response when the handler renders it,
+        so the template response middleware can still change it.
+        """
+        def render():
+            # The response is pickled by the cache middleware after rendering
+            del response.render
+            with timer.phase('render'):
+                response.render()
+            self.send_es_timings(request, response, timer)
+            return response
+
+        response.render = render
+
+    def send_es_timings(self, request, response, timer):
+        if self.es_server_timing:
+            response['Server-Timing'] = timer.to_header()
+        es_request_timed.send(sender=self.__class__, view=self, request=request,
+                              response=response, timings=timer.to_dict())
+
+    def is_es_profile_requested(self, request):
+        if not self.es_profile:
+            return False
+        if request.query_params.get(self.es_profile_param) not in ('1', 'true'):
+            return False
+        return all(permission().has_permission(request, self)
+                   for permission in self.es_profile_permission_classes)
+
+    def get_es_profile(self, search):
+        """
+        Execute the search again with `profile` and return the request body
+        with the per-shard timings of the query clauses.
+        """
+        # Executed by `Search` without the hooks of `TimedSearch`, so the
+        # profiling is not recorded in the timings, metrics and slow log
+        response = Search.execute(search.extra(profile=True), ignore_cache=True)
+        return {
+            'request': search.to_dict(),
+            'profile': response.to_dict().get('profile'),
+        }
+
+    def add_es_profile(self, response, search):
+        data = getattr(response, 'data', None)
+        if data is None or getattr(response, 'exception', False):
+            return
+        if not isinstance(data, dict):
+            data = response.data = {'results': data}
+        data['es_profile'] = self.get_es_profile(search)
+
     def get_es_search_fields(self):
         """
         Return field or fields used for search.
@@ -99,30 +187,70 @@ class ElasticAPIView(views.APIView):
             raise ImproperlyConfigured(msg % self.__class__.__name__)
         index = self.es_model()._get_index()
         es_client = self.get_es_client()
-        s = Search(using=es_client, index=index, doc_type=self.es_model)
+        s = self.es_search_class(using=es_client, index=index, doc_type=self.es_model)
+        if isinstance(s, TimedSearch):
+            s = s.timer(self.get_es_timer())
         return s
 
     def do_search(self):
-        search = self.filter_search(self.get_es_search())
-        search = self.excludes_respond_fields(search)
+        search = self.get_es_search()
+        with self.get_es_timer().phase('filter'):
+            search = self.filter_search(search)
+            search = self.excludes_respond_fields(search)
         return search
 
+    def get_es_serializer_class(self):
+        """
+        Return the class used to represent hits, or `None`
+        to return the hits as they are stored.
+        """
+        return self.es_serializer_class
+
+    def get_es_serializer_context(self):
+        return {
+            'request': getattr(self, 'request', None),
+            'view': self
+        }
+
+    def get_es_serializer(self, *args, **kwargs):
+        serializer_class = self.get_es_serializer_class()
+        kwargs['context'] = self.get_es_serializer_context()
+        return serializer_class(*args, **kwargs)
+
     def es_representation(self, iterable):
         """List of object instances."""
-        return [item.to_dict() for item in iterable]
+        with self.get_es_timer().phase('representation'):
+            data = [item.to_dict() for item in iterable]
+            if self.get_es_serializer_class() is None:
+                return data
+            return self.get_es_serializer(data, many=True).data
 
     def get_queryset(self):
         """
-        Get the list of elastic items for this view.
-        This must be an iterable, and all items must be represented.
+        Get the lazy list of elastic items for this view.
+        Slicing the result executes a bounded search and all
+        items are represented.
         """
-        search = self.do_search()
-        return self.es_representation(search)
+        queryset = ElasticQuerySet(self.do_search(), self.es_representation)
+        # Let the count request of a DRF paginator fetch the requested page
+        window = get_page_window(getattr(self, 'paginator', None), self.request)
+        if window is not None:
+            queryset.prefetch(*window)
+        return queryset
 
 
 class ListElasticAPIView(ListElasticMixin, ElasticAPIView):
     """Concrete view for listing a queryset."""
     es_pagination_class = ElasticLimitOffsetPagination
+    renderer_classes = tuple(api_settings.DEFAULT_RENDERER_CLASSES) + ES_RENDERER_CLASSES
 
     def get(self, request, *args, **kwargs):
         return self.list(request, *args, **kwargs)
+
+
+class BulkIngestElasticAPIView(BulkIngestElasticMixin, ElasticAPIView):
+    """Concrete view for indexing documents of a NDJSON request body."""
+    parser_classes = (NDJSONParser,)
+
+    def post(self, request, *args, **kwargs):
+        return self.create_bulk(request, *args, **kwargs)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.module_loading import import_string
+
+from rest_framework_elasticsearch.es_consistency import ElasticConsistencyChecker
+
+
+class Command(BaseCommand):
+    help = 'Compare the index with the database by pk range checksums.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'serializer',
+            help='Dotted path to the ElasticModelSerializer class.'
+        )
+        parser.add_argument('--using', default=None,
+                            help='Elasticsearch connection alias.')
+        parser.add_argument('--index', default=None)
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--pk-field', default=ElasticConsistencyChecker.pk_field,
+                            help='Elasticsearch field with the pk.')
+        parser.add_argument('--checksum-field', action='append', default=[],
+                            dest='checksum_fields',
+                            help='Numeric field summed in the checksums, '
+                                 '"field" or "model_field:es_field". Without it '
+                                 'all documents are compared.')
+        parser.add_argument('--branching', type=int,
+                            default=ElasticConsistencyChecker.branching)
+        parser.add_argument('--leaf-size', type=int,
+                            default=ElasticConsistencyChecker.leaf_size)
+        parser.add_argument('--repair', action='store_true',
+                            help='Index the missing and stale documents, '
+                                 'delete the extra ones.')
+
+    def handle(self, *args, **options):
+        checksum_fields = {}
+        for value in options['checksum_fields']:
+            field, _, es_field = value.partition(':')
+            checksum_fields[field] = es_field or field
+
+        try:
+            checker = ElasticConsistencyChecker(
+                import_string(options['serializer']),
+                using=options['using'],
+                index=options['index'],
+                database=options['database'],
+                pk_field=options['pk_field'],
+                checksum_fields=checksum_fields,
+                branching=options['branching'],
+                leaf_size=options['leaf_size'],
+                repair=options['repair'],
+            )
+            report = checker.run()
+        except ValueError as exc:
+            raise CommandError(exc)
+
+        for start, stop in report.mismatched_ranges:
+            self.stdout.write('Mismatched range [%d, %d)' % (start, stop))
+        for label, ids in (('Missing', report.missing), ('Stale', report.stale),
+                           ('Extra', report.extra)):
+            if ids:
+                self.stdout.write('%s: %s' % (label, ', '.join(ids)))
+        self.stdout.write(str(report))
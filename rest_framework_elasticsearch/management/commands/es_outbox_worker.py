@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.module_loading import import_string
+
+from rest_framework_elasticsearch.es_outbox import ElasticOutboxWorker
+
+
+class Command(BaseCommand):
+    help = 'Send the Elasticsearch outbox rows in bulk.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dispatcher',
+            default='rest_framework_elasticsearch.es_outbox.outbox_dispatcher',
+            help='Dotted path to the ElasticOutboxDispatcher with registered models.'
+        )
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--batch-size', type=int,
+                            default=ElasticOutboxWorker.batch_size)
+        parser.add_argument('--workers', type=int,
+                            default=ElasticOutboxWorker.workers)
+        parser.add_argument('--max-attempts', type=int, default=None)
+        parser.add_argument('--sleep', type=float, default=1.0,
+                            help='Seconds to wait when the outbox is empty.')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit when the outbox is empty.')
+
+    def handle(self, *args, **options):
+        worker = ElasticOutboxWorker(
+            import_string(options['dispatcher']),
+            using=options['database'],
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            max_attempts=options['max_attempts'],
+        )
+        total = 0
+        try:
+            while True:
+                processed = worker.process_batch()
+                total += processed
+                if processed:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            worker.close()
+        self.stdout.write('Processed %d outbox rows.' % total)
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import json
+
+from django.core.management.base import BaseCommand
+
+from rest_framework_elasticsearch.es_slowlog import ElasticSlowQueryLog, slow_query_log
+
+
+class Command(BaseCommand):
+    help = 'List the slowest Elasticsearch query fingerprints.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--sort', choices=('max', 'total', 'count'), default='max')
+        parser.add_argument('--cache', default=slow_query_log.cache_alias,
+                            help='Cache alias of the slow query log.')
+        parser.add_argument('--clear', action='store_true',
+                            help='Remove the recorded queries.')
+
+    def handle(self, *args, **options):
+        log = ElasticSlowQueryLog(cache_alias=options['cache'],
+                                  cache_key=slow_query_log.cache_key)
+        if options['clear']:
+            log.clear()
+            return
+
+        for entry in log.get_top(options['sort'], options['limit']):
+            self.stdout.write('%s %s count=%d max=%.1fms avg=%.1fms views=%s' % (
+                entry['fingerprint'], entry['method'], entry['count'], entry['max'],
+                entry['total'] / entry['count'], ','.join(entry['views']) or '-'
+            ))
+            for names in entry['params']:
+                self.stdout.write('    params: %s' % ', '.join(names))
+            self.stdout.write('    query: %s' % json.dumps(entry['query'], sort_keys=True))
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import json
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+from elasticsearch_dsl import Search
+
+from rest_framework_elasticsearch.es_operations import update_by_query
+
+
+class Command(BaseCommand):
+    help = 'Update Elasticsearch documents matched by a query with a painless script.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('index', help='Index or alias name.')
+        parser.add_argument('script', help='Source of the painless script.')
+        parser.add_argument('--query', default=None,
+                            help='JSON of the query, all documents by default.')
+        parser.add_argument('--params', default=None,
+                            help='JSON object of the script parameters.')
+        parser.add_argument('--using', default='default',
+                            help='Elasticsearch connection alias.')
+        parser.add_argument('--slices', default='auto')
+        parser.add_argument('--requests-per-second', type=float, default=None,
+                            help='Throttle of the update, not limited by default.')
+        parser.add_argument('--conflicts', default='proceed',
+                            choices=('proceed', 'abort'))
+        parser.add_argument('--poll-interval', type=float, default=5.0,
+                            help='Seconds between the checks of the task progress.')
+        parser.add_argument('--reconcile', default=None,
+                            help='Dotted path to a callable executed with the response '
+                                 'when the update is completed, e.g. to update the database.')
+
+    def get_search(self, options):
+        search = Search(using=options['using'], index=options['index'])
+        if options['query']:
+            search = search.update_from_dict({'query': json.loads(options['query'])})
+        return search
+
+    def write_status(self, status):
+        self.stdout.write('%d/%d documents: %d updated, %d version conflicts' % (
+            status.get('updated', 0) + status.get('noops', 0) +
+            status.get('version_conflicts', 0),
+            status.get('total', 0),
+            status.get('updated', 0),
+            status.get('version_conflicts', 0),
+        ))
+
+    def handle(self, *args, **options):
+        slices = options['slices']
+        response = update_by_query(
+            self.get_search(options),
+            options['script'],
+            params=json.loads(options['params']) if options['params'] else None,
+            slices=int(slices) if slices.isdigit() else slices,
+            conflicts=options['conflicts'],
+            requests_per_second=options['requests_per_second'],
+            poll_interval=options['poll_interval'],
+            callback=self.write_status,
+        )
+        self.write_status(response)
+        for failure in response.get('failures', []):
+            self.stderr.write(json.dumps(failure))
+        if options['reconcile']:
+            import_string(options['reconcile'])(response)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+from rest_framework_elasticsearch.es_reindex import (
+    ElasticAliasReindexer, ElasticReindexer)
+
+
+class Command(BaseCommand):
+    help = 'Rebuild an Elasticsearch index from the database in parallel.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'serializer',
+            help='Dotted path to the ElasticModelSerializer class.'
+        )
+        parser.add_argument('--using', default=None,
+                            help='Elasticsearch connection alias.')
+        parser.add_argument('--index', default=None,
+                            help='Index name, or the alias name with --swap, by default the index of the es_model.')
+        parser.add_argument('--range-size', type=int,
+                            default=ElasticReindexer.range_size)
+        parser.add_argument('--chunk-size', type=int,
+                            default=ElasticReindexer.chunk_size)
+        parser.add_argument('--processes', type=int, default=None)
+        parser.add_argument('--threads', type=int,
+                            default=ElasticReindexer.thread_count)
+        parser.add_argument('--state-file', default=None,
+                            help='File to store the completed ranges.')
+        parser.add_argument('--resume', action='store_true',
+                            help='Skip the ranges completed by the previous run.')
+        parser.add_argument('--swap', action='store_true',
+                            help='Load a new index and swap the alias to it.')
+        parser.add_argument('--keep', type=int, default=ElasticAliasReindexer.keep,
+                            help='Number of the previous indices retained after the swap.')
+        parser.add_argument('--replace-index', action='store_true',
+                            help='Replace the index named as the alias with the alias.')
+
+    def get_reindexer(self, options, **kwargs):
+        reindexer_class = ElasticReindexer
+        if options['swap']:
+            reindexer_class = ElasticAliasReindexer
+            kwargs.update(keep=options['keep'], replace_index=options['replace_index'])
+        return reindexer_class(
+            import_string(options['serializer']),
+            using=options['using'],
+            state_file=options['state_file'],
+            range_size=options['range_size'],
+            chunk_size=options['chunk_size'],
+            processes=options['processes'],
+            thread_count=options['threads'],
+            **kwargs
+        )
+
+    def handle(self, *args, **options):
+        if options['swap']:
+            reindexer = self.get_reindexer(options, alias=options['index'])
+        else:
+            reindexer = self.get_reindexer(options, index=options['index'])
+        progress = reindexer.run(
+            resume=options['resume'],
+            callback=lambda progress: self.stdout.write(str(progress))
+        )
+        self.stdout.write('Done: %s' % progress)
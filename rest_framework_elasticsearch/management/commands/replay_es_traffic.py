@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+from elasticsearch import Elasticsearch
+
+from rest_framework_elasticsearch.es_traffic import ElasticTrafficReplayer, load_traffic
+
+
+def parse_option(value):
+    """Parse the `name=value` option, the value is JSON, a dotted path or a string."""
+    if '=' not in value:
+        raise CommandError("Expected 'name=value', got '%s'" % value)
+    name, value = value.split('=', 1)
+    try:
+        return name, json.loads(value)
+    except ValueError:
+        pass
+    if '.' in value:
+        try:
+            return name, import_string(value)
+        except ImportError:
+            pass
+    return name, value
+
+
+class Command(BaseCommand):
+    help = 'Replay the traffic recorded by ElasticTrafficRecorder and report the latencies.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='NDJSON file of the recorded requests.')
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--repeat', type=int, default=1)
+        parser.add_argument('--host', action='append', default=[],
+                            help='Elasticsearch host used instead of the clients of the views.')
+        parser.add_argument('--set', action='append', default=[], dest='view_options',
+                            help="Attribute of the views, e.g. "
+                                 "'es_pagination_class=myapp.pagination.LargePagination'.")
+        parser.add_argument('--param', action='append', default=[], dest='params',
+                            help="Query parameter of the requests, e.g. 'limit=50'.")
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON.')
+
+    def handle(self, *args, **options):
+        replayer = ElasticTrafficReplayer(
+            concurrency=options['concurrency'],
+            repeat=options['repeat'],
+            es_client=Elasticsearch(options['host']) if options['host'] else None,
+            view_options=dict(parse_option(value) for value in options['view_options']),
+            params=dict(value.split('=', 1) for value in options['params']),
+        )
+        report = replayer.run(load_traffic(options['path'])).to_dict()
+        if options['json']:
+            self.stdout.write(json.dumps(report, sort_keys=True))
+            return
+
+        latency = report['latency']
+        self.stdout.write('requests=%d errors=%d elapsed=%.2fs throughput=%.1f/s' % (
+            report['requests'], report['errors'], report['elapsed'], report['throughput']))
+        if report['requests']:
+            self.stdout.write('latency mean=%.1fms p50=%.1fms p90=%.1fms p99=%.1fms max=%.1fms' % (
+                latency['mean'], latency['p50'], latency['p90'], latency['p99'], latency['max']))
+        self.stdout.write('es_queries=%d cache_hit_ratio=%s' % (
+            report['es_queries'],
+            '-' if report['cache_hit_ratio'] is None else '%.2f' % report['cache_hit_ratio']))
+        for status, count in sorted(report['statuses'].items()):
+            self.stdout.write('    status %s: %d' % (status, count))
+        for name, count in sorted(report['exceptions'].items()):
+            self.stdout.write('    exception %s: %d' % (name, count))
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.module_loading import import_string
+
+from rest_framework_elasticsearch.es_sync import ElasticWatermarkSync
+
+
+class Command(BaseCommand):
+    help = 'Index the objects changed since the last sync by a watermark field.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'serializer',
+            help='Dotted path to the ElasticModelSerializer class.'
+        )
+        parser.add_argument('--field', default='updated_at',
+                            help='Watermark field, e.g. a modification time.')
+        parser.add_argument('--name', default=None,
+                            help='Name of the stored watermark.')
+        parser.add_argument('--using', default=None,
+                            help='Elasticsearch connection alias.')
+        parser.add_argument('--index', default=None)
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--chunk-size', type=int,
+                            default=ElasticWatermarkSync.chunk_size)
+        parser.add_argument('--lag', type=float, default=ElasticWatermarkSync.lag,
+                            help='Seconds, the newer changes are synced by the next run.')
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Repeat the sync every interval seconds.')
+        parser.add_argument('--reset', action='store_true',
+                            help='Sync all objects.')
+
+    def handle(self, *args, **options):
+        sync = ElasticWatermarkSync(
+            import_string(options['serializer']),
+            field=options['field'],
+            name=options['name'],
+            using=options['using'],
+            index=options['index'],
+            database=options['database'],
+            chunk_size=options['chunk_size'],
+            lag=options['lag'],
+        )
+        if options['reset']:
+            sync.reset()
+        try:
+            while True:
+                total = sync.run()
+                self.stdout.write('Indexed %d objects.' % total)
+                if options['interval'] is None:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
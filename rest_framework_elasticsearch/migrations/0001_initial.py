@@ -0,0 +1,34 @@
+# Generated by Django 2.2.28 on 2026-10-19 11:51
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ElasticOutbox',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=255, verbose_name='Model')),
+                ('object_pk', models.CharField(max_length=255, verbose_name='Object pk')),
+                ('op', models.CharField(choices=[('index', 'Index'), ('delete', 'Delete')], max_length=10, verbose_name='Operation')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created at')),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Available at')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Attempts')),
+                ('last_error', models.TextField(blank=True, verbose_name='Last error')),
+            ],
+            options={
+                'verbose_name': 'Elasticsearch outbox item',
+                'verbose_name_plural': 'Elasticsearch outbox',
+                'ordering': ('id',),
+                'index_together': {('available_at', 'id')},
+            },
+        ),
+    ]
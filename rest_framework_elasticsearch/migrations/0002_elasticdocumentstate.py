@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-19 11:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_framework_elasticsearch', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ElasticDocumentState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.CharField(max_length=255, verbose_name='Index')),
+                ('document_id', models.CharField(max_length=255, verbose_name='Document id')),
+                ('digests', models.TextField(verbose_name='Field digests')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated at')),
+            ],
+            options={
+                'verbose_name': 'Elasticsearch document state',
+                'verbose_name_plural': 'Elasticsearch document states',
+                'unique_together': {('index', 'document_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 2.2.28 on 2026-10-19 12:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_framework_elasticsearch', '0002_elasticdocumentstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ElasticSyncWatermark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Name')),
+                ('value', models.TextField(verbose_name='Value')),
+                ('last_pk', models.CharField(max_length=255, verbose_name='Last pk')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated at')),
+            ],
+            options={
+                'verbose_name': 'Elasticsearch sync watermark',
+                'verbose_name_plural': 'Elasticsearch sync watermarks',
+            },
+        ),
+    ]
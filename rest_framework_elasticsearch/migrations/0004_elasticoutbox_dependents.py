@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-19 12:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_framework_elasticsearch', '0003_elasticsyncwatermark'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='elasticoutbox',
+            name='op',
+            field=models.CharField(choices=[('index', 'Index'), ('delete', 'Delete'), ('dependents', 'Dependents')], max_length=10, verbose_name='Operation'),
+        ),
+    ]
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+
+from django.db import models
+from django.utils import timezone
+from django.utils.encoding import python_2_unicode_compatible
+from django.utils.translation import ugettext_lazy as _
+
+
+@python_2_unicode_compatible
+class ElasticOutbox(models.Model):
+    """
+    Index operation written in the same transaction as the model change,
+    the rows are sent to Elasticsearch by the `es_outbox_worker` command.
+    """
+    INDEX = 'index'
+    DELETE = 'delete'
+    DEPENDENTS = 'dependents'
+    OP_CHOICES = (
+        (INDEX, _('Index')),
+        (DELETE, _('Delete')),
+        (DEPENDENTS, _('Dependents')),
+    )
+
+    model = models.CharField(_('Model'), max_length=255)
+    object_pk = models.CharField(_('Object pk'), max_length=255)
+    op = models.CharField(_('Operation'), max_length=10, choices=OP_CHOICES)
+    created_at = models.DateTimeField(_('Created at'), auto_now_add=True)
+    available_at = models.DateTimeField(_('Available at'), default=timezone.now)
+    attempts = models.PositiveIntegerField(_('Attempts'), default=0)
+    last_error = models.TextField(_('Last error'), blank=True)
+
+    class Meta:
+        ordering = ('id',)
+        index_together = (
+            ('available_at', 'id'),
+        )
+        verbose_name = _('Elasticsearch outbox item')
+        verbose_name_plural = _('Elasticsearch outbox')
+
+    def __str__(self):
+        return '%s %s:%s' % (self.op, self.model, self.object_pk)
+
+
+@python_2_unicode_compatible
+class ElasticDocumentState(models.Model):
+    """
+    Hashes of the fields of an indexed document, used to skip writes
+    of unchanged documents and to send only the changed fields.
+    """
+    index = models.CharField(_('Index'), max_length=255)
+    document_id = models.CharField(_('Document id'), max_length=255)
+    # JSON object {field: hash}
+    digests = models.TextField(_('Field digests'))
+    updated_at = models.DateTimeField(_('Updated at'), auto_now=True)
+
+    class Meta:
+        unique_together = (
+            ('index', 'document_id'),
+        )
+        verbose_name = _('Elasticsearch document state')
+        verbose_name_plural = _('Elasticsearch document states')
+
+    def __str__(self):
+        return '%s:%s' % (self.index, self.document_id)
+
+
+@python_2_unicode_compatible
+class ElasticSyncWatermark(models.Model):
+    """
+    Position of the incremental sync, the value of the watermark field
+    and the pk of the last indexed object.
+    """
+    name = models.CharField(_('Name'), max_length=255, unique=True)
+    # JSON of the watermark field value
+    value = models.TextField(_('Value'))
+    last_pk = models.CharField(_('Last pk'), max_length=255)
+    updated_at = models.DateTimeField(_('Updated at'), auto_now=True)
+
+    class Meta:
+        verbose_name = _('Elasticsearch sync watermark')
+        verbose_name_plural = _('Elasticsearch sync watermarks')
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,2839 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, unicode_literals
+
+import copy
+import datetime
+import fnmatch
+import json
+import math
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.utils import six
+from django.utils.dateparse import parse_date as parse_date_only
+from django.utils.dateparse import parse_datetime
+from django.utils.six.moves.urllib.parse import unquote
+from elasticsearch import Elasticsearch
+from elasticsearch.connection import Connection
+from elasticsearch_dsl.connections import connections
+
+from ..es_counters import COUNTERS_SCRIPT
+
+VERSION = '6.8.0'
+EPOCH = datetime.datetime(1970, 1, 1)
+MAX_RESULT_WINDOW = 10000
+# Radius of the Earth used by Elasticsearch, meters
+EARTH_RADIUS = 6371008.7714
+
+TOKEN_RE = re.compile(r"\w+(?:['’]\w+)*", re.UNICODE)
+DATE_DETECTION_RE = re.compile(r'^\d{4}-\d{2}-\d{2}([T ]\d{2}:\d{2}(:\d{2}(\.\d+)?)?'
+                               r'(Z|[+-]\d{2}:?\d{2})?)?$')
+DATE_MATH_RE = re.compile(r'^now(?P<math>([+-]\d+[yMwdhHms])*)(/(?P<round>[yMwdhHms]))?$')
+DATE_MATH_PART_RE = re.compile(r'([+-])(\d+)([yMwdhHms])')
+TIME_RE = re.compile(r'^(\d+(?:\.\d+)?)(nanos|micros|ms|s|m|h|d)?$')
+DISTANCE_RE = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([a-zA-Z]*)\s*$')
+
+TIME_UNITS = {
+    'nanos': 1e-6, 'micros': 1e-3, 'ms': 1, None: 1, 's': 1000, 'm': 60000,
+    'h': 3600000, 'd': 86400000,
+}
+DISTANCE_UNITS = {
+    '': 1, 'm': 1, 'meters': 1, 'km': 1000, 'kilometers': 1000, 'cm': 0.01,
+    'mm': 0.001, 'mi': 1609.344, 'miles': 1609.344, 'yd': 0.9144, 'yards': 0.9144,
+    'ft': 0.3048, 'feet': 0.3048, 'in': 0.0254, 'inch': 0.0254, 'nmi': 1852,
+    'NM': 1852,
+}
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+NUMERIC_TYPES = frozenset(['long', 'integer', 'short', 'byte', 'double', 'float',
+                           'half_float', 'scaled_float'])
+STRING_TYPES = frozenset(['keyword', 'text'])
+# Values of the settings reset with `null`
+DEFAULT_SETTINGS = {
+    'index.number_of_shards': '5',
+    'index.number_of_replicas': '1',
+}
+
+
+class ElasticError(Exception):
+    """Error response of the engine."""
+
+    def __init__(self, status, error_type, reason, **info):
+        super(ElasticError, self).__init__(reason)
+        self.status = status
+        self.error_type = error_type
+        self.reason = reason
+        self.info = info
+
+    def to_dict(self):
+        error = dict(self.info, type=self.error_type, reason=self.reason)
+        error['root_cause'] = [dict(error)]
+        return {'error': error, 'status': self.status}
+
+
+def bad_request(reason, error_type='illegal_argument_exception', **info):
+    return ElasticError(400, error_type, reason, **info)
+
+
+def not_found(reason, error_type='index_not_found_exception', **info):
+    return ElasticError(404, error_type, reason, **info)
+
+
+def analyze(text):
+    """Split a text into lowercased tokens like the standard analyzer."""
+    return [token.lower() for token in TOKEN_RE.findall(six.text_type(text))]
+
+
+def to_millis(value):
+    """Return the epoch milliseconds of a datetime or a date."""
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.replace(tzinfo=None) - value.utcoffset()
+        return int(round((value - EPOCH).total_seconds() * 1000))
+    return to_millis(datetime.datetime(value.year, value.month, value.day))
+
+
+def round_datetime(value, unit):
+    if unit == 'y':
+        return value.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+    if unit == 'M':
+        return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    if unit == 'w':
+        value = value - datetime.timedelta(days=value.weekday())
+        return value.replace(hour=0, minute=0, second=0, microsecond=0)
+    if unit == 'd':
+        return value.replace(hour=0, minute=0, second=0, microsecond=0)
+    if unit in ('h', 'H'):
+        return value.replace(minute=0, second=0, microsecond=0)
+    if unit == 'm':
+        return value.replace(second=0, microsecond=0)
+    return value.replace(microsecond=0)
+
+
+def add_months(value, months):
+    month = value.month - 1 + months
+    year = value.year + month // 12
+    month = month % 12 + 1
+    days = [31, 29 if year % 4 == 0 and (year % 100 or year % 400 == 0) else 28,
+            31, 30, 31, 30, 31, 31, 30, 31, 30, 31][month - 1]
+    return value.replace(year=year, month=month, day=min(value.day, days))
+
+
+def parse_date(value):
+    """Return the epoch milliseconds of a date value, `now` math is supported."""
+    if isinstance(value, bool):
+        raise ValueError('Invalid date: %r' % value)
+    if isinstance(value, six.integer_types + (float,)):
+        return int(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return to_millis(value)
+    value = six.text_type(value).strip()
+    match = DATE_MATH_RE.match(value)
+    if match:
+        now = datetime.datetime.utcnow()
+        for sign, amount, unit in DATE_MATH_PART_RE.findall(match.group('math') or ''):
+            amount = int(amount) * (1 if sign == '+' else -1)
+            if unit == 'y':
+                now = add_months(now, amount * 12)
+            elif unit == 'M':
+                now = add_months(now, amount)
+            else:
+                seconds = {'w': 604800, 'd': 86400, 'h': 3600, 'H': 3600, 'm': 60, 's': 1}
+                now += datetime.timedelta(seconds=amount * seconds[unit])
+        if match.group('round'):
+            now = round_datetime(now, match.group('round'))
+        return to_millis(now)
+    if value.lstrip('-').isdigit():
+        return int(value)
+    parsed = parse_datetime(value.replace(' ', 'T', 1) if 'T' not in value else value)
+    if parsed is None:
+        parsed = parse_date_only(value)
+    if parsed is None:
+        raise ValueError('Invalid date: %r' % value)
+    return to_millis(parsed)
+
+
+def format_date(millis):
+    value = EPOCH + datetime.timedelta(milliseconds=millis)
+    return value.strftime('%Y-%m-%dT%H:%M:%S.') + '%03dZ' % (value.microsecond // 1000)
+
+
+def parse_time(value):
+    """Return the milliseconds of a time value, e.g. '5m'."""
+    if isinstance(value, six.integer_types + (float,)):
+        return value
+    match = TIME_RE.match(six.text_type(value).strip())
+    if not match:
+        raise bad_request('failed to parse time value [%s]' % value)
+    return float(match.group(1)) * TIME_UNITS[match.group(2)]
+
+
+def parse_distance(value):
+    """Return the meters of a distance, e.g. '12km'."""
+    if isinstance(value, six.integer_types + (float,)):
+        return float(value)
+    match = DISTANCE_RE.match(six.text_type(value))
+    if not match or match.group(2) not in DISTANCE_UNITS:
+        raise bad_request('failed to parse distance [%s]' % value)
+    return float(match.group(1)) * DISTANCE_UNITS[match.group(2)]
+
+
+def decode_geohash(value):
+    lat, lon = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in value:
+        bits = GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            interval = lon if even else lat
+            middle = (interval[0] + interval[1]) / 2
+            if bits >> shift & 1:
+                interval[0] = middle
+            else:
+                interval[1] = middle
+            even = not even
+    return (lat[0] + lat[1]) / 2, (lon[0] + lon[1]) / 2
+
+
+def parse_geo_point(value):
+    """Return (lat, lon) of a geo point in any of the supported formats."""
+    try:
+        if isinstance(value, dict):
+            return float(value['lat']), float(value['lon'])
+        if isinstance(value, (list, tuple)):
+            return float(value[1]), float(value[0])
+        value = six.text_type(value).strip()
+        if ',' in value:
+            lat, lon = value.split(',', 1)
+            return float(lat), float(lon)
+        return decode_geohash(value.lower())
+    except (KeyError, IndexError, TypeError, ValueError):
+        raise bad_request('failed to parse geo point [%s]' % (value,),
+                          error_type='parse_exception')
+
+
+def arc_distance(point, other):
+    lat1, lon1 = math.radians(point[0]), math.radians(point[1])
+    lat2, lon2 = math.radians(other[0]), math.radians(other[1])
+    a = (math.sin((lat2 - lat1) / 2) ** 2 +
+         math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def plane_distance(point, other):
+    lat1, lat2 = math.radians(point[0]), math.radians(other[0])
+    x = math.radians(other[1] - point[1]) * math.cos((lat1 + lat2) / 2)
+    return EARTH_RADIUS * math.sqrt(x * x + (lat2 - lat1) ** 2)
+
+
+def get_values(source, path):
+    """Return the flat list of the values of a dotted path of a source."""
+    values = [source]
+    for part in path.split('.'):
+        found = []
+        for value in values:
+            if isinstance(value, dict):
+                if part in value:
+                    found.append(value[part])
+                continue
+            if isinstance(value, list):
+                found.extend(item[part] for item in value
+                             if isinstance(item, dict) and part in item)
+        values = []
+        for value in found:
+            if isinstance(value, list):
+                values.extend(value)
+            else:
+                values.append(value)
+    return [value for value in values if value is not None]
+
+
+def match_patterns(path, patterns, prefix=False):
+    for pattern in patterns:
+        if fnmatch.fnmatchcase(path, pattern):
+            return True
+        if prefix and ('*' in pattern or pattern.startswith(path + '.')):
+            return True
+    return False
+
+
+def filter_source(source, includes=(), excludes=(), prefix=''):
+    """Return the source with the included and without the excluded paths."""
+    if isinstance(source, list):
+        return [filter_source(item, includes, excludes, prefix)
+                if isinstance(item, dict) else item for item in source]
+    filtered = OrderedDict()
+    for key, value in six.iteritems(source):
+        path = prefix + key
+        if excludes and match_patterns(path, excludes):
+            continue
+        if not includes or match_patterns(path, includes):
+            if isinstance(value, (dict, list)) and excludes:
+                value = filter_source(value, (), excludes, path + '.')
+            filtered[key] = value
+        elif isinstance(value, (dict, list)) and match_patterns(path, includes, prefix=True):
+            value = filter_source(value, includes, excludes, path + '.')
+            if value:
+                filtered[key] = value
+    return filtered
+
+
+def get_source_filter(value, includes=None, excludes=None):
+    """Return (enabled, includes, excludes) of a `_source` option."""
+    if value is None and includes is None and excludes is None:
+        return True, (), ()
+    if isinstance(includes, six.string_types):
+        includes = includes.split(',')
+    if isinstance(excludes, six.string_types):
+        excludes = excludes.split(',')
+    if isinstance(value, bool):
+        return value, (), ()
+    if isinstance(value, six.string_types):
+        if value in ('true', 'false'):
+            return value == 'true', (), ()
+        value = value.split(',')
+    if isinstance(value, list):
+        return True, tuple(value), tuple(excludes or ())
+    if isinstance(value, dict):
+        def as_tuple(patterns):
+            return (patterns,) if isinstance(patterns, six.string_types) else tuple(patterns or ())
+        return (True, as_tuple(value.get('includes', value.get('include'))),
+                as_tuple(value.get('excludes', value.get('exclude'))))
+    return True, tuple(includes or ()), tuple(excludes or ())
+
+
+def deep_merge(target, source):
+    for key, value in six.iteritems(source):
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            deep_merge(target[key], value)
+        else:
+            target[key] = copy.deepcopy(value)
+    return target
+
+
+def flatten_settings(settings, prefix=''):
+    """Return the {'index.name': 'value'} of the nested settings."""
+    flat = {}
+    for key, value in six.iteritems(settings):
+        key = prefix + key
+        if isinstance(value, dict):
+            flat.update(flatten_settings(value, key + '.'))
+            continue
+        if not key.startswith('index.'):
+            key = 'index.' + key
+        if isinstance(value, bool):
+            value = 'true' if value else 'false'
+        flat[key] = value if value is None else six.text_type(value)
+    return flat
+
+
+def nest_settings(flat):
+    nested = {}
+    for key, value in sorted(six.iteritems(flat)):
+        parts = key.split('.')
+        target = nested
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return nested
+
+
+def parse_boolean(value):
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, six.string_types):
+        if value.lower() in ('true', 'on', 'yes', '1'):
+            return True
+        if value.lower() in ('false', 'off', 'no', '0', ''):
+            return False
+    elif isinstance(value, six.integer_types + (float,)):
+        return bool(value)
+    raise ValueError('Invalid boolean: %r' % (value,))
+
+
+def to_term(field_type, value):
+    """Return the comparable term of a value of a field type."""
+    if field_type in NUMERIC_TYPES:
+        if isinstance(value, bool):
+            raise ValueError('Invalid number: %r' % value)
+        return float(value)
+    if field_type == 'date':
+        return parse_date(value)
+    if field_type == 'boolean':
+        return parse_boolean(value)
+    if field_type == 'geo_point':
+        return parse_geo_point(value)
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return six.text_type(value)
+
+
+def get_minimum_should_match(value, count):
+    """Return the number of the clauses required by `minimum_should_match`."""
+    if value is None:
+        return None
+    value = six.text_type(value).strip()
+    if '<' in value:
+        required = count
+        for condition in value.split():
+            limit, spec = condition.split('<', 1)
+            if count > int(limit):
+                required = get_minimum_should_match(spec, count)
+        return required
+    if value.endswith('%'):
+        percent = float(value[:-1])
+        required = int(count * abs(percent) / 100)
+        required = count - required if percent < 0 else required
+    else:
+        number = int(value)
+        required = count + number if number < 0 else number
+    return max(0, min(count, required))
+
+
+def edit_distance(first, second, limit):
+    """Return the Damerau-Levenshtein distance, or `limit + 1` when it's larger."""
+    if abs(len(first) - len(second)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(second) + 1))
+    for i in range(1, len(first) + 1):
+        current = [i] + [0] * len(second)
+        for j in range(1, len(second) + 1):
+            cost = 0 if first[i - 1] == second[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (previous2 is not None and i > 1 and j > 1 and
+                    first[i - 1] == second[j - 2] and first[i - 2] == second[j - 1]):
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def get_fuzziness(value, term):
+    if value is None:
+        return 0
+    value = six.text_type(value).upper()
+    if value.startswith('AUTO'):
+        low, high = 3, 6
+        if ':' in value:
+            low, high = [int(part) for part in value.split(':', 1)[1].split(',')]
+        if len(term) < low:
+            return 0
+        return 1 if len(term) < high else 2
+    return min(2, int(float(value)))
+
+
+def update_counters(ctx, params):
+    """Python version of the `COUNTERS_SCRIPT`."""
+    source = ctx['_source']
+    for field, value in six.iteritems(params['counters']):
+        source[field] = (source.get(field) or 0) + value
+
+
+SCRIPT_STATEMENT_RE = re.compile(
+    r'^ctx\._source\.(?P<path>[\w.]+)\s*(?P<op>=|\+=|-=)\s*(?P<operand>.+)$')
+SCRIPT_OP_RE = re.compile(r'^ctx\.op\s*=\s*[\'"](?P<op>\w+)[\'"]$')
+SCRIPT_REMOVE_RE = re.compile(r'^ctx\._source\.remove\(\s*[\'"](?P<field>[\w.]+)[\'"]\s*\)$')
+
+
+def get_path(data, path):
+    for part in path.split('.'):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(part)
+    return data
+
+
+def compile_operand(operand):
+    operand = operand.strip()
+    if operand.startswith('params.'):
+        path = operand[len('params.'):]
+        return lambda ctx, params: get_path(params, path)
+    if operand.startswith('ctx._source.'):
+        path = operand[len('ctx._source.'):]
+        return lambda ctx, params: get_path(ctx['_source'], path)
+    if len(operand) > 1 and operand[0] == operand[-1] == "'":
+        value = operand[1:-1]
+    else:
+        try:
+            value = json.loads(operand)
+        except ValueError:
+            raise ValueError(operand)
+    return lambda ctx, params: copy.deepcopy(value)
+
+
+def compile_statement(statement):
+    match = SCRIPT_OP_RE.match(statement)
+    if match:
+        op = match.group('op')
+
+        def set_op(ctx, params):
+            ctx['op'] = op
+        return set_op
+
+    match = SCRIPT_REMOVE_RE.match(statement)
+    if match:
+        parts = match.group('field').split('.')
+
+        def remove(ctx, params):
+            target = get_path(ctx['_source'], '.'.join(parts[:-1])) if parts[:-1] else ctx['_source']
+            if isinstance(target, dict):
+                target.pop(parts[-1], None)
+        return remove
+
+    match = SCRIPT_STATEMENT_RE.match(statement)
+    if not match:
+        raise ValueError(statement)
+    parts = match.group('path').split('.')
+    op = match.group('op')
+    operand = compile_operand(match.group('operand'))
+
+    def assign(ctx, params):
+        target = ctx['_source']
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        value = operand(ctx, params)
+        if op == '+=':
+            value = target.get(parts[-1]) + value
+        elif op == '-=':
+            value = target.get(parts[-1]) - value
+        target[parts[-1]] = value
+    return assign
+
+
+def compile_script(source):
+    """
+    Compile the subset of painless used by the update scripts: assignments
+    of `ctx._source` fields, `ctx.op` and `ctx._source.remove()`.
+    """
+    statements = []
+    for statement in source.split(';'):
+        statement = statement.strip()
+        if statement:
+            statements.append(compile_statement(statement))
+
+    def run(ctx, params):
+        for statement in statements:
+            statement(ctx, params)
+    return run
+
+
+class InMemoryDocument(object):
+    __slots__ = ('id', 'type', 'source', 'version', 'seq_no', 'cache')
+
+    def __init__(self, id, type, source, version, seq_no):
+        self.id = id
+        self.type = type
+        self.source = source
+        self.version = version
+        self.seq_no = seq_no
+        # {field: terms}, the documents are replaced on writes, never changed
+        self.cache = {}
+
+
+class InMemoryIndex(object):
+    """Documents, mapping and settings of an index."""
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self, name, settings=None, mappings=None, aliases=None):
+        self.name = name
+        self.settings = dict(DEFAULT_SETTINGS, **{
+            'index.uuid': uuid.uuid4().hex[:22],
+            'index.creation_date': six.text_type(int(time.time() * 1000)),
+            'index.provided_name': name,
+            'index.version.created': '6080099',
+        })
+        self.doc_type = None
+        self.properties = OrderedDict()
+        # Mapping options other than the properties, e.g. `dynamic`
+        self.mapping_meta = {}
+        self.aliases = OrderedDict()
+        self.documents = OrderedDict()
+        # {id: version} of the deleted documents
+        self.tombstones = {}
+        # Documents visible to the searches while the refresh is disabled
+        self.snapshot = None
+        self.seq_no = -1
+        self.closed = False
+        self.generation = 0
+        self._fields = {}
+        self._stats = {}
+        self.settings.update((key, value) for key, value in
+                             six.iteritems(flatten_settings(settings or {}))
+                             if value is not None)
+        self.update_settings({})
+        for doc_type, mapping in six.iteritems(mappings or {}):
+            self.put_mapping(doc_type, mapping)
+        for alias, options in six.iteritems(aliases or {}):
+            self.aliases[alias] = dict(options or {})
+
+    # Settings
+
+    def update_settings(self, settings):
+        for key, value in six.iteritems(flatten_settings(settings)):
+            if key in ('index.number_of_shards', 'index.uuid', 'index.creation_date',
+                       'index.provided_name') and self.settings.get(key, value) != value:
+                raise bad_request("final %s setting [%s], not updateable" % (self.name, key))
+            if value is None and key in DEFAULT_SETTINGS:
+                self.settings[key] = DEFAULT_SETTINGS[key]
+            elif value is None:
+                self.settings.pop(key, None)
+            else:
+                self.settings[key] = value
+        refresh_disabled = self.settings.get('index.refresh_interval') == '-1'
+        if refresh_disabled and self.snapshot is None:
+            self.snapshot = OrderedDict(self.documents)
+        elif not refresh_disabled:
+            self.snapshot = None
+        self.changed()
+
+    @property
+    def max_result_window(self):
+        return int(self.settings.get('index.max_result_window', MAX_RESULT_WINDOW))
+
+    # Mapping
+
+    def put_mapping(self, doc_type, mapping):
+        if doc_type in (None, '_doc') and self.doc_type:
+            doc_type = self.doc_type
+        if self.doc_type is not None and doc_type != self.doc_type:
+            raise bad_request(
+                'Rejecting mapping update to [%s] as the final mapping would have more '
+                'than 1 type: [%s, %s]' % (self.name, self.doc_type, doc_type))
+        self.doc_type = doc_type or 'doc'
+        mapping = dict(mapping or {})
+        properties = mapping.pop('properties', {})
+        self.mapping_meta.update(mapping)
+        self.merge_properties(self.properties, properties, '')
+        self._fields = {}
+
+    def merge_properties(self, target, properties, prefix):
+        for name, mapping in six.iteritems(properties):
+            mapping = copy.deepcopy(mapping)
+            if 'properties' in mapping and 'type' not in mapping:
+                mapping['type'] = 'object'
+            current = target.get(name)
+            if current is None:
+                target[name] = mapping
+                continue
+            if current.get('type', 'object') != mapping.get('type', 'object'):
+                raise bad_request(
+                    'mapper [%s%s] of different type, current_type [%s], merged_type [%s]' % (
+                        prefix, name, current.get('type', 'object'),
+                        mapping.get('type', 'object')))
+            if 'properties' in mapping:
+                self.merge_properties(current.setdefault('properties', OrderedDict()),
+                                      mapping.pop('properties'), prefix + name + '.')
+            fields = mapping.pop('fields', None)
+            current.update(mapping)
+            if fields:
+                current.setdefault('fields', {}).update(fields)
+
+    def get_mapping(self):
+        mapping = dict(self.mapping_meta, properties=self.properties)
+        return {self.doc_type: mapping} if self.doc_type else {}
+
+    def get_field(self, path):
+        """Return the (source path, mapping) of a field, `None` when it's unmapped."""
+        if path in self._fields:
+            return self._fields[path]
+        field = None
+        properties = self.properties
+        parts = path.split('.')
+        for i, part in enumerate(parts):
+            mapping = properties.get(part)
+            if mapping is None:
+                break
+            if i == len(parts) - 1:
+                field = ('.'.join(parts), mapping)
+                break
+            if 'properties' in mapping:
+                properties = mapping['properties']
+                continue
+            subfield = mapping.get('fields', {}).get('.'.join(parts[i + 1:]))
+            if subfield is not None:
+                field = ('.'.join(parts[:i + 1]), subfield)
+            break
+        self._fields[path] = field
+        return field
+
+    def get_field_type(self, path):
+        field = self.get_field(path)
+        return field[1].get('type', 'object') if field else None
+
+    def get_fields(self, pattern):
+        """Return the paths of the leaf fields which match a wildcard pattern."""
+        return [path for path in self.iter_fields(self.properties, '')
+                if fnmatch.fnmatchcase(path, pattern)]
+
+    def iter_fields(self, properties, prefix):
+        for name, mapping in six.iteritems(properties):
+            path = prefix + name
+            if 'properties' in mapping:
+                for field in self.iter_fields(mapping['properties'], path + '.'):
+                    yield field
+                continue
+            yield path
+            for subfield in mapping.get('fields', {}):
+                yield '%s.%s' % (path, subfield)
+
+    def guess_mapping(self, value):
+        if isinstance(value, bool):
+            return {'type': 'boolean'}
+        if isinstance(value, six.integer_types):
+            return {'type': 'long'}
+        if isinstance(value, float):
+            return {'type': 'float'}
+        if isinstance(value, dict):
+            return {'type': 'object', 'properties': OrderedDict()}
+        if (self.mapping_meta.get('date_detection', True) and
+                DATE_DETECTION_RE.match(six.text_type(value))):
+            return {'type': 'date'}
+        return {'type': 'text',
+                'fields': {'keyword': {'type': 'keyword', 'ignore_above': 256}}}
+
+    def map_source(self, source, properties, prefix, dynamic):
+        """Add the dynamic mappings of the unmapped fields of a source."""
+        for name, value in six.iteritems(source):
+            values = value if isinstance(value, list) else [value]
+            values = [item for item in values if item is not None]
+            mapping = properties.get(name)
+            if mapping is None:
+                if not values:
+                    continue
+                if dynamic in ('strict', False, 'false'):
+                    if dynamic == 'strict':
+                        raise bad_request(
+                            'mapping set to strict, dynamic introduction of [%s] within [%s] '
+                            'is not allowed' % (name, self.doc_type or 'doc'),
+                            error_type='strict_dynamic_mapping_exception')
+                    continue
+                mapping = properties[name] = self.guess_mapping(values[0])
+                self._fields = {}
+            if mapping.get('type', 'object') in ('object', 'nested'):
+                if mapping.get('enabled', True) is False:
+                    continue
+                for item in values:
+                    if not isinstance(item, dict):
+                        raise bad_request(
+                            'object mapping for [%s%s] tried to parse field [%s] as object, '
+                            'but found a concrete value' % (prefix, name, name),
+                            error_type='mapper_parsing_exception')
+                    self.map_source(item, mapping.setdefault('properties', OrderedDict()),
+                                    prefix + name + '.', mapping.get('dynamic', dynamic))
+
+    def prepare(self, doc_type, source):
+        """Validate a source and extend the mapping, return the document type."""
+        if not isinstance(source, dict):
+            raise bad_request('failed to parse', error_type='mapper_parsing_exception')
+        if doc_type in (None, '_doc'):
+            doc_type = self.doc_type or 'doc'
+        if self.doc_type is None:
+            self.doc_type = doc_type
+        elif doc_type != self.doc_type:
+            raise bad_request(
+                'Rejecting mapping update to [%s] as the final mapping would have more '
+                'than 1 type: [%s, %s]' % (self.name, self.doc_type, doc_type))
+        self.map_source(source, self.properties, '', self.mapping_meta.get('dynamic', True))
+        document = InMemoryDocument(None, doc_type, source, 0, 0)
+        for path in self.iter_fields(self.properties, ''):
+            try:
+                self.get_terms(document, path)
+            except (ElasticError, ValueError, TypeError, AttributeError):
+                raise bad_request(
+                    'failed to parse field [%s] of type [%s]' % (
+                        path, self.get_field_type(path)),
+                    error_type='mapper_parsing_exception')
+        return doc_type, document.cache
+
+    # Values
+
+    def get_terms(self, document, path):
+        """Return the terms of a field of a document, the tokens of a text field."""
+        cache = document.cache
+        if path in cache:
+            return cache[path]
+        field = self.get_field(path)
+        if field is None:
+            terms = []
+        else:
+            source_path, mapping = field
+            field_type = mapping.get('type', 'object')
+            values = get_values(document.source, source_path)
+            if field_type == 'text':
+                terms = []
+                for value in values:
+                    terms.extend(analyze(value))
+            elif field_type == 'keyword':
+                terms = [to_term(field_type, value) for value in values
+                         if len(six.text_type(value)) <= mapping.get('ignore_above', 2 ** 31)]
+            elif field_type == 'geo_point':
+                if values and isinstance(values[0], six.integer_types + (float,)):
+                    # [lon, lat] array
+                    values = [values]
+                terms = [to_term(field_type, value) for value in values]
+            elif field_type in ('object', 'nested'):
+                terms = []
+            else:
+                terms = [to_term(field_type, value) for value in values]
+        cache[path] = terms
+        return terms
+
+    def get_phrases(self, document, path):
+        """Return the token lists of the values of a text field."""
+        key = (path, 'phrases')
+        if key not in document.cache:
+            field = self.get_field(path)
+            values = get_values(document.source, field[0]) if field else []
+            document.cache[key] = [analyze(value) for value in values]
+        return document.cache[key]
+
+    def get_frequencies(self, document, path):
+        key = (path, 'frequencies')
+        if key not in document.cache:
+            frequencies = {}
+            for term in self.get_terms(document, path):
+                frequencies[term] = frequencies.get(term, 0) + 1
+            document.cache[key] = frequencies
+        return document.cache[key]
+
+    def get_stats(self, path):
+        """Return the (doc count, average length, {term: doc frequency}) of a field."""
+        key = (path, self.generation)
+        if key not in self._stats:
+            count = length = 0
+            frequencies = {}
+            for document in self.visible():
+                terms = self.get_terms(document, path)
+                if not terms:
+                    continue
+                count += 1
+                length += len(terms)
+                for term in self.get_frequencies(document, path):
+                    frequencies[term] = frequencies.get(term, 0) + 1
+            self._stats = {key: (count, length / count if count else 0, frequencies)}
+        return self._stats[key]
+
+    def bm25(self, document, path, term):
+        """Return the BM25 score of a term in a document."""
+        frequency = self.get_frequencies(document, path).get(term, 0)
+        if not frequency:
+            return 0.0
+        count, average_length, frequencies = self.get_stats(path)
+        doc_frequency = frequencies.get(term, 0)
+        idf = math.log(1 + (count - doc_frequency + 0.5) / (doc_frequency + 0.5))
+        if self.get_field_type(path) != 'text':
+            # Norms are disabled
+            return idf * frequency * (self.k1 + 1) / (frequency + self.k1)
+        length = len(self.get_terms(document, path))
+        norm = self.k1 * (1 - self.b + self.b * length / (average_length or 1))
+        return idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+    # Documents
+
+    def changed(self):
+        self.generation += 1
+
+    def visible(self):
+        """Return the documents visible to the searches."""
+        documents = self.documents if self.snapshot is None else self.snapshot
+        return list(documents.values())
+
+    def refresh(self):
+        if self.snapshot is not None:
+            self.snapshot = OrderedDict(self.documents)
+            self.changed()
+
+    def write(self, document):
+        self.seq_no += 1
+        document.seq_no = self.seq_no
+        self.documents.pop(document.id, None)
+        self.documents[document.id] = document
+        self.tombstones.pop(document.id, None)
+        self.changed()
+
+    def remove(self, doc_id, version):
+        """Delete a document, return the sequence number of the deletion."""
+        self.seq_no += 1
+        del self.documents[doc_id]
+        self.tombstones[doc_id] = version
+        self.changed()
+        return self.seq_no
+
+    def check_open(self):
+        if self.closed:
+            raise ElasticError(400, 'index_closed_exception', 'closed', index=self.name)
+
+
+def single_field(query_type, body):
+    """Return the (field, options) of a query with one field."""
+    fields = [(key, value) for key, value in six.iteritems(body)
+              if key not in ('boost', '_name', 'ignore_unmapped', 'validation_method',
+                             'type', 'distance', 'distance_type', 'format', 'time_zone')]
+    if len(fields) != 1:
+        raise bad_request('[%s] query requires one field' % query_type,
+                          error_type='parsing_exception')
+    return fields[0]
+
+
+def constant(query, score):
+    def scored(document):
+        return None if query(document) is None else score
+    return scored
+
+
+class QueryCompiler(object):
+    """
+    Compile a query of the query DSL into a function of a document which
+    returns the score, or `None` when the document doesn't match.
+    """
+
+    def __init__(self, index):
+        self.index = index
+
+    def compile(self, query):
+        if query is None:
+            return lambda document: 1.0
+        if not isinstance(query, dict) or len(query) != 1:
+            raise bad_request('query malformed, must start with start_object',
+                              error_type='parsing_exception')
+        query_type, body = next(six.iteritems(query))
+        method = getattr(self, 'compile_%s' % query_type, None)
+        if method is None:
+            raise bad_request('unknown query [%s], it is not supported by the in-memory '
+                              'engine' % query_type, error_type='parsing_exception')
+        return method(body if body is not None else {})
+
+    def compile_list(self, clauses):
+        if isinstance(clauses, dict):
+            clauses = [clauses]
+        return [self.compile(clause) for clause in clauses or ()]
+
+    def get_type(self, field):
+        return self.index.get_field_type(field)
+
+    def terms(self, field):
+        get_terms = self.index.get_terms
+        return lambda document: get_terms(document, field)
+
+    def to_term(self, field, value):
+        try:
+            return to_term(self.get_type(field), value)
+        except (ValueError, TypeError):
+            raise bad_request('failed to create query: field [%s] value [%s]' % (field, value),
+                              error_type='query_shard_exception')
+
+    def compile_match_all(self, body):
+        boost = body.get('boost', 1.0)
+        return lambda document: boost
+
+    def compile_match_none(self, body):
+        return lambda document: None
+
+    def compile_bool(self, body):
+        must = self.compile_list(body.get('must'))
+        filters = self.compile_list(body.get('filter'))
+        should = self.compile_list(body.get('should'))
+        must_not = self.compile_list(body.get('must_not'))
+        required = get_minimum_should_match(body.get('minimum_should_match'), len(should))
+        if required is None:
+            required = 0 if must or filters else min(1, len(should))
+        boost = body.get('boost', 1.0)
+        # A query with the filters or the negative clauses only
+        base = 0.0 if filters and not (must or should) else 1.0
+        if not (must or filters or should):
+            base = 1.0
+        scoring = bool(must or should)
+
+        def query(document):
+            for clause in must_not:
+                if clause(document) is not None:
+                    return None
+            for clause in filters:
+                if clause(document) is None:
+                    return None
+            score = 0.0
+            for clause in must:
+                clause_score = clause(document)
+                if clause_score is None:
+                    return None
+                score += clause_score
+            matched = 0
+            for clause in should:
+                clause_score = clause(document)
+                if clause_score is not None:
+                    matched += 1
+                    score += clause_score
+            if matched < required:
+                return None
+            return (score if scoring else base) * boost
+        return query
+
+    def compile_constant_score(self, body):
+        query = self.compile(body.get('filter'))
+        return constant(query, body.get('boost', 1.0))
+
+    def compile_dis_max(self, body):
+        queries = self.compile_list(body.get('queries'))
+        tie_breaker = body.get('tie_breaker', 0.0)
+        boost = body.get('boost', 1.0)
+
+        def query(document):
+            scores = [score for score in (clause(document) for clause in queries)
+                      if score is not None]
+            if not scores:
+                return None
+            best = max(scores)
+            return (best + tie_breaker * (sum(scores) - best)) * boost
+        return query
+
+    def compile_ids(self, body):
+        ids = set(six.text_type(value) for value in body.get('values', ()))
+        boost = body.get('boost', 1.0)
+        return lambda document: boost if document.id in ids else None
+
+    def compile_exists(self, body):
+        field = body['field']
+        fields = self.index.get_fields(field) if '*' in field else [field]
+        getters = [self.terms(name) for name in fields]
+        boost = body.get('boost', 1.0)
+
+        def query(document):
+            for terms in getters:
+                if terms(document):
+                    return boost
+            return None
+        return query
+
+    def compile_term(self, body):
+        field, options = single_field('term', body)
+        if not isinstance(options, dict):
+            options = {'value': options}
+        return self.term_query(field, options['value'], options.get('boost', 1.0))
+
+    def term_query(self, field, value, boost=1.0):
+        if self.get_type(field) is None:
+            return lambda document: None
+        term = self.to_term(field, value)
+        if self.get_type(field) == 'text':
+            # The terms of a text field are lowercased tokens
+            term = term.lower()
+        index = self.index
+        frequencies = index.get_frequencies
+
+        def query(document):
+            if term not in frequencies(document, field):
+                return None
+            return index.bm25(document, field, term) * boost
+        return query
+
+    def compile_terms(self, body):
+        boost = body.get('boost', 1.0)
+        field, values = single_field('terms', body)
+        if isinstance(values, dict):
+            raise bad_request('terms lookup is not supported by the in-memory engine',
+                              error_type='parsing_exception')
+        if self.get_type(field) is None:
+            return lambda document: None
+        wanted = set(self.to_term(field, value) for value in values)
+        terms = self.terms(field)
+
+        def query(document):
+            for term in terms(document):
+                if term in wanted:
+                    return boost
+            return None
+        return query
+
+    def compile_range(self, body):
+        field, options = single_field('range', body)
+        field_type = self.get_type(field)
+        if field_type is None:
+            return lambda document: None
+        options = dict(options)
+        boost = options.pop('boost', 1.0)
+        include_lower = options.pop('include_lower', True)
+        include_upper = options.pop('include_upper', True)
+        for key in ('format', 'time_zone', 'relation'):
+            options.pop(key, None)
+        bounds = []
+        for key, value in six.iteritems(options):
+            if value is None:
+                continue
+            if key == 'from':
+                key = 'gte' if include_lower else 'gt'
+            elif key == 'to':
+                key = 'lte' if include_upper else 'lt'
+            if key not in ('gt', 'gte', 'lt', 'lte'):
+                raise bad_request('[range] query does not support [%s]' % key,
+                                  error_type='parsing_exception')
+            if field_type == 'text':
+                value = six.text_type(value).lower()
+            bounds.append((key, self.to_term(field, value)))
+        terms = self.terms(field)
+
+        def in_range(term):
+            for key, bound in bounds:
+                if ((key == 'gt' and not term > bound) or (key == 'gte' and not term >= bound) or
+                        (key == 'lt' and not term < bound) or (key == 'lte' and not term <= bound)):
+                    return False
+            return True
+
+        def query(document):
+            for term in terms(document):
+                if in_range(term):
+                    return boost
+            return None
+        return query
+
+    def pattern_query(self, query_type, body, compile_pattern):
+        field, options = single_field(query_type, body)
+        if not isinstance(options, dict):
+            options = {'value': options}
+        if self.get_type(field) is None:
+            return lambda document: None
+        value = options.get('value', options.get(query_type))
+        matches = compile_pattern(six.text_type(value))
+        boost = options.get('boost', 1.0)
+        terms = self.terms(field)
+
+        def query(document):
+            for term in terms(document):
+                if matches(six.text_type(term)):
+                    return boost
+            return None
+        return query
+
+    def compile_prefix(self, body):
+        return self.pattern_query('prefix', body,
+                                  lambda value: lambda term: term.startswith(value))
+
+    def compile_wildcard(self, body):
+        def compile_pattern(value):
+            pattern = re.compile(re.escape(value).replace(r'\*', '.*').replace(r'\?', '.') + '$',
+                                 re.DOTALL)
+            return pattern.match
+        return self.pattern_query('wildcard', body, compile_pattern)
+
+    def compile_regexp(self, body):
+        def compile_pattern(value):
+            try:
+                pattern = re.compile('(?:%s)$' % value, re.DOTALL)
+            except re.error:
+                raise bad_request('invalid regular expression [%s]' % value)
+            return pattern.match
+        return self.pattern_query('regexp', body, compile_pattern)
+
+    def get_query_terms(self, field, text):
+        if self.get_type(field) == 'text':
+            return analyze(text)
+        return [text]
+
+    def compile_match(self, body):
+        field, options = single_field('match', body)
+        if not isinstance(options, dict):
+            options = {'query': options}
+        return self.match_query(field, options)
+
+    def match_query(self, field, options, boost=1.0):
+        field_type = self.get_type(field)
+        if field_type is None:
+            return lambda document: None
+        boost *= options.get('boost', 1.0)
+        if options.get('type') in ('phrase', 'phrase_prefix'):
+            return self.phrase_query(field, options, options['type'] == 'phrase_prefix', boost)
+        if field_type != 'text':
+            if options.get('lenient'):
+                try:
+                    to_term(field_type, options['query'])
+                except (ValueError, TypeError, ElasticError):
+                    return lambda document: None
+            return self.term_query(field, options['query'], boost)
+
+        tokens = analyze(options['query'])
+        if not tokens:
+            if options.get('zero_terms_query', 'none') == 'all':
+                return lambda document: boost
+            return lambda document: None
+        operator = six.text_type(options.get('operator', 'or')).lower()
+        required = get_minimum_should_match(options.get('minimum_should_match'), len(tokens))
+        if operator == 'and':
+            required = len(tokens)
+        elif required is None:
+            required = 1
+        fuzziness = options.get('fuzziness')
+        prefix_length = options.get('prefix_length', 0)
+        index = self.index
+
+        def term_score(document, token):
+            frequencies = index.get_frequencies(document, field)
+            if token in frequencies:
+                return index.bm25(document, field, token)
+            distance = get_fuzziness(fuzziness, token)
+            if not distance:
+                return None
+            scores = [index.bm25(document, field, term) * (1 - edit / max(len(token), 1))
+                      for term, edit in ((term, edit_distance(token, term, distance))
+                                         for term in frequencies
+                                         if term[:prefix_length] == token[:prefix_length])
+                      if edit <= distance]
+            return max(scores) if scores else None
+
+        def query(document):
+            matched = 0
+            score = 0.0
+            for token in tokens:
+                token_score = term_score(document, token)
+                if token_score is not None:
+                    matched += 1
+                    score += token_score
+            if not matched or matched < required:
+                return None
+            return score * boost
+        return query
+
+    def compile_match_phrase(self, body):
+        field, options = single_field('match_phrase', body)
+        if not isinstance(options, dict):
+            options = {'query': options}
+        return self.phrase_query(field, options, False)
+
+    def compile_match_phrase_prefix(self, body):
+        field, options = single_field('match_phrase_prefix', body)
+        if not isinstance(options, dict):
+            options = {'query': options}
+        return self.phrase_query(field, options, True)
+
+    def phrase_query(self, field, options, prefix, boost=1.0):
+        if self.get_type(field) is None:
+            return lambda document: None
+        if self.get_type(field) != 'text':
+            if prefix:
+                return self.compile_prefix({field: options['query']})
+            return self.term_query(field, options['query'], boost)
+        tokens = analyze(options['query'])
+        if not tokens:
+            return lambda document: None
+        slop = options.get('slop', 0)
+        boost *= options.get('boost', 1.0)
+        max_expansions = options.get('max_expansions', 50)
+        index = self.index
+
+        def matches_at(phrase, start):
+            position = start
+            for i, token in enumerate(tokens[1:], 1):
+                last = prefix and i == len(tokens) - 1
+                window = phrase[position + 1:position + 2 + slop]
+                for offset, term in enumerate(window):
+                    if term == token or (last and term.startswith(token)):
+                        position += 1 + offset
+                        break
+                else:
+                    return False
+            return True
+
+        def query(document):
+            frequencies = index.get_frequencies(document, field)
+            first = tokens[0]
+            if len(tokens) == 1 and prefix:
+                expansions = [term for term in frequencies if term.startswith(first)]
+                if not expansions:
+                    return None
+                return sum(index.bm25(document, field, term)
+                           for term in expansions[:max_expansions]) * boost
+            if first not in frequencies:
+                return None
+            count = 0
+            for phrase in index.get_phrases(document, field):
+                for start, term in enumerate(phrase):
+                    if term == first and matches_at(phrase, start):
+                        count += 1
+            if not count:
+                return None
+            return sum(index.bm25(document, field, token) for token in tokens
+                       if token in frequencies) * boost
+        return query
+
+    def expand_fields(self, fields):
+        """Return the (field, boost) of the `field^boost` patterns."""
+        if isinstance(fields, six.string_types):
+            fields = [fields]
+        expanded = []
+        for field in fields or ['*']:
+            boost = 1.0
+            if '^' in field:
+                field, boost = field.rsplit('^', 1)
+                boost = float(boost)
+            names = self.index.get_fields(field) if '*' in field else [field]
+            if '*' in field:
+                # Only the searchable string and numeric fields
+                names = [name for name in names
+                         if self.get_type(name) in STRING_TYPES]
+            expanded.extend((name, boost) for name in names)
+        return expanded
+
+    def compile_multi_match(self, body):
+        options = dict(body)
+        query_type = options.pop('type', 'best_fields')
+        fields = self.expand_fields(options.pop('fields', None))
+        boost = options.pop('boost', 1.0)
+        tie_breaker = options.pop('tie_breaker', 1.0 if query_type == 'most_fields' else 0.0)
+        if query_type in ('phrase', 'phrase_prefix'):
+            options['type'] = query_type
+        elif query_type not in ('best_fields', 'most_fields', 'cross_fields'):
+            raise bad_request('[multi_match] query does not support type %s' % query_type,
+                              error_type='parsing_exception')
+
+        if query_type == 'cross_fields':
+            # Every token must match in any of the fields with the `and` operator
+            tokens = analyze(options.get('query', ''))
+            queries = [
+                [self.match_query(field, dict(options, query=token, operator='or'), field_boost)
+                 for field, field_boost in fields]
+                for token in tokens
+            ]
+            operator = six.text_type(options.get('operator', 'or')).lower()
+            required = len(tokens) if operator == 'and' else get_minimum_should_match(
+                options.get('minimum_should_match'), len(tokens)) or 1
+
+            def cross_query(document):
+                matched = 0
+                score = 0.0
+                for token_queries in queries:
+                    scores = [score for score in (q(document) for q in token_queries)
+                              if score is not None]
+                    if scores:
+                        matched += 1
+                        score += max(scores)
+                if not matched or matched < required:
+                    return None
+                return score * boost
+            return cross_query
+
+        queries = [self.match_query(field, dict(options), field_boost)
+                   for field, field_boost in fields]
+
+        def query(document):
+            scores = [score for score in (clause(document) for clause in queries)
+                      if score is not None]
+            if not scores:
+                return None
+            best = max(scores)
+            return (best + tie_breaker * (sum(scores) - best)) * boost
+        return query
+
+    def geo_field(self, query_type, body):
+        field, options = single_field(query_type, body)
+        if self.get_type(field) != 'geo_point':
+            if self.get_type(field) is None and body.get('ignore_unmapped'):
+                return field, options, None
+            raise bad_request('failed to find geo_point field [%s]' % field,
+                              error_type='query_shard_exception')
+        return field, options, self.terms(field)
+
+    def compile_geo_bounding_box(self, body):
+        field, options, terms = self.geo_field('geo_bounding_box', body)
+        if terms is None:
+            return lambda document: None
+        if 'top_left' in options or 'bottom_right' in options:
+            top, left = parse_geo_point(options['top_left'])
+            bottom, right = parse_geo_point(options['bottom_right'])
+        elif 'top_right' in options or 'bottom_left' in options:
+            top, right = parse_geo_point(options['top_right'])
+            bottom, left = parse_geo_point(options['bottom_left'])
+        else:
+            try:
+                top, left = options['top'], options['left']
+                bottom, right = options['bottom'], options['right']
+            except KeyError:
+                raise bad_request('failed to parse [geo_bbox] query',
+                                  error_type='parsing_exception')
+        boost = body.get('boost', 1.0)
+
+        def inside(point):
+            lat, lon = point
+            if not bottom <= lat <= top:
+                return False
+            if left <= right:
+                return left <= lon <= right
+            # The box crosses the dateline
+            return lon >= left or lon <= right
+
+        def query(document):
+            for point in terms(document):
+                if inside(point):
+                    return boost
+            return None
+        return query
+
+    def compile_geo_distance(self, body):
+        field, point, terms = self.geo_field('geo_distance', body)
+        if terms is None:
+            return lambda document: None
+        origin = parse_geo_point(point)
+        distance = parse_distance(body['distance'])
+        measure = plane_distance if body.get('distance_type') == 'plane' else arc_distance
+        boost = body.get('boost', 1.0)
+
+        def query(document):
+            for other in terms(document):
+                if measure(origin, other) <= distance:
+                    return boost
+            return None
+        return query
+
+
+SHARDS = {'total': 2, 'successful': 1, 'failed': 0}
+INDEX_NAME_RE = re.compile(r'^[^A-Z\\/*?"<>| ,#:_\-+][^A-Z\\/*?"<>| ,#:]*$')
+# Keys of the search body executed by the engine
+SEARCH_KEYS = frozenset([
+    'query', 'post_filter', 'aggs', 'aggregations', 'sort', 'from', 'size', '_source',
+    'search_after', 'min_score', 'track_scores', 'track_total_hits', 'version',
+    'seq_no_primary_term', 'profile', 'timeout', 'terminate_after', 'explain',
+    'stored_fields', 'docvalue_fields', 'slice',
+])
+
+
+def is_true(value):
+    return value in (True, 'true', '')
+
+
+def get_sort_key(value):
+    """Order of the sort values of different types, `None` is handled separately."""
+    if isinstance(value, bool):
+        return 0, value
+    if isinstance(value, six.integer_types + (float,)):
+        return 1, value
+    return 2, six.text_type(value)
+
+
+class InMemoryEngine(object):
+    """
+    In-process stand-in of an Elasticsearch 6 node for the tests and the
+    benchmarks, it executes the REST requests of the client against the
+    indices kept in memory. The engine is used through the client returned
+    by `get_in_memory_client()`.
+
+    The documents are searchable immediately unless the `refresh_interval`
+    of the index is `-1`, the queries, aggregations and scripts which are
+    not supported fail with a 400 error instead of returning wrong results.
+    """
+
+    def __init__(self):
+        self.indices = OrderedDict()
+        self.templates = OrderedDict()
+        self.scrolls = {}
+        self.tasks = OrderedDict()
+        self.scripts = {COUNTERS_SCRIPT: update_counters}
+        self._compiled_scripts = {}
+        self._lock = threading.RLock()
+
+    def register_script(self, source, function):
+        """Execute the `function(ctx, params)` for a painless script source."""
+        self.scripts[source] = function
+
+    def reset(self):
+        """Remove the indices, the templates and the state of the requests."""
+        with self._lock:
+            self.indices.clear()
+            self.templates.clear()
+            self.scrolls.clear()
+            self.tasks.clear()
+
+    # Requests
+
+    def decode_body(self, path, body):
+        if body is None:
+            return None
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+        if path.rstrip('/').endswith(('_bulk', '_msearch')):
+            return [json.loads(line) for line in body.splitlines() if line.strip()]
+        return json.loads(body) if body.strip() else None
+
+    def perform_request(self, method, url, params=None, body=None):
+        """Execute a request and return the (status, response body)."""
+        path = url.split('?', 1)[0]
+        params = dict((key, value.decode('utf-8') if isinstance(value, bytes) else value)
+                      for key, value in six.iteritems(params or {}))
+        try:
+            body = self.decode_body(path, body)
+        except ValueError as e:
+            error = bad_request('Failed to parse the request body: %s' % e,
+                                error_type='parse_exception')
+            return error.status, error.to_dict()
+        with self._lock:
+            try:
+                return self.dispatch(method.upper(), path, params, body)
+            except ElasticError as e:
+                return e.status, e.to_dict()
+
+    def dispatch(self, method, path, params, body):
+        parts = [unquote(part) for part in path.split('/') if part]
+        if not parts:
+            return self.api_root(method, params)
+        index = doc_type = None
+        if parts[0].startswith('_') and parts[0] != '_all':
+            api, rest = parts[0][1:], parts[1:]
+        else:
+            index, rest = parts[0], parts[1:]
+            if not rest:
+                api = 'index'
+            elif rest[0].startswith('_') and rest[0] != '_doc':
+                api, rest = rest[0][1:], rest[1:]
+            else:
+                doc_type, rest = rest[0], rest[1:]
+                if not rest:
+                    api = 'type'
+                elif rest[0] in ('_search', '_count', '_mapping', '_bulk', '_mget',
+                                 '_msearch', '_delete_by_query', '_update_by_query'):
+                    api, rest = rest[0][1:], rest[1:]
+                else:
+                    api = 'document'
+        handler = getattr(self, 'api_%s' % api, None)
+        if handler is None:
+            raise bad_request('no handler found for uri [%s] and method [%s], it is not '
+                              'supported by the in-memory engine' % (path, method))
+        return handler(method, index, doc_type, rest, params, body)
+
+    def api_root(self, method, params):
+        if method == 'HEAD':
+            return 200, None
+        return 200, {
+            'name': 'in-memory',
+            'cluster_name': 'in-memory',
+            'cluster_uuid': 'in-memory',
+            'version': {'number': VERSION, 'build_flavor': 'default',
+                        'lucene_version': '7.7.0'},
+            'tagline': 'You Know, for Search',
+        }
+
+    # Indices
+
+    def resolve(self, expression, params=None, closed=False):
+        """Return the indices of a names, aliases and wildcards expression."""
+        params = params or {}
+        if expression in (None, '', '_all', '*'):
+            names = ['*']
+        elif isinstance(expression, (list, tuple)):
+            names = list(expression)
+        else:
+            names = six.text_type(expression).split(',')
+        ignore_unavailable = is_true(params.get('ignore_unavailable', False))
+        indices = OrderedDict()
+        for name in names:
+            exclude = name.startswith('-') and name != '-'
+            if exclude:
+                name = name[1:]
+            if '*' in name or '?' in name:
+                matched = [index for index in six.itervalues(self.indices)
+                           if fnmatch.fnmatchcase(index.name, name) or
+                           any(fnmatch.fnmatchcase(alias, name) for alias in index.aliases)]
+            elif name in self.indices:
+                matched = [self.indices[name]]
+            else:
+                matched = [index for index in six.itervalues(self.indices)
+                           if name in index.aliases]
+                if not matched and not exclude and not ignore_unavailable:
+                    raise not_found('no such index', index=name, **{'resource.id': name,
+                                                                    'resource.type': 'index_or_alias'})
+            for index in matched:
+                if exclude:
+                    indices.pop(index.name, None)
+                else:
+                    indices[index.name] = index
+        if not closed:
+            for index in indices.values():
+                if index.closed and not ignore_unavailable:
+                    index.check_open()
+            return [index for index in indices.values() if not index.closed]
+        return list(indices.values())
+
+    def get_index(self, name):
+        index = self.indices.get(name)
+        if index is None:
+            raise not_found('no such index', index=name,
+                            **{'resource.id': name, 'resource.type': 'index_expression'})
+        return index
+
+    def get_write_index(self, name, params=None):
+        """Return the index of a write, the index is created when it doesn't exist."""
+        if name in self.indices:
+            return self.indices[name]
+        aliased = [index for index in six.itervalues(self.indices) if name in index.aliases]
+        if len(aliased) > 1:
+            aliased = [index for index in aliased if index.aliases[name].get('is_write_index')]
+            if len(aliased) != 1:
+                raise bad_request(
+                    'no write index is defined for alias [%s]. The write index may be '
+                    'explicitly disabled using is_write_index=false or the alias points to '
+                    'multiple indices without one being designated as a write index' % name)
+        if aliased:
+            return aliased[0]
+        return self.create_index(name)
+
+    def create_index(self, name, body=None):
+        if name in self.indices:
+            raise bad_request('index [%s/%s] already exists' % (
+                name, self.indices[name].settings['index.uuid']),
+                error_type='resource_already_exists_exception', index=name)
+        if not INDEX_NAME_RE.match(name) or name in ('.', '..'):
+            raise bad_request('Invalid index name [%s]' % name,
+                              error_type='invalid_index_name_exception', index=name)
+        if any(name in index.aliases for index in six.itervalues(self.indices)):
+            raise bad_request('Invalid index name [%s], already exists as alias' % name,
+                              error_type='invalid_index_name_exception', index=name)
+        config = {'settings': {}, 'mappings': {}, 'aliases': {}}
+        templates = sorted(
+            (template for template in six.itervalues(self.templates)
+             if any(fnmatch.fnmatchcase(name, pattern)
+                    for pattern in template.get('index_patterns', ()))),
+            key=lambda template: template.get('order', 0))
+        for template in templates + [body or {}]:
+            for key in config:
+                deep_merge(config[key], template.get(key) or {})
+        index = InMemoryIndex(name, config['settings'], config['mappings'], config['aliases'])
+        self.indices[name] = index
+        return index
+
+    def api_index(self, method, index, doc_type, rest, params, body):
+        if method == 'PUT':
+            self.create_index(index, body)
+            return 200, {'acknowledged': True, 'shards_acknowledged': True, 'index': index}
+        if method == 'HEAD':
+            try:
+                return (200 if self.resolve(index, params, closed=True) else 404), None
+            except ElasticError:
+                return 404, None
+        if method == 'GET':
+            return 200, OrderedDict(
+                (item.name, {'aliases': dict(item.aliases), 'mappings': item.get_mapping(),
+                             'settings': nest_settings(item.settings)})
+                for item in self.resolve(index, params, closed=True))
+        if method == 'DELETE':
+            for name in six.text_type(index).split(','):
+                if '*' not in name and name not in self.indices:
+                    if any(name in item.aliases for item in self.indices.values()):
+                        raise bad_request(
+                            'The provided expression [%s] matches an alias, specify the '
+                            'corresponding concrete indices instead.' % name)
+            for item in self.resolve(index, params, closed=True):
+                del self.indices[item.name]
+                for scroll_id in [key for key, scroll in six.iteritems(self.scrolls)
+                                  if item.name in scroll['indices']]:
+                    del self.scrolls[scroll_id]
+            return 200, {'acknowledged': True}
+        raise bad_request('Incorrect HTTP method for uri [/%s] and method [%s]' % (index, method))
+
+    def api_open(self, method, index, doc_type, rest, params, body):
+        for item in self.resolve(index, params, closed=True):
+            item.closed = False
+        return 200, {'acknowledged': True, 'shards_acknowledged': True}
+
+    def api_close(self, method, index, doc_type, rest, params, body):
+        for item in self.resolve(index, params, closed=True):
+            item.closed = True
+        return 200, {'acknowledged': True}
+
+    def api_refresh(self, method, index, doc_type, rest, params, body):
+        indices = self.resolve(index, params)
+        for item in indices:
+            item.refresh()
+        return 200, {'_shards': {'total': len(indices) * 2, 'successful': len(indices),
+                                 'failed': 0}}
+
+    def api_flush(self, method, index, doc_type, rest, params, body):
+        return self.api_refresh(method, index, doc_type, rest, params, body)
+
+    def api_forcemerge(self, method, index, doc_type, rest, params, body):
+        return self.api_refresh(method, index, doc_type, rest, params, body)
+
+    def api_settings(self, method, index, doc_type, rest, params, body):
+        indices = self.resolve(index, params, closed=True)
+        if method in ('PUT', 'POST'):
+            body = body or {}
+            for item in indices:
+                item.update_settings(body.get('settings', body))
+            return 200, {'acknowledged': True}
+        names = rest[0].split(',') if rest else None
+        response = OrderedDict()
+        for item in indices:
+            settings = item.settings
+            if names:
+                settings = dict((key, value) for key, value in six.iteritems(settings)
+                                if match_patterns(key, names) or
+                                match_patterns(key[len('index.'):], names))
+            if not is_true(params.get('flat_settings', False)):
+                settings = nest_settings(settings)
+            response[item.name] = {'settings': settings}
+        return 200, response
+
+    def api_mapping(self, method, index, doc_type, rest, params, body):
+        doc_type = doc_type or (rest[0] if rest else None)
+        if method in ('PUT', 'POST'):
+            body = body or {}
+            if doc_type is None and 'properties' not in body and len(body) == 1:
+                doc_type, body = next(six.iteritems(body))
+            for item in self.resolve(index, params):
+                item.put_mapping(doc_type, body)
+            return 200, {'acknowledged': True}
+        indices = self.resolve(index, params, closed=True)
+        if method == 'HEAD':
+            exists = any(item.doc_type in (doc_type or '').split(',') for item in indices)
+            return (200 if exists else 404), None
+        response = OrderedDict()
+        for item in indices:
+            mappings = item.get_mapping()
+            if doc_type:
+                mappings = dict((name, mapping) for name, mapping in six.iteritems(mappings)
+                                if match_patterns(name, doc_type.split(',')))
+            response[item.name] = {'mappings': mappings}
+        return 200, response
+
+    def api_type(self, method, index, doc_type, rest, params, body):
+        if method == 'POST':
+            return self.index_document(index, doc_type, None, body, params)
+        raise bad_request('Incorrect HTTP method for uri [/%s/%s] and method [%s]' % (
+            index, doc_type, method))
+
+    # Aliases
+
+    def api_alias(self, method, index, doc_type, rest, params, body):
+        names = rest[0].split(',') if rest else ['*']
+        if method in ('PUT', 'POST'):
+            for item in self.resolve(index, params):
+                for name in names:
+                    self.add_alias(item, name, body or {})
+            return 200, {'acknowledged': True}
+        if method == 'DELETE':
+            removed = False
+            for item in self.resolve(index, params):
+                for alias in [alias for alias in item.aliases if match_patterns(alias, names)]:
+                    del item.aliases[alias]
+                    removed = True
+            if not removed:
+                raise not_found('aliases [%s] missing' % ','.join(names),
+                                error_type='aliases_not_found_exception')
+            return 200, {'acknowledged': True}
+
+        response = OrderedDict()
+        found = set()
+        for item in self.resolve(index, params, closed=True):
+            aliases = dict((alias, options) for alias, options in six.iteritems(item.aliases)
+                           if match_patterns(alias, names))
+            found.update(aliases)
+            if aliases or not rest:
+                response[item.name] = {'aliases': aliases}
+        missing = [name for name in names if '*' not in name and name not in found]
+        if method == 'HEAD':
+            return (404 if missing or not found and rest else 200), None
+        if missing:
+            response['error'] = 'alias [%s] missing' % ','.join(missing)
+            response['status'] = 404
+            return 404, response
+        return 200, response
+
+    def api_aliases(self, method, index, doc_type, rest, params, body):
+        if method == 'GET':
+            return self.api_alias(method, index, doc_type, rest, params, body)
+        actions = (body or {}).get('actions', [])
+        # The actions are validated before any of them is applied
+        changes = []
+        for action in actions:
+            (name, options), = six.iteritems(action)
+            options = dict(options)
+            expressions = options.pop('indices', None) or [options.pop('index', None)]
+            if name == 'remove_index':
+                changes.append((name, self.resolve(expressions), None, options))
+                continue
+            aliases = options.pop('aliases', None) or [options.pop('alias', None)]
+            if name not in ('add', 'remove') or None in aliases or None in expressions:
+                raise bad_request('[%s] is unsupported or incomplete alias action' % name)
+            indices = self.resolve(expressions)
+            if name == 'remove':
+                for item in indices:
+                    if not any(match_patterns(alias, aliases) for alias in item.aliases):
+                        raise not_found('aliases [%s] missing' % ','.join(aliases),
+                                        error_type='aliases_not_found_exception')
+            changes.append((name, indices, aliases, options))
+        for name, indices, aliases, options in changes:
+            for item in indices:
+                if name == 'remove_index':
+                    self.indices.pop(item.name, None)
+                elif name == 'add':
+                    for alias in aliases:
+                        self.add_alias(item, alias, options)
+                else:
+                    for alias in [alias for alias in item.aliases
+                                  if match_patterns(alias, aliases)]:
+                        del item.aliases[alias]
+        return 200, {'acknowledged': True}
+
+    def add_alias(self, index, alias, options):
+        if alias in self.indices:
+            raise bad_request('an index or data stream exists with the same name as the '
+                              'alias', error_type='invalid_alias_name_exception')
+        index.aliases[alias] = dict((key, value) for key, value in six.iteritems(options)
+                                    if key in ('filter', 'routing', 'index_routing',
+                                               'search_routing', 'is_write_index'))
+
+    # Templates, tasks and cluster
+
+    def api_template(self, method, index, doc_type, rest, params, body):
+        name = rest[0] if rest else '*'
+        if method in ('PUT', 'POST'):
+            if is_true(params.get('create', False)) and name in self.templates:
+                raise bad_request('index_template [%s] already exists' % name)
+            template = dict(body or {})
+            if 'template' in template and 'index_patterns' not in template:
+                template['index_patterns'] = [template.pop('template')]
+            if isinstance(template.get('index_patterns'), six.string_types):
+                template['index_patterns'] = [template['index_patterns']]
+            self.templates[name] = template
+            return 200, {'acknowledged': True}
+        names = [key for key in self.templates if match_patterns(key, name.split(','))]
+        if not names and rest and '*' not in name:
+            if method == 'HEAD':
+                return 404, None
+            raise not_found('index_template [%s] missing' % name,
+                            error_type='resource_not_found_exception')
+        if method == 'DELETE':
+            for key in names:
+                del self.templates[key]
+            return 200, {'acknowledged': True}
+        if method == 'HEAD':
+            return 200, None
+        return 200, OrderedDict((key, self.templates[key]) for key in names)
+
+    def api_tasks(self, method, index, doc_type, rest, params, body):
+        if not rest:
+            return 200, {'nodes': {}}
+        task = self.tasks.get(rest[0])
+        if task is None:
+            raise not_found('task [%s] isn\'t running and hasn\'t stored its results' % rest[0],
+                            error_type='resource_not_found_exception')
+        if len(rest) > 1 and rest[1] == '_cancel':
+            return 200, {'nodes': {}}
+        return 200, task
+
+    def api_cluster(self, method, index, doc_type, rest, params, body):
+        if rest and rest[0] == 'health':
+            indices = self.resolve(rest[1] if len(rest) > 1 else None, params, closed=True)
+            return 200, {
+                'cluster_name': 'in-memory', 'status': 'green', 'timed_out': False,
+                'number_of_nodes': 1, 'number_of_data_nodes': 1,
+                'active_primary_shards': sum(int(item.settings['index.number_of_shards'])
+                                             for item in indices),
+                'active_shards': sum(int(item.settings['index.number_of_shards'])
+                                     for item in indices),
+                'relocating_shards': 0, 'initializing_shards': 0, 'unassigned_shards': 0,
+                'number_of_pending_tasks': 0,
+            }
+        if rest and rest[0] == 'state':
+            expression = rest[2] if len(rest) > 2 else None
+            indices = self.resolve(expression, params, closed=True)
+            return 200, {'cluster_name': 'in-memory', 'metadata': {'indices': OrderedDict(
+                (item.name, {
+                    'state': 'close' if item.closed else 'open',
+                    'settings': nest_settings(item.settings),
+                    'mappings': item.get_mapping(),
+                    'aliases': list(item.aliases),
+                }) for item in indices
+            )}}
+        raise bad_request('[_cluster/%s] is not supported by the in-memory engine' %
+                          '/'.join(rest))
+
+    # Documents
+
+    def version_conflict(self, index, doc_type, doc_id, reason):
+        return ElasticError(409, 'version_conflict_engine_exception',
+                            '[%s][%s]: version conflict, %s' % (doc_type, doc_id, reason),
+                            index=index.name, shard='0', index_uuid=index.settings['index.uuid'])
+
+    def check_version(self, index, doc_type, doc_id, current, options):
+        """Return the version of a write, raise the conflicts."""
+        version_type = options.get('version_type', 'internal')
+        version = options.get('version')
+        version = int(version) if version is not None else None
+        previous = current.version if current is not None else index.tombstones.get(doc_id)
+        if options.get('if_seq_no') is not None:
+            if current is None or current.seq_no != int(options['if_seq_no']):
+                raise self.version_conflict(
+                    index, doc_type, doc_id, 'required seqNo [%s], primary term [1]. current '
+                    'document has seqNo [%s] and primary term [1]' % (
+                        options['if_seq_no'], current.seq_no if current else -2))
+        if version_type in ('external', 'external_gt', 'external_gte'):
+            if version is None:
+                raise bad_request('Validation Failed: 1: an external version is required;',
+                                  error_type='action_request_validation_exception')
+            if previous is not None and (version < previous or (
+                    version == previous and version_type != 'external_gte')):
+                raise self.version_conflict(
+                    index, doc_type, doc_id, 'current version [%s] is higher or equal to the '
+                    'one provided [%s]' % (previous, version))
+            return version
+        if version_type == 'force':
+            return version
+        if version is not None and (current is None or current.version != version):
+            raise self.version_conflict(
+                index, doc_type, doc_id, 'current version [%s] is different than the one '
+                'provided [%s]' % (current.version if current else -1, version))
+        return (previous or 0) + 1
+
+    def refresh_after(self, index, options):
+        if options.get('refresh') not in (None, False, 'false'):
+            index.refresh()
+
+    def write_result(self, index, document, result):
+        return {
+            '_index': index.name, '_type': document.type, '_id': document.id,
+            '_version': document.version, 'result': result, '_shards': SHARDS,
+            '_seq_no': document.seq_no, '_primary_term': 1,
+        }
+
+    def index_document(self, name, doc_type, doc_id, source, options):
+        index = self.get_write_index(name)
+        index.check_open()
+        if doc_id is None:
+            if options.get('op_type') not in (None, 'create') and 'version' in options:
+                raise bad_request('an id is required for a versioned write')
+            doc_id = uuid.uuid4().hex[:20]
+        doc_id = six.text_type(doc_id)
+        current = index.documents.get(doc_id)
+        if options.get('op_type') == 'create' and current is not None:
+            raise self.version_conflict(index, current.type, doc_id,
+                                        'document already exists (current version [%s])' %
+                                        current.version)
+        doc_type, cache = index.prepare(doc_type, source)
+        version = self.check_version(index, doc_type, doc_id, current, options)
+        document = InMemoryDocument(doc_id, doc_type, source, version, 0)
+        document.cache = cache
+        index.write(document)
+        self.refresh_after(index, options)
+        return (201 if current is None else 200,
+                self.write_result(index, document, 'created' if current is None else 'updated'))
+
+    def get_document(self, name, doc_id):
+        """Return the (index, document) of a realtime get."""
+        indices = self.resolve(name)
+        if len(indices) > 1:
+            raise bad_request('Alias [%s] has more than one indices associated with it [%s], '
+                              'can\'t execute a single index op' % (
+                                  name, sorted(index.name for index in indices)))
+        if not indices:
+            raise not_found('no such index', index=name)
+        index = indices[0]
+        return index, index.documents.get(six.text_type(doc_id))
+
+    def delete_document(self, name, doc_type, doc_id, options):
+        index, current = self.get_document(name, doc_id)
+        if current is None:
+            if options.get('version') is not None or options.get('if_seq_no') is not None:
+                self.check_version(index, doc_type, doc_id, None, options)
+            index.seq_no += 1
+            return 404, {'_index': index.name, '_type': doc_type or index.doc_type,
+                         '_id': doc_id, '_version': 1, 'result': 'not_found',
+                         '_shards': SHARDS, '_seq_no': index.seq_no, '_primary_term': 1}
+        version = self.check_version(index, current.type, current.id, current, options)
+        document = InMemoryDocument(current.id, current.type, current.source, version,
+                                    index.remove(current.id, version))
+        self.refresh_after(index, options)
+        return 200, self.write_result(index, document, 'deleted')
+
+    def get_script(self, script):
+        if isinstance(script, six.string_types):
+            script = {'source': script}
+        source = script.get('source', script.get('inline'))
+        if source is None or script.get('lang', 'painless') != 'painless':
+            raise bad_request('only the inline painless scripts are supported by the '
+                              'in-memory engine', error_type='script_exception')
+        function = self.scripts.get(source) or self._compiled_scripts.get(source)
+        if function is None:
+            try:
+                function = self._compiled_scripts[source] = compile_script(source)
+            except ValueError:
+                raise bad_request(
+                    'compile error, the script is not supported by the in-memory engine, '
+                    'register its Python version with register_script()',
+                    error_type='script_exception', script=source, lang='painless')
+        return function, script.get('params', {})
+
+    def run_script(self, script, document_id, source, op='index'):
+        """Run an update script, return the (op, source)."""
+        function, params = self.get_script(script)
+        ctx = {'_source': copy.deepcopy(source), 'op': op, '_id': document_id}
+        try:
+            function(ctx, params)
+        except ElasticError:
+            raise
+        except Exception as e:
+            raise bad_request('runtime error: %r' % e, error_type='script_exception')
+        return ctx['op'], ctx['_source']
+
+    def update_document(self, name, doc_type, doc_id, body, options):
+        body = body or {}
+        index, current = self.get_document(name, doc_id)
+        if current is None:
+            if 'upsert' in body and not body.get('scripted_upsert'):
+                return self.index_document(name, doc_type, doc_id,
+                                           copy.deepcopy(body['upsert']), options)
+            if body.get('doc_as_upsert') and 'doc' in body:
+                return self.index_document(name, doc_type, doc_id,
+                                           copy.deepcopy(body['doc']), options)
+            if body.get('scripted_upsert') and 'script' in body:
+                op, source = self.run_script(body['script'], doc_id,
+                                             body.get('upsert', {}), 'create')
+                if op == 'none':
+                    return 200, {'_index': index.name, '_type': doc_type, '_id': doc_id,
+                                 '_version': 0, 'result': 'noop', '_shards': SHARDS}
+                return self.index_document(name, doc_type, doc_id, source, options)
+            raise ElasticError(404, 'document_missing_exception',
+                               '[%s][%s]: document missing' % (doc_type or index.doc_type,
+                                                               doc_id),
+                               index=index.name, shard='0')
+
+        if 'script' in body:
+            op, source = self.run_script(body['script'], current.id, current.source)
+            if op == 'delete':
+                return self.delete_document(index.name, current.type, current.id, options)
+        elif 'doc' in body:
+            op, source = 'index', deep_merge(copy.deepcopy(current.source), body['doc'])
+            if body.get('detect_noop', True) and source == current.source:
+                op = 'none'
+        else:
+            raise bad_request('Validation Failed: 1: script or doc is missing;',
+                              error_type='action_request_validation_exception')
+        if op == 'none':
+            return 200, self.write_result(index, current, 'noop')
+        options = dict((key, value) for key, value in six.iteritems(options)
+                       if key not in ('version', 'version_type'))
+        if options.get('if_seq_no') is None:
+            options['version'] = current.version
+        status, result = self.index_document(index.name, current.type, current.id, source,
+                                             options)
+        result['result'] = 'updated'
+        return 200, result
+
+    def get_result(self, index, doc_id, document, source_filter):
+        if document is None:
+            return {'_index': index.name, '_type': index.doc_type or '_doc',
+                    '_id': doc_id, 'found': False}
+        result = {'_index': index.name, '_type': document.type, '_id': document.id,
+                  '_version': document.version, '_seq_no': document.seq_no,
+                  '_primary_term': 1, 'found': True}
+        enabled, includes, excludes = source_filter
+        if enabled:
+            result['_source'] = (filter_source(document.source, includes, excludes)
+                                 if includes or excludes else document.source)
+        return result
+
+    def get_params_source_filter(self, params):
+        return get_source_filter(params.get('_source'),
+                                 params.get('_source_includes', params.get('_source_include')),
+                                 params.get('_source_excludes', params.get('_source_exclude')))
+
+    def api_document(self, method, index, doc_type, rest, params, body):
+        doc_id = rest[0]
+        endpoint = rest[1] if len(rest) > 1 else None
+        if endpoint == '_update' and method == 'POST':
+            return self.update_document(index, doc_type, doc_id, body, params)
+        if endpoint == '_create' and method in ('PUT', 'POST'):
+            return self.index_document(index, doc_type, doc_id, body,
+                                       dict(params, op_type='create'))
+        if endpoint in (None, '_source') and method in ('GET', 'HEAD'):
+            item, document = self.get_document(index, doc_id)
+            if endpoint == '_source':
+                if document is None:
+                    return 404, None if method == 'HEAD' else self.get_result(
+                        item, doc_id, None, (False, (), ()))
+                if method == 'HEAD':
+                    return 200, None
+                return 200, self.get_result(item, doc_id, document,
+                                            self.get_params_source_filter(params))['_source']
+            if method == 'HEAD':
+                return (200 if document is not None else 404), None
+            return (200 if document is not None else 404), self.get_result(
+                item, doc_id, document, self.get_params_source_filter(params))
+        if endpoint is None and method in ('PUT', 'POST'):
+            return self.index_document(index, doc_type, doc_id, body, params)
+        if endpoint is None and method == 'DELETE':
+            return self.delete_document(index, doc_type, doc_id, params)
+        raise bad_request('no handler found for uri [%s] and method [%s], it is not '
+                          'supported by the in-memory engine' % ('/'.join(rest), method))
+
+    def api_mget(self, method, index, doc_type, rest, params, body):
+        body = body or {}
+        docs = body.get('docs')
+        if docs is None:
+            docs = [{'_id': doc_id} for doc_id in body.get('ids', [])]
+        params_filter = self.get_params_source_filter(params)
+        results = []
+        for doc in docs:
+            name = doc.get('_index', index)
+            if name is None:
+                raise bad_request('Validation Failed: 1: index is missing for doc 0;',
+                                  error_type='action_request_validation_exception')
+            try:
+                item, document = self.get_document(name, doc['_id'])
+            except ElasticError as e:
+                results.append({'_index': name, '_type': doc.get('_type', doc_type),
+                                '_id': doc['_id'], 'error': e.to_dict()['error']})
+                continue
+            source_filter = (get_source_filter(doc['_source']) if '_source' in doc
+                             else params_filter)
+            results.append(self.get_result(item, six.text_type(doc['_id']), document,
+                                           source_filter))
+        return 200, {'docs': results}
+
+    def api_bulk(self, method, index, doc_type, rest, params, body):
+        started = time.time()
+        lines = list(body or [])
+        items = []
+        errors = False
+        refreshed = set()
+        i = 0
+        while i < len(lines):
+            (action, meta), = six.iteritems(lines[i])
+            i += 1
+            options = dict((key.lstrip('_'), value) for key, value in six.iteritems(meta))
+            name = options.pop('index', index)
+            item_type = options.pop('type', doc_type)
+            doc_id = options.pop('id', None)
+            if doc_id is not None:
+                doc_id = six.text_type(doc_id)
+            source = None
+            if action != 'delete':
+                source = lines[i]
+                i += 1
+            try:
+                if name is None:
+                    raise bad_request('Validation Failed: 1: index is missing;',
+                                      error_type='action_request_validation_exception')
+                if action in ('index', 'create'):
+                    if action == 'create':
+                        options['op_type'] = 'create'
+                    status, result = self.index_document(name, item_type, doc_id, source,
+                                                         options)
+                elif action == 'update':
+                    status, result = self.update_document(name, item_type, doc_id, source,
+                                                          options)
+                elif action == 'delete':
+                    status, result = self.delete_document(name, item_type, doc_id, options)
+                else:
+                    raise bad_request('Malformed action/metadata line [%d], expected one of '
+                                      '[create, delete, index, update] but found [%s]' % (
+                                          i, action))
+                refreshed.add(result['_index'])
+            except ElasticError as e:
+                status = e.status
+                result = {'_index': name, '_type': item_type, '_id': doc_id,
+                          'error': e.to_dict()['error']}
+            result = dict(result, status=status)
+            result.pop('found', None)
+            if status >= 400 and not (action == 'delete' and status == 404):
+                errors = True
+            items.append({action: result})
+        if params.get('refresh') not in (None, False, 'false'):
+            for name in refreshed:
+                self.indices[name].refresh()
+        return 200, {'took': int((time.time() - started) * 1000), 'errors': errors,
+                     'items': items}
+
+    # Search
+
+    def get_sort(self, sort):
+        """Return the list of (field, options) of a sort."""
+        if sort is None:
+            return []
+        if not isinstance(sort, list):
+            sort = [sort]
+        specs = []
+        for item in sort:
+            if isinstance(item, six.string_types):
+                if ':' in item:
+                    field, order = item.rsplit(':', 1)
+                    specs.append((field, {'order': order}))
+                else:
+                    specs.append((item, {}))
+                continue
+            (field, options), = six.iteritems(item)
+            if not isinstance(options, dict):
+                options = {'order': options}
+            specs.append((field, dict(options)))
+        for field, options in specs:
+            options.setdefault('order', 'desc' if field == '_score' else 'asc')
+            if options['order'] not in ('asc', 'desc'):
+                raise bad_request('[sort] unknown order [%s]' % options['order'],
+                                  error_type='parsing_exception')
+        return specs
+
+    def get_sort_function(self, field, options, indices):
+        """Return the function of a (index, document, score, position) hit of a sort."""
+        if field == '_score':
+            return lambda hit: hit[2]
+        if field == '_doc':
+            return lambda hit: hit[3]
+        if field == '_id':
+            return lambda hit: hit[1].id
+        mode = options.get('mode', 'min' if options['order'] == 'asc' else 'max')
+
+        def reduce(values):
+            if not values:
+                return None
+            if mode == 'min':
+                return min(values)
+            if mode == 'max':
+                return max(values)
+            if mode == 'sum':
+                return sum(values)
+            if mode == 'avg':
+                return sum(values) / len(values)
+            if mode == 'median':
+                values = sorted(values)
+                middle = len(values) // 2
+                return (values[middle] if len(values) % 2 else
+                        (values[middle - 1] + values[middle]) / 2)
+            raise bad_request('[sort] unknown mode [%s]' % mode)
+
+        if field == '_geo_distance':
+            unit = DISTANCE_UNITS.get(options.get('unit', 'm'), 1)
+            measure = (plane_distance if options.get('distance_type') == 'plane'
+                       else arc_distance)
+            (field, point), = [(key, value) for key, value in six.iteritems(options)
+                               if key not in ('order', 'mode', 'unit', 'distance_type',
+                                              'ignore_unmapped', 'validation_method')]
+            if isinstance(point, list) and point and not isinstance(point[0], (int, float)):
+                point = point[0]
+            origin = parse_geo_point(point)
+
+            def geo_distance(hit):
+                points = hit[0].get_terms(hit[1], field)
+                return reduce([measure(origin, other) / unit for other in points])
+            return geo_distance
+
+        for index in indices:
+            field_type = index.get_field_type(field)
+            if field_type is None and 'unmapped_type' not in options:
+                raise bad_request('No mapping found for [%s] in order to sort on' % field,
+                                  error_type='query_shard_exception', index=index.name)
+            if field_type == 'text' and not index.get_field(field)[1].get('fielddata'):
+                raise bad_request(
+                    'Fielddata is disabled on text fields by default. Set fielddata=true on '
+                    '[%s] in order to load fielddata in memory by uninverting the inverted '
+                    'index. Note that this can however use significant memory. Alternatively '
+                    'use a keyword field instead.' % field, index=index.name)
+
+        def value(hit):
+            terms = hit[0].get_terms(hit[1], field)
+            if terms and isinstance(terms[0], bool):
+                terms = [int(term) for term in terms]
+            return reduce(terms)
+        return value
+
+    def get_sort_value(self, index, field, value):
+        """Return the sort value of a hit as it's returned by Elasticsearch."""
+        if isinstance(value, float) and value.is_integer() and field not in (
+                '_score', '_geo_distance'):
+            field_type = index.get_field_type(field)
+            if field_type in ('long', 'integer', 'short', 'byte', 'date'):
+                return int(value)
+        return value
+
+    def sort_hits(self, hits, specs, indices):
+        """Sort the hits in place, return the functions of the sort values."""
+        functions = [self.get_sort_function(field, options, indices)
+                     for field, options in specs]
+        for (field, options), function in reversed(list(zip(specs, functions))):
+            descending = options['order'] == 'desc'
+            missing = options.get('missing', '_last')
+            first = missing == '_first'
+            substitute = None if missing in ('_first', '_last') else missing
+
+            def key(hit, function=function, first=first, substitute=substitute,
+                    descending=descending):
+                value = function(hit)
+                if value is None and substitute is not None:
+                    value = substitute
+                if value is None:
+                    return (1 if first == descending else -1), (0, 0)
+                return 0, get_sort_key(value)
+            for hit in hits:
+                hit[4].append(key(hit))
+            hits.sort(key=lambda hit: hit[4][-1], reverse=descending)
+        for hit in hits:
+            hit[4].reverse()
+        return functions
+
+    def is_after(self, keys, after_keys, specs):
+        for key, after_key, (field, options) in zip(keys, after_keys, specs):
+            if key == after_key:
+                continue
+            return key > after_key if options['order'] == 'asc' else key < after_key
+        return False
+
+    def get_after_keys(self, values, specs):
+        keys = []
+        for value, (field, options) in zip(values, specs):
+            descending = options['order'] == 'desc'
+            if value is None:
+                first = options.get('missing', '_last') == '_first'
+                keys.append(((1 if first == descending else -1), (0, 0)))
+            else:
+                keys.append((0, get_sort_key(value)))
+        return keys
+
+    def match(self, indices, body, params):
+        """Return the list of the matched [index, document, score, position, keys]."""
+        hits = []
+        min_score = body.get('min_score')
+        position = 0
+        for index in indices:
+            query = QueryCompiler(index).compile(body.get('query'))
+            for document in index.visible():
+                score = query(document)
+                position += 1
+                if score is None or (min_score is not None and score < min_score):
+                    continue
+                hits.append([index, document, score, position, []])
+        return hits
+
+    def search(self, indices, body, params, scroll=None):
+        started = time.time()
+        body = dict(body or {})
+        unsupported = set(body) - SEARCH_KEYS
+        if unsupported:
+            raise bad_request('[%s] is not supported by the in-memory engine' %
+                              ', '.join(sorted(unsupported)), error_type='parsing_exception')
+        if 'q' in params:
+            raise bad_request('[q] is not supported by the in-memory engine')
+        for key in ('from', 'size'):
+            if key in params:
+                body[key] = int(params[key])
+        if 'sort' in params:
+            body['sort'] = params['sort'].split(',')
+        for key in ('version', 'seq_no_primary_term', 'track_scores'):
+            if key in params:
+                body[key] = is_true(params[key])
+        start = int(body.get('from', 0))
+        size = int(body.get('size', 10))
+        if not scroll:
+            window = min([index.max_result_window for index in indices] or [MAX_RESULT_WINDOW])
+            if start + size > window:
+                raise bad_request(
+                    'Result window is too large, from + size must be less than or equal to: '
+                    '[%d] but was [%d]. See the scroll api for a more efficient way to request '
+                    'large data sets.' % (window, start + size),
+                    error_type='query_phase_execution_exception')
+
+        hits = self.match(indices, body, params)
+        aggregations = None
+        aggs = body.get('aggs', body.get('aggregations'))
+        if aggs:
+            aggregations = self.aggregate(aggs, hits, indices)
+        if body.get('post_filter'):
+            filters = dict((index.name, QueryCompiler(index).compile(body['post_filter']))
+                           for index in indices)
+            hits = [hit for hit in hits if filters[hit[0].name](hit[1]) is not None]
+        total = len(hits)
+
+        specs = self.get_sort(body.get('sort'))
+        sorted_by_score = not specs or specs[0][0] == '_score'
+        track_scores = sorted_by_score or body.get('track_scores')
+        if not specs:
+            specs = [('_score', {'order': 'desc'})]
+        functions = self.sort_hits(hits, specs, indices)
+        if body.get('search_after') is not None:
+            after_keys = self.get_after_keys(body['search_after'], specs)
+            hits = [hit for hit in hits if self.is_after(hit[4], after_keys, specs)]
+            start = 0
+
+        enabled, includes, excludes = get_source_filter(
+            body.get('_source'), params.get('_source_includes', params.get('_source_include')),
+            params.get('_source_excludes', params.get('_source_exclude')))
+        if '_source' in params:
+            enabled, includes, excludes = self.get_params_source_filter(params)
+
+        def render(hit):
+            index, document, score = hit[:3]
+            result = OrderedDict([
+                ('_index', index.name), ('_type', document.type), ('_id', document.id),
+                ('_score', score if track_scores else None),
+            ])
+            if body.get('version'):
+                result['_version'] = document.version
+            if body.get('seq_no_primary_term'):
+                result['_seq_no'] = document.seq_no
+                result['_primary_term'] = 1
+            if enabled:
+                result['_source'] = (filter_source(document.source, includes, excludes)
+                                     if includes or excludes else document.source)
+            if body.get('sort') is not None:
+                result['sort'] = [self.get_sort_value(index, field, function(hit))
+                                  for (field, options), function in zip(specs, functions)]
+            return result
+
+        page = hits[start:start + size]
+        max_score = None
+        if track_scores and hits:
+            max_score = max(hit[2] for hit in hits)
+        response = OrderedDict([
+            ('took', int((time.time() - started) * 1000)),
+            ('timed_out', False),
+            ('_shards', {'total': len(indices), 'successful': len(indices), 'skipped': 0,
+                         'failed': 0}),
+            ('hits', {'total': total, 'max_score': max_score,
+                      'hits': [render(hit) for hit in page]}),
+        ])
+        if aggregations is not None:
+            response['aggregations'] = aggregations
+        if body.get('profile'):
+            response['profile'] = self.get_profile(indices, body, time.time() - started)
+        if scroll:
+            scroll_id = uuid.uuid4().hex
+            self.scrolls[scroll_id] = {
+                'hits': [render(hit) for hit in hits[start + size:]],
+                'size': size, 'expires': time.time() + parse_time(scroll) / 1000.0,
+                'indices': [index.name for index in indices], 'total': total,
+                'max_score': max_score,
+            }
+            response['_scroll_id'] = scroll_id
+        return response
+
+    def get_profile(self, indices, body, duration):
+        nanos = int(duration * 1e9)
+        return {'shards': [{
+            'id': '[in-memory][%s][0]' % index.name,
+            'searches': [{
+                'query': [{
+                    'type': 'InMemoryQuery',
+                    'description': json.dumps(body.get('query', {'match_all': {}}),
+                                              sort_keys=True),
+                    'time_in_nanos': nanos, 'breakdown': {}, 'children': [],
+                }],
+                'rewrite_time': 0,
+                'collector': [{'name': 'InMemoryCollector', 'reason': 'search_top_hits',
+                               'time_in_nanos': nanos}],
+            }],
+            'aggregations': [],
+        } for index in indices]}
+
+    def expire_scrolls(self):
+        now = time.time()
+        for scroll_id in [key for key, scroll in six.iteritems(self.scrolls)
+                          if scroll['expires'] < now]:
+            del self.scrolls[scroll_id]
+
+    def scroll(self, method, params, body):
+        body = body or {}
+        if isinstance(body, six.string_types):
+            body = {'scroll_id': body}
+        scroll_ids = body.get('scroll_id', params.get('scroll_id'))
+        if method == 'DELETE':
+            if scroll_ids in (None, '_all'):
+                freed = len(self.scrolls)
+                self.scrolls.clear()
+            else:
+                if isinstance(scroll_ids, six.string_types):
+                    scroll_ids = scroll_ids.split(',')
+                freed = len([self.scrolls.pop(scroll_id) for scroll_id in scroll_ids
+                             if scroll_id in self.scrolls])
+                if not freed:
+                    return 404, {'succeeded': True, 'num_freed': 0}
+            return 200, {'succeeded': True, 'num_freed': freed}
+
+        self.expire_scrolls()
+        started = time.time()
+        scroll = self.scrolls.get(scroll_ids)
+        if scroll is None:
+            raise not_found('No search context found for id [%s]' % scroll_ids,
+                            error_type='search_context_missing_exception')
+        keep_alive = body.get('scroll', params.get('scroll'))
+        if keep_alive:
+            scroll['expires'] = time.time() + parse_time(keep_alive) / 1000.0
+        page, scroll['hits'] = scroll['hits'][:scroll['size']], scroll['hits'][scroll['size']:]
+        shards = len(scroll['indices'])
+        return 200, OrderedDict([
+            ('_scroll_id', scroll_ids),
+            ('took', int((time.time() - started) * 1000)),
+            ('timed_out', False),
+            ('_shards', {'total': shards, 'successful': shards, 'skipped': 0, 'failed': 0}),
+            ('hits', {'total': scroll['total'], 'max_score': scroll['max_score'],
+                      'hits': page}),
+        ])
+
+    def api_search(self, method, index, doc_type, rest, params, body):
+        if rest[:1] == ['scroll']:
+            if len(rest) > 1:
+                params = dict(params, scroll_id=rest[1])
+            return self.scroll(method, params, body)
+        if rest:
+            raise bad_request('[_search/%s] is not supported by the in-memory engine' %
+                              '/'.join(rest))
+        indices = self.resolve(index, params)
+        return 200, self.search(indices, body, params, params.get('scroll'))
+
+    def api_msearch(self, method, index, doc_type, rest, params, body):
+        lines = list(body or [])
+        responses = []
+        for header, search_body in zip(lines[::2], lines[1::2]):
+            try:
+                indices = self.resolve(header.get('index', index), header)
+                response = self.search(indices, search_body, {})
+                response['status'] = 200
+            except ElasticError as e:
+                response = e.to_dict()
+            responses.append(response)
+        return 200, {'responses': responses}
+
+    def api_count(self, method, index, doc_type, rest, params, body):
+        indices = self.resolve(index, params)
+        body = body or {}
+        unsupported = set(body) - set(['query'])
+        if unsupported:
+            raise bad_request('request does not support [%s]' % ', '.join(sorted(unsupported)),
+                              error_type='parsing_exception')
+        count = len(self.match(indices, body, params))
+        return 200, {'count': count, '_shards': {'total': len(indices),
+                                                 'successful': len(indices), 'skipped': 0,
+                                                 'failed': 0}}
+
+    # Aggregations
+
+    def get_agg_values(self, hits, field):
+        values = []
+        for hit in hits:
+            values.extend(hit[0].get_terms(hit[1], field))
+        return [float(value) if isinstance(value, bool) else value for value in values]
+
+    def get_agg_type(self, indices, field):
+        for index in indices:
+            field_type = index.get_field_type(field)
+            if field_type is not None:
+                if field_type == 'text' and not index.get_field(field)[1].get('fielddata'):
+                    raise bad_request('Fielddata is disabled on text fields by default. Set '
+                                      'fielddata=true on [%s]' % field, index=index.name)
+                return field_type
+        return None
+
+    def format_value(self, field_type, value):
+        if value is None:
+            return {'value': None}
+        result = {'value': value}
+        if field_type == 'date':
+            result['value_as_string'] = format_date(value)
+        return result
+
+    def aggregate(self, aggs, hits, indices):
+        results = OrderedDict()
+        for name, agg in six.iteritems(aggs):
+            agg = dict(agg)
+            sub_aggs = agg.pop('aggs', agg.pop('aggregations', None))
+            agg.pop('meta', None)
+            if len(agg) != 1:
+                raise bad_request('Expected one aggregation type under [%s]' % name,
+                                  error_type='parsing_exception')
+            (agg_type, options), = six.iteritems(agg)
+            method = getattr(self, 'agg_%s' % agg_type, None)
+            if method is None:
+                raise bad_request('Unknown aggregation type [%s], it is not supported by the '
+                                  'in-memory engine' % agg_type, error_type='parsing_exception')
+            results[name] = method(options, hits, indices, sub_aggs)
+        return results
+
+    def bucket(self, hits, indices, sub_aggs, **values):
+        bucket = OrderedDict(values)
+        bucket['doc_count'] = len(hits)
+        if sub_aggs:
+            bucket.update(self.aggregate(sub_aggs, hits, indices))
+        return bucket
+
+    def metric_values(self, options, hits, indices):
+        field = options['field']
+        field_type = self.get_agg_type(indices, field)
+        values = [float(value) for value in self.get_agg_values(hits, field)]
+        if not values and 'missing' in options:
+            values = [float(to_term(field_type, options['missing']))] * len(hits)
+        return field_type, values
+
+    def agg_min(self, options, hits, indices, sub_aggs):
+        field_type, values = self.metric_values(options, hits, indices)
+        return self.format_value(field_type, min(values) if values else None)
+
+    def agg_max(self, options, hits, indices, sub_aggs):
+        field_type, values = self.metric_values(options, hits, indices)
+        return self.format_value(field_type, max(values) if values else None)
+
+    def agg_sum(self, options, hits, indices, sub_aggs):
+        field_type, values = self.metric_values(options, hits, indices)
+        return {'value': float(sum(values))}
+
+    def agg_avg(self, options, hits, indices, sub_aggs):
+        field_type, values = self.metric_values(options, hits, indices)
+        return self.format_value(field_type, sum(values) / len(values) if values else None)
+
+    def agg_value_count(self, options, hits, indices, sub_aggs):
+        return {'value': len(self.get_agg_values(hits, options['field']))}
+
+    def agg_cardinality(self, options, hits, indices, sub_aggs):
+        self.get_agg_type(indices, options['field'])
+        return {'value': len(set(self.get_agg_values(hits, options['field'])))}
+
+    def agg_stats(self, options, hits, indices, sub_aggs):
+        field_type, values = self.metric_values(options, hits, indices)
+        return {
+            'count': len(values),
+            'min': min(values) if values else None,
+            'max': max(values) if values else None,
+            'avg': sum(values) / len(values) if values else None,
+            'sum': float(sum(values)),
+        }
+
+    def agg_terms(self, options, hits, indices, sub_aggs):
+        field = options['field']
+        field_type = self.get_agg_type(indices, field)
+        if field_type is None:
+            return {'doc_count_error_upper_bound': 0, 'sum_other_doc_count': 0, 'buckets': []}
+        grouped = OrderedDict()
+        for hit in hits:
+            for term in set(hit[0].get_terms(hit[1], field)):
+                grouped.setdefault(term, []).append(hit)
+        if 'missing' in options:
+            missing = [hit for hit in hits if not hit[0].get_terms(hit[1], field)]
+            if missing:
+                grouped.setdefault(to_term(field_type, options['missing']), []).extend(missing)
+        if 'include' in options or 'exclude' in options:
+            def allowed(term):
+                term = six.text_type(term)
+                include, exclude = options.get('include'), options.get('exclude')
+                if isinstance(include, list) and term not in include:
+                    return False
+                if isinstance(include, six.string_types) and not re.match(
+                        '(?:%s)$' % include, term):
+                    return False
+                if isinstance(exclude, list) and term in exclude:
+                    return False
+                return not (isinstance(exclude, six.string_types) and
+                            re.match('(?:%s)$' % exclude, term))
+            grouped = OrderedDict((term, items) for term, items in six.iteritems(grouped)
+                                  if allowed(term))
+        grouped = [(term, items) for term, items in six.iteritems(grouped)
+                   if len(items) >= options.get('min_doc_count', 1)]
+
+        order = options.get('order', {'_count': 'desc'})
+        if isinstance(order, dict):
+            order = [order]
+        # Ties are ordered by the keys
+        grouped.sort(key=lambda entry: get_sort_key(entry[0]))
+        for item in reversed(order):
+            (key, direction), = six.iteritems(item)
+            if key == '_count':
+                grouped.sort(key=lambda entry: len(entry[1]), reverse=direction == 'desc')
+            elif key in ('_key', '_term'):
+                grouped.sort(key=lambda entry: get_sort_key(entry[0]),
+                             reverse=direction == 'desc')
+            else:
+                raise bad_request('ordering terms by [%s] is not supported by the in-memory '
+                                  'engine' % key)
+        size = options.get('size', 10)
+        buckets = []
+        for term, items in grouped[:size]:
+            values = {'key': term}
+            if field_type == 'boolean':
+                values = {'key': int(term), 'key_as_string': 'true' if term else 'false'}
+            elif field_type == 'date':
+                values = {'key': int(term), 'key_as_string': format_date(term)}
+            elif field_type in NUMERIC_TYPES and float(term).is_integer() and field_type not in (
+                    'double', 'float', 'half_float', 'scaled_float'):
+                values = {'key': int(term)}
+            buckets.append(self.bucket(items, indices, sub_aggs, **values))
+        return {'doc_count_error_upper_bound': 0,
+                'sum_other_doc_count': sum(len(items) for term, items in grouped[size:]),
+                'buckets': buckets}
+
+    def agg_range(self, options, hits, indices, sub_aggs):
+        field = options['field']
+        field_type = self.get_agg_type(indices, field)
+        buckets = []
+        for item in options.get('ranges', []):
+            low = item.get('from')
+            high = item.get('to')
+            low = None if low is None else float(to_term(field_type or 'double', low))
+            high = None if high is None else float(to_term(field_type or 'double', high))
+            matched = [hit for hit in hits if any(
+                (low is None or term >= low) and (high is None or term < high)
+                for term in hit[0].get_terms(hit[1], field))]
+            key = item.get('key', '%s-%s' % ('*' if low is None else repr(low),
+                                             '*' if high is None else repr(high)))
+            values = OrderedDict([('key', key)])
+            if low is not None:
+                values['from'] = low
+            if high is not None:
+                values['to'] = high
+            buckets.append(self.bucket(matched, indices, sub_aggs, **values))
+        if options.get('keyed'):
+            keyed = OrderedDict()
+            for bucket in buckets:
+                keyed[bucket.pop('key')] = bucket
+            return {'buckets': keyed}
+        return {'buckets': buckets}
+
+    def agg_filter(self, options, hits, indices, sub_aggs):
+        queries = dict((index.name, QueryCompiler(index).compile(options)) for index in indices)
+        matched = [hit for hit in hits if queries[hit[0].name](hit[1]) is not None]
+        return self.bucket(matched, indices, sub_aggs)
+
+    def agg_filters(self, options, hits, indices, sub_aggs):
+        filters = options['filters']
+        if isinstance(filters, dict):
+            keyed = OrderedDict()
+            for key, query in six.iteritems(filters):
+                keyed[key] = self.agg_filter(query, hits, indices, sub_aggs)
+            return {'buckets': keyed}
+        return {'buckets': [self.agg_filter(query, hits, indices, sub_aggs)
+                            for query in filters]}
+
+    def agg_missing(self, options, hits, indices, sub_aggs):
+        field = options['field']
+        matched = [hit for hit in hits if not hit[0].get_terms(hit[1], field)]
+        return self.bucket(matched, indices, sub_aggs)
+
+    # By query
+
+    def by_query(self, method_name, index, params, body, process):
+        body = dict(body or {})
+        conflicts = body.pop('conflicts', params.get('conflicts', 'abort'))
+        script = body.pop('script', None)
+        indices = self.resolve(index, params)
+        started = time.time()
+        hits = self.match(indices, {'query': body.get('query')}, params)
+        response = OrderedDict([
+            ('took', 0), ('timed_out', False), ('total', len(hits)), ('updated', 0),
+            ('deleted', 0), ('batches', 1 if hits else 0), ('version_conflicts', 0),
+            ('noops', 0), ('retries', {'bulk': 0, 'search': 0}), ('throttled_millis', 0),
+            ('requests_per_second', -1.0), ('throttled_until_millis', 0), ('failures', []),
+        ])
+        for hit in hits:
+            index, document = hit[0], hit[1]
+            current = index.documents.get(document.id)
+            if current is None or current.version != document.version:
+                response['version_conflicts'] += 1
+                if conflicts != 'proceed':
+                    response['failures'].append({
+                        'index': index.name, 'type': document.type, 'id': document.id,
+                        'cause': self.version_conflict(index, document.type, document.id,
+                                                       'the document was changed').to_dict()[
+                                                           'error'],
+                        'status': 409,
+                    })
+                    break
+                continue
+            process(index, current, script, response)
+        if params.get('refresh') not in (None, False, 'false'):
+            for index in indices:
+                index.refresh()
+        response['took'] = int((time.time() - started) * 1000)
+
+        if is_true(params.get('wait_for_completion', True)):
+            return 200, response
+        task_id = 'memory:%d' % (len(self.tasks) + 1)
+        self.tasks[task_id] = {
+            'completed': True,
+            'task': {
+                'node': 'memory', 'id': len(self.tasks) + 1, 'type': 'transport',
+                'action': 'indices:data/write/%s' % method_name,
+                'status': dict((key, response[key]) for key in (
+                    'total', 'updated', 'deleted', 'batches', 'version_conflicts', 'noops',
+                    'retries', 'throttled_millis', 'requests_per_second',
+                    'throttled_until_millis')),
+                'description': method_name, 'start_time_in_millis': int(started * 1000),
+                'running_time_in_nanos': int((time.time() - started) * 1e9),
+                'cancellable': True,
+            },
+            'response': response,
+        }
+        return 200, {'task': task_id}
+
+    def api_delete_by_query(self, method, index, doc_type, rest, params, body):
+        def process(index, document, script, response):
+            index.remove(document.id, document.version + 1)
+            response['deleted'] += 1
+        return self.by_query('delete/byquery', index, params, body, process)
+
+    def api_update_by_query(self, method, index, doc_type, rest, params, body):
+        def process(index, document, script, response):
+            source = document.source
+            op = 'index'
+            if script is not None:
+                op, source = self.run_script(script, document.id, document.source)
+            if op == 'none':
+                response['noops'] += 1
+            elif op == 'delete':
+                index.remove(document.id, document.version + 1)
+                response['deleted'] += 1
+            else:
+                doc_type, cache = index.prepare(document.type, source)
+                updated = InMemoryDocument(document.id, doc_type, source,
+                                           document.version + 1, 0)
+                updated.cache = cache
+                index.write(updated)
+                response['updated'] += 1
+        return self.by_query('update/byquery', index, params, body, process)
+
+
+class InMemoryConnection(Connection):
+    """Connection class which sends the requests to an `InMemoryEngine`."""
+
+    def __init__(self, engine=None, **kwargs):
+        kwargs.setdefault('host', 'in-memory')
+        super(InMemoryConnection, self).__init__(**kwargs)
+        self.engine = engine if engine is not None else InMemoryEngine()
+
+    def perform_request(self, method, url, params=None, body=None, timeout=None,
+                        ignore=(), headers=None):
+        started = time.time()
+        status, data = self.engine.perform_request(method, url, params, body)
+        duration = time.time() - started
+        raw_data = json.dumps(data) if data is not None else ''
+        full_url = self.host + url
+        if not (200 <= status < 300) and status not in ignore:
+            self.log_request_fail(method, full_url, url, body, duration, status, raw_data)
+            self._raise_error(status, raw_data)
+        self.log_request_success(method, full_url, url, body, status, raw_data, duration)
+        return status, {'content-type': 'application/json'}, raw_data
+
+
+def get_in_memory_client(engine=None, **kwargs):
+    """Return an `Elasticsearch` client of the in-memory engine."""
+    kwargs.setdefault('connection_class', InMemoryConnection)
+    return Elasticsearch(engine=engine if engine is not None else InMemoryEngine(), **kwargs)
+
+
+@contextmanager
+def in_memory_connection(alias='default', engine=None):
+    """
+    Register the client of an in-memory engine as the connection `alias`
+    of `elasticsearch_dsl`, the previous connection is restored on exit.
+
+        with in_memory_connection() as client:
+            BlogDocument.init()
+    """
+    try:
+        previous = connections.get_connection(alias)
+    except KeyError:
+        previous = None
+    client = get_in_memory_client(engine)
+    connections.add_connection(alias, client)
+    try:
+        yield client
+    finally:
+        if previous is not None:
+            connections.add_connection(alias, previous)
+        else:
+            connections.remove_connection(alias)
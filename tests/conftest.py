@@ -2,6 +2,7 @@
 from __future__ import unicode_literals
 
 import os
+import tempfile
 
 import pytest
 import rest_framework
@@ -11,10 +12,14 @@ from elasticsearch_dsl.connections import connections
 from elasticsearch.helpers import bulk
 from elasticsearch import Elasticsearch
 
+from rest_framework_elasticsearch.testing.es_memory import get_in_memory_client
+
 from .test_data import create_test_index, DATA
 
 
 DRF_VERSION = tuple(map(int, rest_framework.VERSION.split('.')))
+# File database is shared by the threads, unlike in-memory one
+TEST_DB_NAME = os.path.join(tempfile.gettempdir(), 'rest_framework_elasticsearch.sqlite3')
 
 
 def pytest_configure():
@@ -23,6 +28,16 @@ def pytest_configure():
 
     settings.configure(
         SITE_ID=1,
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': TEST_DB_NAME,
+            }
+        },
+        INSTALLED_APPS=[
+            'rest_framework_elasticsearch',
+            'tests',
+        ],
         SECRET_KEY='not very secret in tests',
         ROOT_URLCONF='tests.urls',
         TEMPLATES=[
@@ -35,25 +50,83 @@ def pytest_configure():
             },
         ],
         ALLOWED_HOSTS=['localhost', 'testserver'],
+        # django.contrib.auth is not installed
+        REST_FRAMEWORK={'UNAUTHENTICATED_USER': None},
         ES_CLIENT = connections.create_connection(hosts=[os.environ.get('TEST_ES_SERVER', {})], timeout=20)
     )
 
     django.setup()
 
 
+@pytest.fixture(scope='session')
+def django_db_setup():
+    """Create tables of the test models"""
+    from django.apps import apps
+    from django.db import connection
+
+    if os.path.exists(TEST_DB_NAME):
+        os.remove(TEST_DB_NAME)
+    with connection.schema_editor() as editor:
+        for app_config in apps.get_app_configs():
+            for model in app_config.get_models():
+                editor.create_model(model)
+    yield
+    connection.close()
+    os.remove(TEST_DB_NAME)
+
+
+@pytest.fixture(scope='function')
+def db(django_db_setup):
+    """Remove rows of the test models after the test"""
+    from django.apps import apps
+
+    yield
+    models = [model for app_config in apps.get_app_configs()
+              for model in app_config.get_models()]
+    # Referencing models are declared after the referenced ones
+    for model in reversed(models):
+        model._base_manager.all()._raw_delete(model._base_manager.db)
+
+
 @pytest.fixture(scope='session')
 def es_client():
-    """Create and return elasticsearch connection"""
-    connection = Elasticsearch([os.environ.get('TEST_ES_SERVER', {})])
+    """Create and return elasticsearch connection, the in-memory engine
+    is used when TEST_ES_SERVER is not set.
+    """
+    if os.environ.get('TEST_ES_SERVER'):
+        connection = Elasticsearch([os.environ['TEST_ES_SERVER']])
+    else:
+        connection = get_in_memory_client()
     connections.add_connection('default', connection)
     return connection
 
 
+@pytest.fixture(autouse=True)
+def reindex_pool(monkeypatch):
+    """Index the ranges of the reindex by threads with the in-memory engine,
+    the worker processes don't share it.
+    """
+    from multiprocessing.pool import ThreadPool
+    from rest_framework_elasticsearch.es_reindex import ElasticReindexer, init_worker
+
+    if not os.environ.get('TEST_ES_SERVER'):
+        monkeypatch.setattr(ElasticReindexer, 'get_pool',
+                            lambda self: ThreadPool(self.processes, initializer=init_worker))
+
+
+@pytest.fixture(scope='function')
+def in_memory_es():
+    """Return a client of an empty in-memory engine"""
+    return get_in_memory_client()
+
+
 @pytest.fixture(scope='function')
 def es_data_client(es_client):
     """Create elasticsearch index with preparing data and
     delete after exit of the scope.
     """
+    # Documents written to the test index outside of the fixture
+    es_client.indices.delete('test*', ignore=404)
     create_test_index()
     bulk(es_client, DATA, raise_on_error=True, refresh=True)
     yield es_client
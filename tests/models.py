@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models
+
+
+class Author(models.Model):
+    """Related model denormalized into the Person documents"""
+    name = models.CharField(max_length=100)
+
+    class Meta:
+        app_label = 'tests'
+
+
+class Person(models.Model):
+    """Django ORM test model indexed into DataDocType"""
+    first_name = models.CharField(max_length=100)
+    last_name = models.CharField(max_length=100, blank=True)
+    score = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    author = models.ForeignKey(Author, null=True, blank=True, on_delete=models.SET_NULL)
+
+    class Meta:
+        app_label = 'tests'
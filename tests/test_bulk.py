@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import pytest
+from elasticsearch.helpers import BulkIndexError
+
+from rest_framework_elasticsearch.es_bulk import ElasticBulkIndexer
+from .test_data import DataDocType, DATA
+
+
+def create_documents(start=100, count=5):
+    """Create and return test documents with ids from the start value"""
+    documents = []
+    for pk in range(start, start + count):
+        document = DataDocType(**DATA[pk % len(DATA)]['_source'])
+        document.meta.id = pk
+        documents.append(document)
+    return documents
+
+
+def test_options():
+    indexer = ElasticBulkIndexer(chunk_size=10, max_retries=5)
+    assert indexer.chunk_size == 10
+    assert indexer.max_retries == 5
+    assert ElasticBulkIndexer.chunk_size == 500
+
+
+@pytest.mark.parametrize('elapsed, expected', [
+    (0.1, 150),
+    (1.0, 100),
+    (2.0, 50),
+])
+def test_adapt_chunk_size(elapsed, expected):
+    indexer = ElasticBulkIndexer(chunk_size=100, target_latency=1.0)
+    indexer.adapt_chunk_size(elapsed)
+    assert indexer.chunk_size == expected
+
+
+def test_adapt_chunk_size_limits():
+    indexer = ElasticBulkIndexer(chunk_size=100, min_chunk_size=80,
+                                 max_chunk_size=120)
+    indexer.adapt_chunk_size(10)
+    assert indexer.chunk_size == 80
+    indexer.adapt_chunk_size(0)
+    indexer.adapt_chunk_size(0)
+    assert indexer.chunk_size == 120
+
+
+def test_index_action():
+    document = create_documents(count=1)[0]
+    action = ElasticBulkIndexer().index_action(document, index='test-copy')
+    assert action == {
+        '_id': 100,
+        '_index': 'test-copy',
+        '_type': 'doc',
+        '_source': document.to_dict()
+    }
+
+
+def test_versioned_actions():
+    document = create_documents(count=1)[0]
+    document.meta.version = 10
+    document.meta.version_type = 'external'
+    indexer = ElasticBulkIndexer()
+    action = indexer.index_action(document)
+    assert (action['_version'], action['_version_type']) == (10, 'external')
+    assert '_version' not in indexer.delete_action(document)
+
+
+def test_is_ok():
+    indexer = ElasticBulkIndexer()
+    assert indexer.is_ok('delete', {'status': 404})
+    assert not indexer.is_ok('index', {'status': 404})
+    assert not indexer.is_ok('index', {'status': 409})
+    assert ElasticBulkIndexer(skip_conflicts=True).is_ok('index', {'status': 409})
+
+
+def test_delete_action():
+    document = create_documents(count=1)[0]
+    action = ElasticBulkIndexer().delete_action(document)
+    assert action == {
+        '_id': 100,
+        '_index': 'test',
+        '_type': 'doc',
+        '_op_type': 'delete'
+    }
+
+
+@pytest.mark.parametrize('adaptive', [False, True])
+def test_index_and_delete(es_data_client, adaptive):
+    indexer = ElasticBulkIndexer(chunk_size=2, adaptive=adaptive)
+    documents = create_documents()
+
+    result = indexer.index(documents, refresh=True)
+    assert result.success == len(documents)
+    assert result.errors == []
+    for document in documents:
+        assert DataDocType.get(id=document.meta.id).to_dict() == document.to_dict()
+
+    result = indexer.delete(documents, refresh=True)
+    assert result.success == len(documents)
+    assert DataDocType.get(id=documents[0].meta.id, ignore=404) is None
+
+
+def test_delete_ids(es_data_client):
+    indexer = ElasticBulkIndexer()
+    result = indexer.delete_ids(DataDocType, ['1', '2', '1000'], refresh=True)
+    # Missing documents are not reported
+    assert result.success == 3
+    assert DataDocType.get(id=1, ignore=404) is None
+    assert DataDocType.get(id=2, ignore=404) is None
+
+
+def test_errors(es_data_client):
+    documents = create_documents(count=3)
+    documents[1].score = 'not a number'
+
+    with pytest.raises(BulkIndexError) as err:
+        ElasticBulkIndexer().index(documents, validate=False)
+    assert len(err.value.errors) == 1
+
+    result = ElasticBulkIndexer(raise_on_error=False).index(
+        documents, validate=False)
+    assert result.success == 2
+    assert result.errors[0]['index']['_id'] == '101'
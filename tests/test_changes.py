@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import pytest
+from django.db.models import QuerySet
+
+from rest_framework_elasticsearch.es_changes import (
+    ElasticChangeTracker, forget_index_states)
+from rest_framework_elasticsearch.es_counters import ElasticCounterBuffer
+from rest_framework_elasticsearch.es_reindex import ElasticReindexer
+from rest_framework_elasticsearch.es_serializer import ElasticModelSerializer
+from rest_framework_elasticsearch.models import ElasticDocumentState
+from .models import Person
+from .test_data import DataDocType
+from .utils import RecordingIndexer
+
+
+class TrackedPersonSerializer(ElasticModelSerializer):
+    class Meta:
+        model = Person
+        es_model = DataDocType
+        fields = ('first_name', 'last_name', 'score', 'updated_at')
+        es_track_changes = True
+        es_ignore_change_fields = ('updated_at',)
+
+
+def document(pk, **fields):
+    return DataDocType(meta={'id': pk}, **fields)
+
+
+@pytest.fixture
+def tracker(db):
+    return ElasticChangeTracker('test', ignore_fields=('updated_at',))
+
+
+def test_get_changed_fields():
+    tracker = ElasticChangeTracker('test', ignore_fields=('updated_at',))
+    old = {'first_name': 'a', 'score': 'b', 'updated_at': 'c'}
+    assert tracker.get_changed_fields(None, old) is None
+    assert tracker.get_changed_fields(old, dict(old)) == []
+    assert tracker.get_changed_fields(old, dict(old, updated_at='d')) == []
+    assert tracker.get_changed_fields(old, dict(old, score='e', updated_at='d')) == [
+        'score', 'updated_at']
+    assert tracker.get_changed_fields(old, {'first_name': 'a', 'updated_at': 'c'}) == [
+        'score']
+
+
+def test_store(tracker):
+    tracker.store({1: {'first_name': 'a'}, '2': {'first_name': 'b'}})
+    tracker.store({1: {'first_name': 'c'}})
+    assert tracker.load([1, 2, 3]) == {
+        '1': {'first_name': 'c'}, '2': {'first_name': 'b'}}
+    assert ElasticChangeTracker('other').load([1]) == {}
+
+    tracker.forget([1])
+    assert tracker.load([1, 2]) == {'2': {'first_name': 'b'}}
+    tracker.clear()
+    assert tracker.load([1, 2]) == {}
+
+
+def test_store_concurrent(tracker, monkeypatch):
+    bulk_create = QuerySet.bulk_create
+
+    def concurrent_bulk_create(self, objs, *args, **kwargs):
+        # The state is created by another write after the delete
+        monkeypatch.setattr(QuerySet, 'bulk_create', bulk_create)
+        ElasticDocumentState.objects.create(index='test', document_id='1', digests='{}')
+        return bulk_create(self, objs, *args, **kwargs)
+
+    monkeypatch.setattr(QuerySet, 'bulk_create', concurrent_bulk_create)
+    tracker.store({1: {'first_name': 'a'}, 2: {'first_name': 'b'}})
+    assert tracker.load([1, 2]) == {
+        '1': {'first_name': 'a'}, '2': {'first_name': 'b'}}
+
+
+def test_forget_index_states(tracker):
+    tracker.store({1: {'first_name': 'a'}, 2: {'first_name': 'b'}})
+    other = ElasticChangeTracker('other')
+    other.store({1: {'first_name': 'a'}})
+    forget_index_states('test', [1])
+    assert list(tracker.load([1, 2])) == ['2']
+    forget_index_states('test')
+    assert tracker.load([1, 2]) == {}
+    assert list(other.load([1])) == ['1']
+    forget_index_states()
+    assert other.load([1]) == {}
+
+
+def test_changes(tracker):
+    documents = [document(1, first_name='Zofia', score=1),
+                 document(2, first_name='Callisto', score=2)]
+    assert [fields for _, _, fields, _ in tracker.changes(documents)] == [None, None]
+    tracker.store(dict((doc.meta.id, digests)
+                       for doc, _, _, digests in tracker.changes(documents)))
+
+    documents = [document(1, first_name='Zofia', score=1, updated_at='2018'),
+                 document(2, first_name='Callisto', score=3),
+                 document(3, first_name='Nika')]
+    changes = [(doc.meta.id, fields) for doc, _, fields, _ in tracker.changes(documents)]
+    assert changes == [(2, ['score']), (3, None)]
+
+
+def test_changes_object_field(tracker):
+    address = {'city': 'Warsaw', 'street': 'Long'}
+    tracker.store({1: tracker.get_digests({'first_name': 'Zofia', 'address': address})})
+    documents = [document(1, first_name='Zofia', address={'city': 'Gdansk'})]
+    # A partial update would keep the removed street
+    assert [fields for _, _, fields, _ in tracker.changes(documents)] == [None]
+
+
+def test_index_changes(tracker):
+    indexer = RecordingIndexer()
+    result = indexer.index_changes([document(1, first_name='Zofia', score=1),
+                                    document(2, first_name='Callisto', score=2)],
+                                   tracker)
+    assert result.success == 2
+    assert [action.get('_op_type', 'index') for action in indexer.sent] == ['index', 'index']
+
+    indexer = RecordingIndexer()
+    result = indexer.index_changes([document(1, first_name='Zofia', score=1),
+                                    document(2, first_name='Callisto')],
+                                   tracker)
+    assert result.success == 1
+    assert indexer.sent == [{
+        '_op_type': 'update', '_index': 'test', '_type': 'doc', '_id': 2,
+        'doc': {'score': None}
+    }]
+
+
+def test_index_changes_missing(tracker):
+    tracker.store({'1': tracker.get_digests({'first_name': 'Zofia'})})
+    indexer = RecordingIndexer(missing=('1',))
+    indexer.index_changes([document('1', first_name='Callisto')], tracker)
+    assert [action.get('_op_type', 'index') for action in indexer.sent] == ['update', 'index']
+    assert tracker.load(['1']) == {'1': tracker.get_digests({'first_name': 'Callisto'})}
+
+
+def test_serializer_tracker(db):
+    assert TrackedPersonSerializer().get_change_tracker().index == 'test'
+    assert TrackedPersonSerializer().get_change_tracker('other').index == 'other'
+    assert TrackedPersonSerializer().get_change_tracker().ignore_fields == {'updated_at'}
+
+
+def test_serializer_save(db, es_data_client):
+    person = Person.objects.create(first_name='Zofia', score=1)
+    TrackedPersonSerializer(person).save(refresh=True)
+    assert DataDocType.get(id=person.pk).score == 1
+
+    # Only the ignored field is changed, the document is not written
+    person.save()
+    version = DataDocType.get(id=person.pk).meta.version
+    TrackedPersonSerializer(person).save(refresh=True)
+    assert DataDocType.get(id=person.pk).meta.version == version
+
+    person.score = 2
+    person.save()
+    result = TrackedPersonSerializer([person], many=True).save(refresh=True)
+    assert result.success == 1
+    doc = DataDocType.get(id=person.pk)
+    assert doc.score == 2
+    assert doc.meta.version == version + 1
+
+    TrackedPersonSerializer([person], many=True).delete(refresh=True)
+    assert TrackedPersonSerializer().get_change_tracker().load([person.pk]) == {}
+
+
+def test_reindex_forgets_states(db, es_data_client):
+    person = Person.objects.create(first_name='Zofia', score=1)
+    TrackedPersonSerializer(person).save(refresh=True)
+
+    # The document is rewritten out of band
+    Person.objects.filter(pk=person.pk).update(score=2)
+    ElasticReindexer(TrackedPersonSerializer, processes=1).run()
+    DataDocType._index.refresh()
+    assert DataDocType.get(id=person.pk).score == 2
+
+    # The stored state of score=1 does not suppress the write
+    person.save()
+    TrackedPersonSerializer(person).save(refresh=True)
+    assert DataDocType.get(id=person.pk).score == 1
+
+
+def test_counters_forget_states(db, es_data_client):
+    person = Person.objects.create(first_name='Zofia', score=1)
+    TrackedPersonSerializer(person).save(refresh=True)
+
+    buffer = ElasticCounterBuffer(TrackedPersonSerializer)
+    buffer.incr(person.pk, 'score')
+    buffer.flush()
+    DataDocType._index.refresh()
+    assert DataDocType.get(id=person.pk).score == 2
+    assert TrackedPersonSerializer().get_change_tracker().load([person.pk]) == {}
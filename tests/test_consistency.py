@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import pytest
+from django.core.management import call_command
+from rest_framework import serializers
+
+from rest_framework_elasticsearch.es_consistency import (
+    ConsistencyReport, ElasticConsistencyChecker, get_source_digest)
+from .models import Person
+from .test_data import DataDocType
+from .utils import PersonSerializer
+
+
+class PersonIdSerializer(PersonSerializer):
+    id = serializers.IntegerField(source='pk')
+
+    class Meta(PersonSerializer.Meta):
+        fields = ('id', 'first_name', 'last_name', 'score')
+
+
+class PersonBirthdaySerializer(PersonIdSerializer):
+    birthday = serializers.DateTimeField(source='updated_at')
+
+    class Meta(PersonIdSerializer.Meta):
+        fields = ('id', 'first_name', 'last_name', 'score', 'birthday')
+
+
+class StubChecker(ElasticConsistencyChecker):
+    """Checker which reads the index side from a dict of documents"""
+
+    def __init__(self, *args, **kwargs):
+        self.documents = kwargs.pop('documents')
+        self.compared = []
+        super(StubChecker, self).__init__(*args, **kwargs)
+
+    def get_es_checksums(self, ranges):
+        checksums = []
+        for start, stop in ranges:
+            pks = [pk for pk in self.documents if start <= pk < stop]
+            checksums.append((len(pks), (sum(pks), sum(self.documents[pk] for pk in pks))))
+        return checksums
+
+    def compare(self, start, stop, report):
+        self.compared.append((start, stop))
+
+
+@pytest.fixture
+def people(db):
+    return [Person.objects.create(first_name='name %d' % i, score=i).pk
+            for i in range(30)]
+
+
+def test_branching():
+    with pytest.raises(ValueError):
+        ElasticConsistencyChecker(PersonIdSerializer, branching=1)
+
+
+def test_split():
+    checker = ElasticConsistencyChecker(PersonIdSerializer, branching=4)
+    assert checker.split(0, 10) == [(0, 3), (3, 6), (6, 9), (9, 10)]
+    assert checker.split(5, 7) == [(5, 6), (6, 7)]
+
+
+def test_source_digest():
+    assert get_source_digest({'a': 1, 'b': 2}) == get_source_digest({'b': 2, 'a': 1})
+    assert get_source_digest({'a': 1}) != get_source_digest({'a': 2})
+
+
+def test_db_checksums(people):
+    checker = ElasticConsistencyChecker(PersonIdSerializer,
+                                        checksum_fields={'score': 'score'})
+    first = people[0]
+    checksums = checker.get_db_checksums([(first, first + 10), (first + 10, first + 40)])
+    assert checksums == [
+        (10, (sum(people[:10]), sum(range(10)))),
+        (20, (sum(people[10:]), sum(range(10, 30)))),
+    ]
+
+
+def test_check_recurses_into_mismatched_ranges(people):
+    documents = dict((pk, score) for score, pk in enumerate(people))
+    # Stale and missing documents
+    documents[people[3]] = 100
+    del documents[people[25]]
+    checker = StubChecker(PersonIdSerializer, documents=documents, branching=3,
+                          leaf_size=4, checksum_fields={'score': 'score'})
+    report = ConsistencyReport()
+    checker.check(checker.split(people[0], people[-1] + 1), report)
+    assert len(checker.compared) == 2
+    assert any(start <= people[3] < stop for start, stop in checker.compared)
+    assert any(start <= people[25] < stop for start, stop in checker.compared)
+    assert all(stop - start <= 4 for start, stop in checker.compared)
+
+
+def test_run(people, es_data_client):
+    checker = ElasticConsistencyChecker(PersonIdSerializer, repair=True,
+                                        checksum_fields={'score': 'score'})
+    report = checker.run()
+    assert sorted(report.missing) == sorted('%d' % pk for pk in people)
+    assert report.repaired == 30
+    DataDocType._index.refresh()
+
+    Person.objects.filter(pk=people[0]).update(score=100)
+    report = ElasticConsistencyChecker(PersonIdSerializer, repair=True,
+                                       checksum_fields={'score': 'score'}).run()
+    assert report.stale == ['%d' % people[0]]
+    assert report.repaired == 1
+    DataDocType._index.refresh()
+    assert DataDocType.get(id=people[0]).score == 100
+
+    assert ElasticConsistencyChecker(PersonIdSerializer).run().consistent
+
+
+def test_content_drift(people, es_data_client):
+    ElasticConsistencyChecker(PersonIdSerializer, repair=True).run()
+    DataDocType._index.refresh()
+    Person.objects.filter(pk=people[5]).update(first_name='changed')
+
+    # The sums of the checksum fields miss the change of other fields
+    checker = ElasticConsistencyChecker(PersonIdSerializer, checksum_fields={'score': 'score'})
+    assert checker.run().consistent
+
+    checker = ElasticConsistencyChecker(PersonIdSerializer, leaf_size=10)
+    report = checker.run()
+    assert report.stale == ['%d' % people[5]]
+    [(start, stop)] = report.mismatched_ranges
+    assert start <= people[5] < stop
+
+
+def test_date_field(people, es_data_client):
+    report = ElasticConsistencyChecker(PersonBirthdaySerializer, repair=True).run()
+    assert report.repaired == 30
+    DataDocType._index.refresh()
+    # The dates are compared as they are indexed
+    assert ElasticConsistencyChecker(PersonBirthdaySerializer).run().consistent
+
+
+def test_command(people, es_data_client, capsys):
+    call_command('check_es_consistency', 'tests.test_consistency.PersonIdSerializer',
+                 '--checksum-field', 'score')
+    out = capsys.readouterr().out
+    assert 'Missing:' in out
+    assert '30 missing' in out
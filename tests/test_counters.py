@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import threading
+
+import pytest
+from elasticsearch.exceptions import ConnectionError
+from elasticsearch.helpers import expand_action
+
+from rest_framework_elasticsearch.es_bulk import BulkResult, ElasticBulkIndexer
+from rest_framework_elasticsearch.es_counters import ElasticCounterBuffer
+from .test_data import DataDocType
+from .utils import PersonSerializer, RecordingIndexer
+
+
+class RecordingCounterBuffer(ElasticCounterBuffer):
+    """Counter buffer which records bulk actions instead of sending them"""
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingCounterBuffer, self).__init__(*args, **kwargs)
+        self.sent = []
+        self.flushed = threading.Event()
+
+    def get_bulk_indexer(self):
+        indexer = RecordingIndexer()
+        indexer.sent = self.sent
+        return indexer
+
+    def flush(self):
+        result = super(RecordingCounterBuffer, self).flush()
+        if result.success:
+            self.flushed.set()
+        return result
+
+
+class FailingIndexer(RecordingIndexer):
+    """Indexer which fails the updates of the documents with the statuses"""
+
+    def __init__(self, statuses, *args, **kwargs):
+        super(FailingIndexer, self).__init__(*args, **kwargs)
+        self.statuses = statuses
+
+    def send(self, actions, **kwargs):
+        result = BulkResult()
+        for action in actions:
+            self.sent.append(action)
+            if action['_id'] in self.statuses:
+                result.errors.append({'update': {'_id': str(action['_id']),
+                                                 'status': self.statuses[action['_id']]}})
+            else:
+                result.success += 1
+        return result
+
+
+class FailingCounterBuffer(RecordingCounterBuffer):
+    statuses = {}
+
+    def get_bulk_indexer(self):
+        indexer = FailingIndexer(self.statuses, raise_on_error=False)
+        indexer.sent = self.sent
+        return indexer
+
+
+class InterruptedIndexer(ElasticBulkIndexer):
+    """Indexer which applies the first update and loses the connection"""
+
+    def streaming(self, client, actions, **kwargs):
+        actions = iter(actions)
+        action = next(actions)
+        yield True, {'update': {'_id': str(action['_id']), 'status': 200}}
+        raise ConnectionError('N/A', 'connection lost', None)
+
+
+class InterruptedCounterBuffer(ElasticCounterBuffer):
+    def get_bulk_indexer(self):
+        return InterruptedIndexer(raise_on_error=False)
+
+
+def get_counters(actions):
+    return dict((action['_id'], action['script']['params']['counters'])
+                for action in actions)
+
+
+def test_aggregation():
+    buffer = RecordingCounterBuffer(PersonSerializer)
+    buffer.incr(1, 'score')
+    buffer.incr(1, 'score', 2)
+    buffer.incr(2, 'score')
+    buffer.incr(2, 'likes')
+    buffer.decr(3, 'score')
+    buffer.incr(3, 'score')
+    assert len(buffer) == 3
+
+    result = buffer.flush()
+    assert result.success == 2
+    assert len(buffer) == 0
+    assert get_counters(buffer.sent) == {1: {'score': 3}, 2: {'score': 1, 'likes': 1}}
+    action = buffer.sent[0]
+    assert (action['_op_type'], action['_index'], action['_type']) == ('update', 'test', 'doc')
+    meta, body = expand_action(action)
+    assert meta['update']['retry_on_conflict'] == buffer.retry_on_conflict
+    assert list(body) == ['script']
+
+    assert buffer.flush().success == 0
+    assert len(buffer.sent) == 2
+
+
+def test_flush_by_size():
+    buffer = RecordingCounterBuffer(PersonSerializer, max_size=2)
+    buffer.incr(1, 'score')
+    buffer.incr(1, 'score')
+    assert buffer.sent == []
+    buffer.incr(2, 'score')
+    assert get_counters(buffer.sent) == {1: {'score': 2}, 2: {'score': 1}}
+
+
+def test_background_flush():
+    buffer = RecordingCounterBuffer(PersonSerializer, interval=0.01).start()
+    try:
+        buffer.incr(1, 'score')
+        assert buffer.flushed.wait(5)
+        assert get_counters(buffer.sent) == {1: {'score': 1}}
+    finally:
+        buffer.close()
+
+
+def test_close():
+    buffer = RecordingCounterBuffer(PersonSerializer, interval=60).start()
+    buffer.incr(1, 'score', 5)
+    buffer.close()
+    assert buffer._thread is None
+    assert get_counters(buffer.sent) == {1: {'score': 5}}
+
+
+def test_failed_updates():
+    buffer = FailingCounterBuffer(PersonSerializer, statuses={1: 429, 2: 404, 3: 503})
+    buffer.incr(1, 'score', 2)
+    buffer.incr(2, 'score')
+    buffer.incr(3, 'score')
+    buffer.incr(4, 'score')
+    result = buffer.flush()
+    assert result.success == 1
+    assert len(result.errors) == 3
+    # The missing document is dropped, the rejected increments are retried
+    assert buffer.dropped == 1
+    assert len(buffer) == 2
+
+    buffer.statuses = {}
+    buffer.sent[:] = []
+    buffer.incr(1, 'score')
+    assert buffer.flush().success == 2
+    assert get_counters(buffer.sent) == {1: {'score': 3}, 3: {'score': 1}}
+    assert buffer.dropped == 1
+
+
+def test_interrupted_flush():
+    buffer = InterruptedCounterBuffer(PersonSerializer)
+    buffer.incr(1, 'score', 2)
+    buffer.incr(2, 'score')
+    with pytest.raises(ConnectionError):
+        buffer.flush()
+    # The applied update is not sent again
+    assert dict(buffer._pending) == {2: {'score': 1}}
+
+
+def test_register_at_exit_once(monkeypatch):
+    registered = []
+    monkeypatch.setattr('atexit.register', registered.append)
+    buffer = RecordingCounterBuffer(PersonSerializer, interval=60)
+    for _ in range(2):
+        buffer.start()
+        buffer.close()
+    assert registered == [buffer.close]
+
+
+def test_concurrent_increments():
+    buffer = RecordingCounterBuffer(PersonSerializer, max_size=10)
+
+    def increment():
+        for i in range(1000):
+            buffer.incr(i % 20, 'score')
+
+    threads = [threading.Thread(target=increment) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    buffer.flush()
+    assert sum(action['script']['params']['counters']['score']
+               for action in buffer.sent) == 4000
+
+
+def test_scripted_update(es_data_client):
+    buffer = ElasticCounterBuffer(PersonSerializer)
+    buffer.incr(1, 'score', 5)
+    buffer.incr(2, 'score')
+    buffer.incr(2, 'views', 2)
+    result = buffer.flush()
+    assert result.success == 2
+
+    DataDocType._index.refresh()
+    assert DataDocType.get(id=1).score == 105
+    assert DataDocType.get(id=2).score == 201
+    assert DataDocType.get(id=2).views == 2
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import pytest
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from elasticsearch.helpers import BulkIndexError
+
+from rest_framework_elasticsearch.es_indexing import (
+    ElasticIndexDispatcher, INDEX, DELETE, DEPENDENTS)
+from .models import Author, Person
+from .test_data import DataDocType
+from .utils import AuthorPersonSerializer, PersonSerializer
+
+
+class RecordingDispatcher(ElasticIndexDispatcher):
+    """Dispatcher which records flushed items instead of sending them"""
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingDispatcher, self).__init__(*args, **kwargs)
+        self.flushed = []
+        self.exception = None
+
+    def flush_items(self, items, using='default'):
+        if self.exception is not None:
+            raise self.exception
+        self.flushed.append(dict(items))
+
+
+@pytest.fixture
+def dispatcher(db):
+    dispatcher = RecordingDispatcher()
+    dispatcher.register(Person, PersonSerializer)
+    yield dispatcher
+    dispatcher.unregister(Person)
+
+
+def test_get_serializer_class(dispatcher):
+    assert dispatcher.get_serializer_class(Person) == PersonSerializer
+    dispatcher.unregister(Person)
+    with pytest.raises(ValueError):
+        dispatcher.get_serializer_class(Person)
+
+
+def test_autocommit(dispatcher):
+    person = Person.objects.create(first_name='Zofia')
+    assert dispatcher.flushed == [{(Person, person.pk): INDEX}]
+
+
+def test_coalesce_on_commit(dispatcher):
+    with transaction.atomic():
+        person = Person.objects.create(first_name='Zofia')
+        person.score = 10
+        person.save()
+        other = Person.objects.create(first_name='Eldon')
+        other_pk = other.pk
+        other.delete()
+        assert dispatcher.flushed == []
+
+    assert dispatcher.flushed == [{
+        (Person, person.pk): INDEX,
+        (Person, other_pk): DELETE,
+    }]
+
+
+def test_rollback(dispatcher):
+    with pytest.raises(ValueError):
+        with transaction.atomic():
+            Person.objects.create(first_name='Zofia')
+            raise ValueError()
+    assert dispatcher.flushed == []
+
+    with transaction.atomic():
+        person = Person.objects.create(first_name='Eldon')
+    # Items of the rolled back transaction are dropped
+    assert dispatcher.flushed == [{(Person, person.pk): INDEX}]
+
+
+def test_flush_error(dispatcher, caplog):
+    dispatcher.exception = BulkIndexError('failed', [])
+    callbacks = []
+    with transaction.atomic():
+        Person.objects.create(first_name='Zofia')
+        transaction.on_commit(lambda: callbacks.append(True))
+    # The error is logged and the other callbacks are run
+    assert callbacks == [True]
+    assert 'Failed to sync 1 object(s) on commit' in caplog.text
+
+    dispatcher.raise_on_error = True
+    with pytest.raises(BulkIndexError):
+        with transaction.atomic():
+            Person.objects.create(first_name='Eldon')
+
+
+def test_suspended(dispatcher):
+    with dispatcher.suspended():
+        people = [Person.objects.create(first_name='name %d' % i) for i in range(3)]
+        Person.objects.filter(pk=people[0].pk).delete()
+        assert dispatcher.flushed == []
+
+    assert dispatcher.flushed == [{
+        (Person, people[0].pk): DELETE,
+        (Person, people[1].pk): INDEX,
+        (Person, people[2].pk): INDEX,
+    }]
+
+
+def test_suspended_in_transaction(dispatcher):
+    with transaction.atomic():
+        with dispatcher.suspended():
+            person = Person.objects.create(first_name='Zofia')
+        assert dispatcher.flushed == []
+    assert dispatcher.flushed == [{(Person, person.pk): INDEX}]
+
+
+def test_reindex(dispatcher):
+    people = [Person.objects.create(first_name='name %d' % i) for i in range(2)]
+    dispatcher.flushed = []
+    with transaction.atomic():
+        Person.objects.update(score=1)
+        dispatcher.reindex(Person, [person.pk for person in people])
+    assert dispatcher.flushed == [{
+        (Person, people[0].pk): INDEX,
+        (Person, people[1].pk): INDEX,
+    }]
+
+
+@pytest.fixture
+def dependency_dispatcher(db):
+    dispatcher = RecordingDispatcher()
+    dispatcher.register(Person, AuthorPersonSerializer)
+    yield dispatcher
+    dispatcher.unregister(Person)
+
+
+def test_register_dependencies(dependency_dispatcher):
+    assert dependency_dispatcher._dependencies == {Author: [(Person, 'author')]}
+    dependency_dispatcher.unregister(Person)
+    assert dependency_dispatcher._dependencies == {}
+
+
+def test_dependency_save(dependency_dispatcher):
+    author = Author.objects.create(name='Zofia')
+    assert dependency_dispatcher.flushed == [{(Author, author.pk): DEPENDENTS}]
+
+
+def test_dependency_indexed(db):
+    # The related model is indexed itself as well
+    dispatcher = RecordingDispatcher()
+    dispatcher.register(Author, PersonSerializer)
+    dispatcher.register(Person, AuthorPersonSerializer)
+    try:
+        with transaction.atomic():
+            author = Author.objects.create(name='Zofia')
+        with dispatcher.suspended():
+            other = Author.objects.create(name='Eldon')
+    finally:
+        dispatcher.unregister(Person)
+        dispatcher.unregister(Author)
+    # DEPENDENTS does not replace the INDEX of the object
+    assert dispatcher.flushed == [
+        {(Author, author.pk): INDEX}, {(Author, other.pk): INDEX}]
+
+
+def test_dependency_delete(dependency_dispatcher):
+    author = Author.objects.create(name='Zofia')
+    people = [Person.objects.create(first_name='name %d' % i, author=author)
+              for i in range(2)]
+    dependency_dispatcher.flushed = []
+    with transaction.atomic():
+        author.delete()
+    # Dependent objects are resolved before the relations are removed
+    assert dependency_dispatcher.flushed == [{
+        (Person, people[0].pk): INDEX,
+        (Person, people[1].pk): INDEX,
+    }]
+
+
+def test_get_dependent_pks(dependency_dispatcher):
+    authors = [Author.objects.create(name='name %d' % i) for i in range(3)]
+    people = [Person.objects.create(first_name='name %d' % i, author=author)
+              for i, author in enumerate(authors)]
+    with CaptureQueriesContext(connection) as queries:
+        dependent = dependency_dispatcher.get_dependent_pks(
+            Author, [authors[0].pk, authors[2].pk])
+    assert len(queries) == 1
+    assert sorted(dependent[Person]) == [people[0].pk, people[2].pk]
+
+
+def test_flush_dependents(db, es_data_client):
+    dispatcher = ElasticIndexDispatcher()
+    dispatcher.register(Person, AuthorPersonSerializer)
+    try:
+        author = Author.objects.create(name='Zofia')
+        person = Person.objects.create(first_name='Eldon', author=author)
+        dispatcher.flush_items({(Author, author.pk): DEPENDENTS})
+        DataDocType._index.refresh()
+        assert DataDocType.get(id=person.pk).first_name == 'Eldon'
+    finally:
+        dispatcher.unregister(Person)
+
+
+def test_flush_items(db, es_data_client):
+    dispatcher = ElasticIndexDispatcher()
+    dispatcher.register(Person, PersonSerializer)
+    try:
+        with transaction.atomic():
+            person = Person.objects.create(first_name='Zofia', score=5)
+            removed = Person.objects.create(first_name='Eldon')
+            removed_pk = removed.pk
+            removed.delete()
+        DataDocType._index.refresh()
+        assert DataDocType.get(id=person.pk).to_dict() == {
+            'first_name': 'Zofia', 'last_name': '', 'score': 5}
+
+        # Queued object which does not exist anymore is deleted
+        dispatcher.flush_items({(Person, person.pk): INDEX,
+                                (Person, removed_pk): INDEX})
+        assert DataDocType.get(id=removed_pk, ignore=404) is None
+
+        person_pk = person.pk
+        with transaction.atomic():
+            person.delete()
+        DataDocType._index.refresh()
+        assert DataDocType.get(id=person_pk, ignore=404) is None
+    finally:
+        dispatcher.unregister(Person)
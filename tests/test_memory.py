@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import pytest
+from elasticsearch.exceptions import ConflictError, NotFoundError, RequestError
+from elasticsearch.helpers import bulk, scan
+from elasticsearch_dsl import Search
+from elasticsearch_dsl.connections import connections
+
+from rest_framework_elasticsearch.testing.es_memory import (
+    analyze, filter_source, get_in_memory_client,
+    get_minimum_should_match, in_memory_connection, parse_distance, parse_geo_point)
+from .test_data import DATA
+
+
+@pytest.fixture
+def client(in_memory_es):
+    in_memory_es.indices.create('people', body={'mappings': {'doc': {'properties': {
+        'name': {'type': 'keyword'},
+        'bio': {'type': 'text'},
+        'age': {'type': 'integer'},
+        'joined': {'type': 'date'},
+        'location': {'type': 'geo_point'},
+    }}}})
+    bulk(in_memory_es, [
+        {'_index': 'people', '_type': 'doc', '_id': '1', '_source': {
+            'name': 'ann', 'bio': 'Python developer from Oslo', 'age': 31,
+            'joined': '2015-01-10', 'location': {'lat': 59.91, 'lon': 10.75}}},
+        {'_index': 'people', '_type': 'doc', '_id': '2', '_source': {
+            'name': 'bob', 'bio': 'Java and Python developer', 'age': 25,
+            'joined': '2018-06-01', 'location': {'lat': 52.52, 'lon': 13.40}}},
+        {'_index': 'people', '_type': 'doc', '_id': '3', '_source': {
+            'name': 'eve', 'bio': 'Developer advocate', 'joined': '2012-03-04',
+            'location': {'lat': 40.71, 'lon': -74.0}}},
+    ], refresh=True)
+    return in_memory_es
+
+
+def search_ids(client, body, index='people'):
+    response = client.search(index=index, body=body)
+    return [hit['_id'] for hit in response['hits']['hits']]
+
+
+def test_helpers():
+    assert analyze("Don't PANIC, it's 42") == ["don't", 'panic', "it's", '42']
+    assert parse_distance('2km') == 2000
+    assert parse_distance('1.5mi') == pytest.approx(2414.016)
+    assert parse_geo_point('41.12,-71.34') == (41.12, -71.34)
+    assert parse_geo_point([-71.34, 41.12]) == (41.12, -71.34)
+    assert parse_geo_point('drm3btev3e86') == pytest.approx((41.12, -71.34), abs=1e-4)
+    assert get_minimum_should_match('75%', 4) == 3
+    assert get_minimum_should_match('-1', 4) == 3
+    assert get_minimum_should_match('2<-25% 9<3', 10) == 3
+    assert filter_source({'a': {'b': 1, 'c': 2}, 'd': 3}, ['a.b']) == {'a': {'b': 1}}
+    assert filter_source({'a': {'b': 1, 'c': 2}, 'd': 3}, (), ['a.*']) == {'a': {}, 'd': 3}
+
+
+@pytest.mark.parametrize('query, expected', [
+    ({'term': {'name': 'bob'}}, ['2']),
+    ({'terms': {'age': ['31', 25]}}, ['1', '2']),
+    ({'range': {'age': {'gt': 25}}}, ['1']),
+    ({'range': {'joined': {'gte': '2015-01-01', 'lt': 'now'}}}, ['1', '2']),
+    ({'exists': {'field': 'age'}}, ['1', '2']),
+    ({'ids': {'values': ['3', '4']}}, ['3']),
+    ({'prefix': {'name': 'e'}}, ['3']),
+    ({'wildcard': {'name': '?o*'}}, ['2']),
+    ({'match': {'bio': {'query': 'python oslo', 'operator': 'and'}}}, ['1']),
+    ({'match': {'bio': {'query': 'pyhton', 'fuzziness': 'AUTO'}}}, ['1', '2']),
+    ({'match_phrase': {'bio': 'python developer'}}, ['1', '2']),
+    ({'match_phrase': {'bio': 'developer python'}}, []),
+    ({'match_phrase_prefix': {'bio': 'developer adv'}}, ['3']),
+    ({'bool': {'must_not': {'term': {'name': 'ann'}}}}, ['2', '3']),
+    ({'bool': {'should': [{'term': {'name': 'ann'}}, {'term': {'age': 25}},
+                          {'term': {'name': 'bob'}}],
+               'minimum_should_match': 2}}, ['2']),
+    ({'geo_distance': {'distance': '1000km', 'location': '55,12'}}, ['1', '2']),
+    ({'geo_bounding_box': {'location': {'top_left': {'lat': 60, 'lon': 0},
+                                        'bottom_right': {'lat': 50, 'lon': 12}}}}, ['1']),
+    ({'geo_bounding_box': {'location': {'top_left': {'lat': 60, 'lon': 170},
+                                        'bottom_right': {'lat': 30, 'lon': -70}}}}, ['3']),
+    ({'term': {'unmapped': 'x'}}, []),
+])
+def test_queries(client, query, expected):
+    body = {'query': {'constant_score': {'filter': query}}, 'sort': ['_id']}
+    assert search_ids(client, body) == expected
+
+
+def test_scoring(client):
+    # The shorter bio is a better match
+    assert search_ids(client, {'query': {'match': {'bio': 'developer'}}}) == ['3', '1', '2']
+    # The rare term is a better match
+    response = client.search(index='people', body={
+        'query': {'multi_match': {'query': 'python advocate', 'fields': ['name', 'bio']}}})
+    hits = response['hits']['hits']
+    assert [hit['_id'] for hit in hits] == ['3', '1', '2']
+    assert response['hits']['max_score'] == hits[0]['_score'] > hits[1]['_score']
+
+    def get_score(fields):
+        response = client.search(index='people', body={
+            'query': {'multi_match': {'query': 'ann', 'fields': fields}}})
+        return response['hits']['max_score']
+    assert get_score(['name^3', 'bio']) == pytest.approx(get_score(['name']) * 3)
+
+
+def test_sort(client):
+    assert search_ids(client, {'sort': [{'age': 'desc'}]}) == ['1', '2', '3']
+    assert search_ids(client, {'sort': [{'age': {'order': 'asc', 'missing': '_first'}}]}) == [
+        '3', '2', '1']
+    response = client.search(index='people', body={
+        'sort': [{'_geo_distance': {'location': '59,10', 'unit': 'km'}}]})
+    hits = response['hits']['hits']
+    assert [hit['_id'] for hit in hits] == ['1', '2', '3']
+    assert hits[0]['sort'][0] == pytest.approx(109.7, abs=0.1)
+    assert hits[0]['_score'] is None
+
+    with pytest.raises(RequestError):
+        client.search(index='people', body={'sort': ['bio']})
+    with pytest.raises(RequestError):
+        client.search(index='people', body={'sort': ['unmapped']})
+    assert search_ids(client, {'sort': [{'unmapped': {'unmapped_type': 'long'}}]}) == [
+        '1', '2', '3']
+
+
+def test_pagination(client):
+    assert search_ids(client, {'sort': ['name'], 'from': 1, 'size': 1}) == ['2']
+    assert search_ids(client, {'sort': ['name'], 'search_after': ['ann']}) == ['2', '3']
+    with pytest.raises(RequestError):
+        client.search(index='people', body={'from': 10000, 'size': 10})
+
+    # The scroll has no result window
+    results = list(scan(client, index='people', size=1, query={'sort': ['_doc']}))
+    assert [hit['_id'] for hit in results] == ['1', '2', '3']
+    assert not client.transport.get_connection().engine.scrolls
+
+
+def test_source_filtering(client):
+    response = client.search(index='people', body={
+        'query': {'ids': {'values': ['1']}}, '_source': {'includes': ['name', 'loc*'],
+                                                         'excludes': ['*.lon']}})
+    assert response['hits']['hits'][0]['_source'] == {'name': 'ann', 'location': {'lat': 59.91}}
+    response = client.get('people', 'doc', '1', _source_includes='age')
+    assert response['_source'] == {'age': 31}
+    response = client.search(index='people', body={'_source': False})
+    assert '_source' not in response['hits']['hits'][0]
+
+
+def test_count_and_aggregations(client):
+    assert client.count(index='people', body={'query': {'match': {'bio': 'python'}}}) == {
+        'count': 2, '_shards': {'total': 1, 'successful': 1, 'skipped': 0, 'failed': 0}}
+    response = client.search(index='people', body={'size': 0, 'aggs': {
+        'min': {'min': {'field': 'age'}},
+        'max': {'max': {'field': 'joined'}},
+        'names': {'terms': {'field': 'name', 'size': 2}},
+        'ages': {'range': {'field': 'age', 'keyed': True, 'ranges': [{'to': 30}, {'from': 30}]},
+                 'aggs': {'total': {'sum': {'field': 'age'}}}},
+    }})
+    aggs = response['aggregations']
+    assert aggs['min'] == {'value': 25.0}
+    assert aggs['max']['value_as_string'] == '2018-06-01T00:00:00.000Z'
+    assert [bucket['key'] for bucket in aggs['names']['buckets']] == ['ann', 'bob']
+    assert aggs['names']['sum_other_doc_count'] == 1
+    assert aggs['ages']['buckets']['*-30.0']['total'] == {'value': 25.0}
+    assert aggs['ages']['buckets']['30.0-*']['doc_count'] == 1
+
+
+def test_unsupported(client):
+    with pytest.raises(RequestError) as error:
+        client.search(index='people', body={'query': {'more_like_this': {'like': 'x'}}})
+    assert 'in-memory engine' in error.value.info['error']['reason']
+    with pytest.raises(RequestError):
+        client.search(index='people', body={'suggest': {}})
+    with pytest.raises(RequestError):
+        client.update('people', 'doc', '1', body={'script': 'ctx._source.tags.add(1)'})
+
+
+def test_documents(client):
+    response = client.index('people', 'doc', {'name': 'joe'}, id='4')
+    assert (response['result'], response['_version']) == ('created', 1)
+    response = client.index('people', 'doc', {'name': 'joe', 'age': 40}, id='4')
+    assert (response['result'], response['_version']) == ('updated', 2)
+    with pytest.raises(ConflictError):
+        client.create('people', 'doc', '4', {'name': 'joe'})
+    with pytest.raises(ConflictError):
+        client.index('people', 'doc', {'name': 'joe'}, id='4', version=1)
+    with pytest.raises(ConflictError):
+        client.index('people', 'doc', {'name': 'joe'}, id='4', version=2,
+                     version_type='external')
+    with pytest.raises(RequestError):
+        client.index('people', 'doc', {'age': 'old'}, id='5')
+
+    client.update('people', 'doc', '4', body={'script': {
+        'source': 'ctx._source.age += params.years', 'params': {'years': 2}}})
+    assert client.get('people', 'doc', '4')['_source'] == {'name': 'joe', 'age': 42}
+    client.update('people', 'doc', '4', body={'doc': {'name': 'joseph'}})
+    assert client.get('people', 'doc', '4')['_source']['name'] == 'joseph'
+
+    client.delete('people', 'doc', '4')
+    assert not client.exists('people', 'doc', '4')
+    with pytest.raises(NotFoundError):
+        client.delete('people', 'doc', '4')
+    # The version of the deleted document is not reused
+    response = client.index('people', 'doc', {'name': 'joe'}, id='4')
+    assert response['_version'] == 6
+
+
+def test_bulk_errors(client):
+    success, errors = bulk(client, [
+        {'_index': 'people', '_type': 'doc', '_id': '1', '_source': {'name': 'ann'},
+         '_op_type': 'create'},
+        {'_index': 'people', '_type': 'doc', '_id': '9', '_op_type': 'delete'},
+        {'_index': 'people', '_type': 'doc', '_id': '2', '_op_type': 'update',
+         'doc': {'age': 26}},
+    ], raise_on_error=False)
+    assert success == 1
+    assert [list(error.values())[0]['status'] for error in errors] == [409, 404]
+
+
+def test_refresh_interval(client):
+    client.indices.put_settings(index='people', body={'index': {'refresh_interval': '-1'}})
+    client.index('people', 'doc', {'name': 'joe'}, id='4')
+    assert client.count(index='people')['count'] == 3
+    # The realtime get sees the document
+    assert client.get('people', 'doc', '4')['found']
+    client.indices.refresh('people')
+    assert client.count(index='people')['count'] == 4
+
+    client.indices.put_settings(index='people', body={'index': {'refresh_interval': None}})
+    settings = client.indices.get_settings(index='people')['people']['settings']['index']
+    assert 'refresh_interval' not in settings
+    assert settings['number_of_replicas'] == '1'
+
+
+def test_indices_and_aliases(client):
+    client.indices.put_template('logs', body={
+        'index_patterns': ['logs-*'], 'aliases': {'logs': {}},
+        'mappings': {'doc': {'properties': {'level': {'type': 'keyword'}}}}})
+    client.index('logs-1', 'doc', {'level': 'info'}, id='1', refresh=True)
+    assert client.indices.get_mapping('logs-1')['logs-1']['mappings']['doc']['properties'] == {
+        'level': {'type': 'keyword'}}
+    assert search_ids(client, {}, index='logs') == ['1']
+
+    client.indices.update_aliases(body={'actions': [
+        {'add': {'index': 'people', 'alias': 'all'}},
+        {'add': {'index': 'logs-1', 'alias': 'all'}},
+    ]})
+    assert client.count(index='all')['count'] == 4
+    assert sorted(client.indices.get_alias(name='all')) == ['logs-1', 'people']
+    with pytest.raises(RequestError):
+        # No write index
+        client.index('all', 'doc', {'level': 'info'})
+    with pytest.raises(NotFoundError):
+        client.indices.get_alias(name='missing')
+
+    client.indices.delete('logs-*')
+    assert list(client.indices.get_alias(name='all')) == ['people']
+    assert not client.indices.exists('logs-1')
+
+
+def test_dynamic_mapping(in_memory_es):
+    in_memory_es.index('dynamic', 'doc', {'title': 'Hello', 'count': 1, 'created': '2018-01-01',
+                                          'tags': ['a', 'b'], 'author': {'name': 'ann'}},
+                       id='1', refresh=True)
+    properties = in_memory_es.indices.get_mapping('dynamic')['dynamic']['mappings']['doc'][
+        'properties']
+    assert properties['title']['type'] == 'text'
+    assert properties['title']['fields']['keyword']['type'] == 'keyword'
+    assert properties['count'] == {'type': 'long'}
+    assert properties['created'] == {'type': 'date'}
+    assert properties['author']['properties']['name']['type'] == 'text'
+    assert search_ids(in_memory_es, {'query': {'term': {'title.keyword': 'Hello'}}},
+                      index='dynamic') == ['1']
+    assert search_ids(in_memory_es, {'query': {'match': {'author.name': 'ANN'}}},
+                      index='dynamic') == ['1']
+
+
+def test_register_script(client):
+    engine = client.transport.get_connection().engine
+
+    def add_tag(ctx, params):
+        ctx['_source'].setdefault('tags', []).append(params['tag'])
+
+    script = 'ctx._source.tags.add(params.tag)'
+    engine.register_script(script, add_tag)
+    client.update_by_query(index='people', body={
+        'query': {'term': {'name': 'ann'}},
+        'script': {'source': script, 'params': {'tag': 'admin'}}}, refresh=True)
+    assert client.get('people', 'doc', '1')['_source']['tags'] == ['admin']
+
+
+def test_dsl_connection():
+    with in_memory_connection() as client:
+        bulk(client, DATA, refresh=True)
+        assert connections.get_connection() is client
+        assert Search(index='test').filter('term', is_active=False).count() == 4
+    assert connections.get_connection() is not client
+
+
+def test_separate_engines():
+    first, second = get_in_memory_client(), get_in_memory_client()
+    first.index('people', 'doc', {'name': 'ann'}, id='1')
+    assert not second.indices.exists('people')
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import pytest
+from django.test import RequestFactory
+from elasticsearch.exceptions import ConnectionTimeout
+
+from rest_framework_elasticsearch.es_bulk import ElasticBulkIndexer
+from rest_framework_elasticsearch.es_metrics import (
+    ElasticMetricsCollector, MetricsRegistry, StatsdSink, get_operation,
+    metrics_view, prometheus_text)
+from rest_framework_elasticsearch.es_queryset import ElasticQuerySet
+from rest_framework_elasticsearch.es_timing import RequestTimer, TimedSearch
+from .test_data import DataDocType
+from .utils import StubElasticsearch
+
+
+class TimeoutElasticsearch(StubElasticsearch):
+    def count(self, index=None, doc_type=None, body=None, **params):
+        raise ConnectionTimeout('TIMEOUT', 'timed out', None)
+
+
+class RecordingSink(object):
+    def __init__(self):
+        self.sent = []
+
+    def inc(self, name, value, labels):
+        self.sent.append(('inc', name, value, labels))
+
+    def observe(self, name, value, labels):
+        self.sent.append(('observe', name, value, labels))
+
+
+class RecordingStatsdSink(StatsdSink):
+    def __init__(self, *args, **kwargs):
+        super(RecordingStatsdSink, self).__init__(*args, **kwargs)
+        self.sent = []
+
+    def send(self, data):
+        self.sent.append(data)
+
+
+@pytest.fixture
+def collector():
+    collector = ElasticMetricsCollector(MetricsRegistry())
+    collector.connect()
+    yield collector
+    collector.disconnect()
+
+
+def test_counter_and_histogram():
+    registry = MetricsRegistry()
+    registry.counter('requests', 'Requests.', ('view',))
+    registry.histogram('latency', 'Latency.', buckets=(0.1, 1))
+    registry.inc('requests', view='a')
+    registry.inc('requests', 2, view='a')
+    registry.observe('latency', 0.05)
+    registry.observe('latency', 0.5)
+    assert registry.get_metric('requests').get(view='a') == 3
+    assert registry.get_metric('latency').get() == (0.55, 2)
+
+    text = prometheus_text(registry)
+    assert '# TYPE requests counter' in text
+    assert 'requests{view="a"} 3.0' in text
+    assert 'latency_bucket{le="0.1"} 1.0' in text
+    assert 'latency_bucket{le="1"} 2.0' in text
+    assert 'latency_bucket{le="+Inf"} 2.0' in text
+    assert 'latency_count 2.0' in text
+
+    registry.clear()
+    assert registry.get_metric('requests').get(view='a') == 0
+
+
+def test_sinks():
+    sink = RecordingSink()
+    registry = MetricsRegistry(sinks=[sink])
+    registry.counter('requests', 'Requests.', ('view',))
+    registry.inc('requests', view='a')
+    assert sink.sent == [('inc', 'requests', 1, {'view': 'a'})]
+
+
+def test_statsd_sink():
+    sink = RecordingStatsdSink(prefix='app')
+    sink.inc('es_requests_total', 1, {'view': 'Blog View', 'operation': 'search'})
+    sink.observe('es_request_duration_seconds', 0.25, {'view': '', 'operation': 'bulk'})
+    assert sink.sent == ['app.es_requests_total.search.Blog_View:1|c',
+                         'app.es_request_duration_seconds.bulk:0.25|h']
+
+
+def test_get_operation():
+    assert get_operation('GET', '/blog/_search') == 'search'
+    # Scroll pages are searches
+    assert get_operation('POST', '/_search/scroll') == 'search'
+    assert get_operation('PUT', '/blog/_doc/1') == 'put'
+    assert get_operation('POST', '/_bulk?refresh=true') == 'bulk'
+
+
+def test_collect_search(collector):
+    registry = collector.registry
+    search = TimedSearch(using=StubElasticsearch(), index='test', doc_type=DataDocType)
+    search.timer(RequestTimer('BlogView')).execute()
+    with pytest.raises(ConnectionTimeout):
+        TimedSearch(using=TimeoutElasticsearch(), index='test').count()
+
+    requests = registry.get_metric('es_requests_total')
+    assert requests.get(view='BlogView', operation='search') == 1
+    assert requests.get(view='', operation='count') == 1
+    assert registry.get_metric('es_hits_total').get(view='BlogView', operation='search') == 1
+    assert registry.get_metric('es_took_seconds').get(
+        view='BlogView', operation='search') == (0.003, 1)
+    assert registry.get_metric('es_request_errors_total').get(
+        view='', operation='count', error='timeout') == 1
+
+
+def test_collect_cache(collector):
+    queryset = ElasticQuerySet(TimedSearch(using=StubElasticsearch(), index='test'))
+    queryset[0:10]
+    queryset[0:5]
+    queryset.count()
+    cache = collector.registry.get_metric('es_cache_requests_total')
+    assert cache.get(cache='queryset', result='miss') == 1
+    assert cache.get(cache='queryset', result='hit') == 1
+    assert cache.get(cache='queryset_count', result='hit') == 1
+
+
+def test_collect_bulk(collector, monkeypatch):
+    def streaming(self, client, actions, **kwargs):
+        for action in actions:
+            if action['_id'] == 2:
+                yield False, {'index': {'_id': 2, 'status': 400}}
+            else:
+                yield True, {'index': {'_id': action['_id'], 'status': 201}}
+
+    monkeypatch.setattr(ElasticBulkIndexer, 'streaming', streaming)
+    ElasticBulkIndexer(StubElasticsearch(), raise_on_error=False).bulk(
+        [{'_id': 1}, {'_id': 2}, {'_id': 3}])
+    registry = collector.registry
+    assert registry.get_metric('es_requests_total').get(view='', operation='bulk') == 1
+    documents = registry.get_metric('es_bulk_documents_total')
+    assert documents.get(result='success') == 2
+    assert documents.get(result='error') == 1
+
+
+def test_metrics_view():
+    response = metrics_view(RequestFactory().get('/metrics'))
+    assert response.status_code == 200
+    assert response['Content-Type'].startswith('text/plain; version=0.0.4')
+    assert b'# TYPE es_requests_total counter' in response.content
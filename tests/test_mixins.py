@@ -1,17 +1,21 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import json
+
 import pytest
-from rest_framework.test import APIRequestFactory
+from elasticsearch.exceptions import ConnectionError
+from rest_framework import serializers
 
+from rest_framework_elasticsearch.es_bulk import ElasticBulkIndexer
 from rest_framework_elasticsearch.es_mixins import ListElasticMixin
-from rest_framework_elasticsearch.es_views import ElasticAPIView
+from rest_framework_elasticsearch.es_serializer import ElasticSerializer
+from rest_framework_elasticsearch.es_views import (
+    BulkIngestElasticAPIView, ElasticAPIView)
 from rest_framework_elasticsearch.es_pagination import (
     ElasticLimitOffsetPagination)
 from .test_data import DATA, DataDocType
-
-
-rf = APIRequestFactory()
+from .utils import rf
 
 
 def create_view(es_client):
@@ -104,3 +108,164 @@ def test_list_representation(search, es_client):
     assert response.data['next'] is None
     assert response.data['previous'] is None
     assert len(response.data['results']) == 1
+
+
+class IngestSerializer(ElasticSerializer):
+    id = serializers.IntegerField()
+    first_name = serializers.CharField()
+    score = serializers.IntegerField(required=False)
+
+    class Meta:
+        es_model = DataDocType
+        es_bulk_options = {'chunk_size': 2}
+
+
+class RecordingIngestIndexer(ElasticBulkIndexer):
+    """Indexer which records chunks of actions instead of sending them"""
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingIngestIndexer, self).__init__(*args, **kwargs)
+        self.chunks = []
+
+    def get_client(self):
+        return None
+
+    def streaming(self, client, actions, **kwargs):
+        self.chunks.append(actions)
+        for action in actions:
+            if action['_id'] == 3:
+                yield False, {'index': {'_id': '3', 'status': 400, 'error': {'type': 'x'}}}
+            else:
+                yield True, {'index': {'_id': str(action['_id']), 'status': 201}}
+
+
+class RecordingIngestView(BulkIngestElasticAPIView):
+    authentication_classes = ()
+    permission_classes = ()
+    ingest_serializer_class = IngestSerializer
+
+    def get_ingest_bulk_indexer(self):
+        self.indexer = RecordingIngestIndexer(chunk_size=2)
+        return self.indexer
+
+
+def post_ndjson(view, lines):
+    body = '\n'.join(line if isinstance(line, str) else json.dumps(line)
+                     for line in lines)
+    request = rf.post('/', body, content_type='application/x-ndjson')
+    response = view(request)
+    return response, [json.loads(line) for line in b''.join(response).splitlines()]
+
+
+def test_ingest():
+    view = RecordingIngestView()
+    response, results = post_ndjson(view.as_view(), [])
+    assert response['Content-Type'] == 'application/x-ndjson'
+    assert results == [{'summary': {'lines': 0, 'indexed': 0, 'failed': 0}}]
+
+    lines = [{'id': 1, 'first_name': 'Zofia'},
+             {'id': 2, 'first_name': 'Callisto', 'score': 'x'},
+             '{"id": ',
+             {'id': 3, 'first_name': 'Eldon'},
+             {'id': 4, 'first_name': 'Nika'}]
+    response, results = post_ndjson(view.as_view(), lines)
+    assert results.pop() == {'summary': {'lines': 5, 'indexed': 2, 'failed': 3}}
+    assert [(result['line'], result['status']) for result in results] == [
+        (1, 201), (2, 400), (3, 400), (4, 400), (5, 201)]
+    assert results[0]['_id'] == '1'
+    assert 'score' in results[1]['error']
+    assert results[2]['error'].startswith('JSON parse error')
+    assert results[3]['error'] == {'type': 'x'}
+
+
+def test_ingest_chunks():
+    views = []
+
+    class View(RecordingIngestView):
+        def get_ingest_bulk_indexer(self):
+            views.append(self)
+            return super(View, self).get_ingest_bulk_indexer()
+
+    lines = [{'id': pk, 'first_name': 'name'} for pk in (1, 2, 4, 5, 6)]
+    post_ndjson(View.as_view(), lines)
+    assert [[action['_id'] for action in chunk] for chunk in views[0].indexer.chunks] == [
+        [1, 2], [4, 5], [6]]
+
+
+class FailingIngestIndexer(RecordingIngestIndexer):
+    """Indexer which loses the connection on the `fail_chunk` chunk"""
+    fail_chunk = 1
+
+    def streaming(self, client, actions, **kwargs):
+        if len(self.chunks) == self.fail_chunk:
+            raise ConnectionError('N/A', 'connection lost', None)
+        return super(FailingIngestIndexer, self).streaming(client, actions, **kwargs)
+
+
+class RejectingIngestIndexer(RecordingIngestIndexer):
+    """Indexer which rejects the first attempt of the document 1 with 429"""
+
+    def streaming(self, client, actions, **kwargs):
+        assert kwargs['max_retries'] == 0
+        self.chunks.append(actions)
+        for action in actions:
+            if action['_id'] == 1 and len(self.chunks) == 1:
+                yield False, {'index': {'_id': '1', 'status': 429, 'error': 'rejected'}}
+            else:
+                yield True, {'index': {'_id': str(action['_id']), 'status': 201}}
+
+
+def test_ingest_retry():
+    class View(RecordingIngestView):
+        def get_ingest_bulk_indexer(self):
+            self.indexer = RejectingIngestIndexer(chunk_size=3, initial_backoff=0)
+            return self.indexer
+
+    lines = [{'id': pk, 'first_name': 'name %d' % pk} for pk in (1, 2, 4)]
+    response, results = post_ndjson(View.as_view(), lines)
+    # The retried document is reported on its line
+    assert [(result['line'], result['_id'], result['status']) for result in results[:-1]] == [
+        (1, '1', 201), (2, '2', 201), (3, '4', 201)]
+
+
+def test_ingest_failure_in_stream():
+    class View(RecordingIngestView):
+        def get_ingest_bulk_indexer(self):
+            return FailingIngestIndexer(chunk_size=2)
+
+    lines = [{'id': pk, 'first_name': 'name'} for pk in (1, 2, 4, 5, 6)]
+    response, results = post_ndjson(View.as_view(), lines)
+    assert response.status_code == 200
+    assert [result['line'] for result in results[:-1]] == [1, 2]
+    # The failure after the response is started is reported in the last line
+    assert results[-1]['summary'] == {'lines': 2, 'indexed': 2, 'failed': 0}
+    assert 'connection lost' in results[-1]['error']
+
+
+def test_ingest_failure_before_stream():
+    class Indexer(FailingIngestIndexer):
+        fail_chunk = 0
+
+    class View(RecordingIngestView):
+        def get_ingest_bulk_indexer(self):
+            return Indexer(chunk_size=2)
+
+    # The failure of the first chunk is raised by the view
+    with pytest.raises(ConnectionError):
+        post_ndjson(View.as_view(), [{'id': 1, 'first_name': 'name'}])
+
+
+def test_ingest_view(es_data_client):
+    class View(BulkIngestElasticAPIView):
+        authentication_classes = ()
+        permission_classes = ()
+        es_client = es_data_client
+        ingest_serializer_class = IngestSerializer
+
+    lines = [{'id': 100 + pk, 'first_name': 'name %d' % pk} for pk in range(5)]
+    lines.append({'id': 200})
+    response, results = post_ndjson(View.as_view(), lines)
+    assert [result['status'] for result in results[:-1]] == [201] * 5 + [400]
+
+    DataDocType._index.refresh()
+    assert DataDocType.get(id=103).first_name == 'name 3'
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+import threading
+
+import pytest
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.utils.six import StringIO
+from elasticsearch_dsl import Search
+
+from rest_framework_elasticsearch.es_changes import ElasticChangeTracker
+from rest_framework_elasticsearch.es_operations import (
+    ElasticTaskError, collect_deletes, delete_by_query, get_search_request,
+    update_by_query, wait_for_task)
+from rest_framework_elasticsearch.es_serializer import ElasticListSerializer
+from .models import Person
+from .test_data import DataDocType
+from .utils import PersonSerializer
+
+
+class RecordingListSerializer(ElasticListSerializer):
+    """List serializer which records deleted ids instead of sending them"""
+    deleted = []
+
+    def delete_ids(self, ids, using=None, index=None, **kwargs):
+        self.deleted.append(list(ids))
+
+
+class RecordingPersonSerializer(PersonSerializer):
+    class Meta(PersonSerializer.Meta):
+        list_serializer_class = RecordingListSerializer
+
+
+class TasksClient(object):
+    """Client which returns the prepared states of a task"""
+
+    def __init__(self, states):
+        self.states = list(states)
+        self.tasks = self
+
+    def get(self, task_id):
+        return self.states.pop(0)
+
+
+class ByQueryClient(TasksClient):
+    """Client which records the by-query requests"""
+
+    def __init__(self, states):
+        super(ByQueryClient, self).__init__(states)
+        self.requests = []
+
+    def update_by_query(self, **kwargs):
+        self.requests.append(kwargs)
+        return {'task': 'node:1'}
+
+
+reconciled = []
+
+
+def reconcile(response):
+    reconciled.append(response)
+
+
+@pytest.fixture
+def deleted():
+    RecordingListSerializer.deleted = []
+    return RecordingListSerializer.deleted
+
+
+def test_get_search_request():
+    search = DataDocType.search().filter('term', first_name='Zofia')
+    client, index, body = get_search_request(search)
+    assert index == 'test'
+    assert body == {'query': {'bool': {'filter': [{'term': {'first_name': 'Zofia'}}]}}}
+
+    _, index, body = get_search_request(Search())
+    assert index == '_all'
+    assert body == {}
+
+
+def test_wait_for_task():
+    client = TasksClient([
+        {'completed': False, 'task': {'status': {'deleted': 1}}},
+        {'completed': True, 'task': {'status': {'deleted': 2}},
+         'response': {'deleted': 2, 'failures': []}},
+    ])
+    statuses = []
+    response = wait_for_task(client, 'node:1', poll_interval=0, callback=statuses.append)
+    assert response == {'deleted': 2, 'failures': []}
+    assert statuses == [{'deleted': 1}, {'deleted': 2}]
+
+
+def test_wait_for_failed_task():
+    client = TasksClient([
+        {'completed': True, 'task': {}, 'error': {'type': 'search_phase_execution_exception'}},
+    ])
+    with pytest.raises(ElasticTaskError) as err:
+        wait_for_task(client, 'node:1')
+    assert err.value.task_id == 'node:1'
+
+
+def test_collect_deletes(db, deleted):
+    people = [Person.objects.create(first_name='name %d' % i) for i in range(3)]
+    pks = [person.pk for person in people]
+    with collect_deletes(RecordingPersonSerializer):
+        Person.objects.filter(pk__in=pks[:2]).delete()
+        people[2].delete()
+    assert [sorted(ids) for ids in deleted] == [sorted(pks)]
+
+    # Signals after the block are not collected
+    Person.objects.create(first_name='other').delete()
+    assert len(deleted) == 1
+
+
+def test_collect_deletes_in_transaction(db, deleted):
+    person = Person.objects.create(first_name='Zofia')
+    pk = person.pk
+    with transaction.atomic():
+        with collect_deletes(RecordingPersonSerializer):
+            person.delete()
+        assert deleted == []
+    assert deleted == [[pk]]
+
+    # The deletes of a rolled back transaction are dropped
+    person = Person.objects.create(first_name='Zofia')
+    pk = person.pk
+    with pytest.raises(ValueError):
+        with transaction.atomic():
+            with collect_deletes(RecordingPersonSerializer):
+                person.delete()
+            raise ValueError
+    assert len(deleted) == 1
+    assert Person.objects.filter(pk=pk).exists()
+
+
+def test_collect_deletes_other_thread(db, deleted):
+    people = [Person.objects.create(first_name='name %d' % i) for i in range(2)]
+    pks = [person.pk for person in people]
+
+    def delete():
+        people[0].delete()
+        connection.close()
+
+    with collect_deletes(RecordingPersonSerializer):
+        # Deleted by another request, e.g. a thread of the server
+        thread = threading.Thread(target=delete)
+        thread.start()
+        thread.join()
+        people[1].delete()
+    assert not Person.objects.filter(pk__in=pks).exists()
+    assert deleted == [[pks[1]]]
+
+
+@pytest.mark.parametrize('wait_for_completion', [False, True])
+def test_delete_by_query(es_data_client, wait_for_completion):
+    search = DataDocType.search().filter('term', skills='sql')
+    expected = search.count()
+    total = DataDocType.search().count()
+
+    response = delete_by_query(search, refresh=True, poll_interval=0.1,
+                               wait_for_completion=wait_for_completion)
+    assert response['deleted'] == expected
+    assert response['failures'] == []
+    assert DataDocType.search().count() == total - expected
+
+
+def test_delete_by_query_task(es_data_client):
+    task_id = delete_by_query(DataDocType.search(), poll_interval=None)
+    assert wait_for_task(es_data_client, task_id, poll_interval=0.1)['deleted'] > 0
+
+
+def test_update_by_query():
+    client = ByQueryClient([{'completed': True, 'task': {}, 'response': {'updated': 3}}])
+    search = Search(using=client, index='test').filter('term', skills='sql')
+    response = update_by_query(search, 'ctx._source.score += params.value',
+                               params={'value': 1}, requests_per_second=100)
+    assert response == {'updated': 3}
+    assert client.requests == [{
+        'index': 'test',
+        'body': {
+            'query': {'bool': {'filter': [{'term': {'skills': 'sql'}}]}},
+            'script': {'source': 'ctx._source.score += params.value',
+                       'lang': 'painless', 'params': {'value': 1}},
+        },
+        'wait_for_completion': False,
+        'slices': 'auto',
+        'conflicts': 'proceed',
+        'requests_per_second': 100,
+    }]
+
+
+def test_update_by_query_states(db):
+    tracker = ElasticChangeTracker('test')
+    tracker.store({1: {'score': 'a'}})
+    client = ByQueryClient([{'completed': False, 'task': {'status': {}}},
+                            {'completed': True, 'task': {}, 'response': {}}])
+    stored = []
+    update_by_query(Search(using=client, index='test'), 'ctx._source.score += 1',
+                    poll_interval=0, callback=lambda status: stored.append(
+                        bool(tracker.load([1]))))
+    # The states are removed when the task is completed
+    assert stored == [True, True]
+    assert tracker.load([1]) == {}
+
+    tracker.store({1: {'score': 'a'}})
+    assert update_by_query(Search(using=client, index='test'), 'ctx._source.score += 1',
+                           poll_interval=None) == 'node:1'
+    assert tracker.load([1]) == {}
+
+
+def test_update_by_query_script(es_data_client):
+    search = DataDocType.search().filter('term', skills='sql')
+    expected = search.count()
+    response = update_by_query(search, 'ctx._source.score += params.value',
+                               params={'value': 1}, refresh=True, poll_interval=0.1)
+    assert response['updated'] == expected
+    assert DataDocType.get(id=1).score == 101
+
+
+def test_update_by_query_command(es_data_client):
+    del reconciled[:]
+    out = StringIO()
+    call_command('es_update_by_query', 'test', 'ctx._source.is_active = params.value',
+                 '--query', json.dumps({'term': {'first_name': 'Zofia'}}),
+                 '--params', json.dumps({'value': False}),
+                 '--slices', '2', '--poll-interval', '0.1',
+                 '--reconcile', 'tests.test_operations.reconcile',
+                 stdout=out)
+    assert '1 updated' in out.getvalue()
+    assert reconciled[0]['updated'] == 1
+    DataDocType._index.refresh()
+    assert DataDocType.get(id=1).is_active is False
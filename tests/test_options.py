@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import pytest
+
+from rest_framework_elasticsearch.es_options import set_options
+
+
+class Options(object):
+    size = 10
+
+    def __init__(self, **options):
+        set_options(self, options)
+
+
+def test_set_options():
+    assert Options().size == 10
+    assert Options(size=5).size == 5
+    # The class attribute is not changed
+    assert Options.size == 10
+
+
+def test_unexpected_option():
+    with pytest.raises(TypeError) as exc_info:
+        Options(limit=5)
+    assert str(exc_info.value) == "Options() got an unexpected keyword argument 'limit'"
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import pytest
+from django.core.management import call_command
+from django.db import transaction
+from django.utils import timezone
+from elasticsearch.helpers import BulkIndexError
+
+from rest_framework_elasticsearch.es_bulk import ElasticBulkIndexer
+from rest_framework_elasticsearch.es_indexing import (
+    ElasticSyncError, INDEX, DELETE, DEPENDENTS)
+from rest_framework_elasticsearch.es_outbox import (
+    ElasticOutboxDispatcher, ElasticOutboxWorker)
+from rest_framework_elasticsearch.models import ElasticOutbox
+from .models import Author, Person
+from .test_data import DataDocType
+from .utils import AuthorPersonSerializer, PersonSerializer
+
+
+class RecordingOutboxDispatcher(ElasticOutboxDispatcher):
+    """Outbox dispatcher which records flushed items instead of sending them"""
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingOutboxDispatcher, self).__init__(*args, **kwargs)
+        self.flushed = []
+        self.failed_pks = set()
+        self.exception = None
+
+    def flush_items(self, items, using='default'):
+        if self.exception is not None:
+            raise self.exception
+        failed = [key for key in items if key[1] in self.failed_pks]
+        if failed:
+            errors = [{'index': {'_id': str(pk), 'error': 'failed'}} for (_, pk) in failed]
+            raise ElasticSyncError('failed', errors, failed)
+        self.flushed.append(dict(items))
+
+
+recording_dispatcher = RecordingOutboxDispatcher()
+
+
+class DocumentIdPersonSerializer(PersonSerializer):
+    def get_es_instace_pk(self, instance):
+        return 'person-%s' % instance.pk
+
+
+@pytest.fixture
+def dispatcher(db):
+    recording_dispatcher.flushed = []
+    recording_dispatcher.failed_pks = set()
+    recording_dispatcher.exception = None
+    recording_dispatcher.register(Person, PersonSerializer)
+    yield recording_dispatcher
+    recording_dispatcher.unregister(Person)
+
+
+def get_outbox():
+    return list(ElasticOutbox.objects.values_list('model', 'object_pk', 'op'))
+
+
+def test_write_in_transaction(dispatcher):
+    with transaction.atomic():
+        person = Person.objects.create(first_name='Zofia')
+        person.save()
+        assert len(get_outbox()) == 2
+
+    assert get_outbox() == [
+        ('tests.Person', str(person.pk), INDEX),
+        ('tests.Person', str(person.pk), INDEX),
+    ]
+    # Nothing is sent in the request path
+    assert dispatcher.flushed == []
+
+
+def test_rollback(dispatcher):
+    with pytest.raises(ValueError):
+        with transaction.atomic():
+            Person.objects.create(first_name='Zofia')
+            raise ValueError()
+    assert get_outbox() == []
+
+
+def test_worker(dispatcher):
+    people = [Person.objects.create(first_name='name %d' % i) for i in range(5)]
+    deleted_pk = people[0].pk
+    people[0].delete()
+
+    worker = ElasticOutboxWorker(dispatcher, workers=2)
+    try:
+        assert worker.process_batch() == 6
+        assert worker.process_batch() == 0
+    finally:
+        worker.close()
+
+    flushed = {}
+    for items in dispatcher.flushed:
+        flushed.update(items)
+    # Operations are coalesced per document
+    assert flushed == dict(
+        [((Person, person.pk), INDEX) for person in people[1:]] +
+        [((Person, deleted_pk), DELETE)]
+    )
+    assert get_outbox() == []
+
+
+def test_worker_dependents(dispatcher):
+    author = Author.objects.create(name='Zofia')
+    ElasticOutbox.objects.bulk_create([
+        ElasticOutbox(model='tests.Author', object_pk=str(author.pk), op=op)
+        for op in (INDEX, DEPENDENTS)
+    ])
+    dispatcher.register(Author, PersonSerializer)
+    try:
+        ElasticOutboxWorker(dispatcher, workers=1).process_batch()
+    finally:
+        dispatcher.unregister(Author)
+    assert dispatcher.flushed == [{(Author, author.pk): INDEX}]
+
+
+def test_worker_retry(dispatcher):
+    people = [Person.objects.create(first_name='name %d' % i) for i in range(3)]
+    dispatcher.failed_pks = {people[1].pk}
+
+    worker = ElasticOutboxWorker(dispatcher, workers=1, backoff=10)
+    assert worker.process_batch() == 3
+
+    row = ElasticOutbox.objects.get()
+    assert row.object_pk == str(people[1].pk)
+    assert row.attempts == 1
+    assert row.last_error == 'failed'
+    assert row.available_at > timezone.now()
+    # Row is not available until the backoff delay
+    assert worker.process_batch() == 0
+
+
+def test_worker_exception(dispatcher):
+    Person.objects.create(first_name='Zofia')
+    dispatcher.exception = ValueError('unavailable')
+
+    worker = ElasticOutboxWorker(dispatcher, workers=1, max_attempts=1)
+    assert worker.process_batch() == 1
+    # The row is dropped after max_attempts
+    assert get_outbox() == []
+
+
+@pytest.fixture
+def rejected_index(monkeypatch):
+    def index(self, documents, *args, **kwargs):
+        errors = [{'index': {'_id': str(document.meta.id), 'error': 'rejected'}}
+                  for document in documents]
+        raise BulkIndexError('%i document(s) failed to index.' % len(errors), errors)
+
+    monkeypatch.setattr(ElasticBulkIndexer, 'index', index)
+
+
+def test_worker_index_failure(db, es_data_client, rejected_index):
+    dispatcher = ElasticOutboxDispatcher()
+    dispatcher.register(Person, PersonSerializer)
+    try:
+        removed = Person.objects.create(first_name='Eldon')
+        removed_pk = removed.pk
+        DataDocType(meta={'id': removed_pk}, first_name='Eldon').save(refresh=True)
+        ElasticOutbox.objects.all().delete()
+        removed.delete()
+        person = Person.objects.create(first_name='Zofia')
+
+        worker = ElasticOutboxWorker(dispatcher, workers=1)
+        assert worker.process_batch() == 2
+        # The delete is sent although the index of the batch failed
+        DataDocType._index.refresh()
+        assert DataDocType.get(id=removed_pk, ignore=404) is None
+        assert get_outbox() == [('tests.Person', str(person.pk), INDEX)]
+    finally:
+        dispatcher.unregister(Person)
+
+
+def test_worker_document_id(db, rejected_index):
+    dispatcher = ElasticOutboxDispatcher()
+    dispatcher.register(Person, DocumentIdPersonSerializer)
+    try:
+        person = Person.objects.create(first_name='Zofia')
+        assert ElasticOutboxWorker(dispatcher, workers=1).process_batch() == 1
+    finally:
+        dispatcher.unregister(Person)
+    # The failure of the document is matched to the row by the pk
+    row = ElasticOutbox.objects.get()
+    assert row.object_pk == str(person.pk)
+    assert row.attempts == 1
+    assert row.last_error == 'rejected'
+
+
+def test_worker_dependent_failure(db, rejected_index):
+    dispatcher = ElasticOutboxDispatcher()
+    dispatcher.register(Person, AuthorPersonSerializer)
+    try:
+        author = Author.objects.create(name='Zofia')
+        # The dependent document id differs from the row pk
+        Person.objects.create(pk=author.pk + 1, first_name='Eldon', author=author)
+        ElasticOutbox.objects.all().delete()
+        author.save()
+        assert get_outbox() == [('tests.Author', str(author.pk), DEPENDENTS)]
+        assert ElasticOutboxWorker(dispatcher, workers=1).process_batch() == 1
+    finally:
+        dispatcher.unregister(Person)
+    # The row of the author is retried with its dependent documents
+    row = ElasticOutbox.objects.get()
+    assert (row.model, row.object_pk) == ('tests.Author', str(author.pk))
+    assert row.attempts == 1
+
+
+def test_lease(dispatcher):
+    Person.objects.create(first_name='Zofia')
+    worker = ElasticOutboxWorker(dispatcher)
+    assert len(worker.claim()) == 1
+    assert worker.claim() == []
+
+
+def test_command(dispatcher):
+    Person.objects.create(first_name='Zofia')
+    call_command('es_outbox_worker', '--once',
+                 '--dispatcher', 'tests.test_outbox.recording_dispatcher')
+    assert get_outbox() == []
+    assert len(dispatcher.flushed) == 1
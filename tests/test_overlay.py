@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import pytest
+from django.core.cache import cache
+from rest_framework import serializers
+
+from rest_framework_elasticsearch.es_mixins import (
+    ListElasticMixin, ReadYourWritesElasticMixin)
+from rest_framework_elasticsearch.es_overlay import ElasticWriteOverlay
+from rest_framework_elasticsearch.es_serializer import ElasticSerializer
+from rest_framework_elasticsearch.es_views import ElasticAPIView
+from .test_data import DataDocType
+from .utils import rf
+
+
+class User(object):
+    is_authenticated = True
+
+    def __init__(self, pk):
+        self.pk = pk
+
+
+class Request(object):
+    def __init__(self, user=None):
+        self.user = user
+
+
+class MgetDocType(DataDocType):
+    """Document which returns the realtime versions from a dict"""
+    current = {}
+
+    options = {}
+
+    @classmethod
+    def mget(cls, docs, using=None, index=None, missing='raise', **kwargs):
+        cls.options = kwargs
+        return [cls.current.get(pk) for pk in docs]
+
+
+class PersonDocSerializer(ElasticSerializer):
+    id = serializers.IntegerField()
+    first_name = serializers.CharField()
+
+    class Meta:
+        es_model = DataDocType
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def test_get_key():
+    overlay = ElasticWriteOverlay()
+    assert overlay.get_key(Request(User(5))) == 'es_overlay:user:5'
+    assert overlay.get_key(Request()) is None
+
+
+def test_remember():
+    overlay = ElasticWriteOverlay()
+    request = Request(User(1))
+    overlay.remember(request, 'test', [1, 2])
+    overlay.remember(request, 'test', [3], deleted=True)
+    writes = overlay.get_writes(request)
+    assert sorted(writes['test']) == ['1', '2', '3']
+    assert writes['test']['3'][1] is True
+    # Writes of the other users are not visible
+    assert overlay.get_writes(Request(User(2))) == {}
+    # Anonymous writes without a session are not remembered
+    overlay.remember(Request(), 'test', [4])
+
+
+def test_remember_expired():
+    overlay = ElasticWriteOverlay(timeout=-1)
+    request = Request(User(1))
+    overlay.remember(request, 'test', [1])
+    assert overlay.get_writes(request) == {}
+
+
+def test_patch():
+    overlay = ElasticWriteOverlay()
+    request = Request(User(1))
+    hits = [MgetDocType(meta={'id': pk}, first_name='old %s' % pk) for pk in ('1', '2', '3')]
+    assert overlay.patch(request, hits, MgetDocType) == hits
+
+    overlay.remember(request, 'test', ['1'])
+    overlay.remember(request, 'test', ['3'], deleted=True)
+    MgetDocType.current = {'1': MgetDocType(meta={'id': '1'}, first_name='new 1')}
+    patched = overlay.patch(request, hits, MgetDocType)
+    assert [hit.first_name for hit in patched] == ['new 1', 'old 2']
+    assert MgetDocType.options == {}
+
+    overlay.patch(request, hits, MgetDocType, excludes=('description',))
+    assert MgetDocType.options == {'_source_excludes': ['description']}
+
+
+def test_save_wait_for(monkeypatch):
+    saved = []
+    monkeypatch.setattr(PersonDocSerializer, 'save',
+                        lambda self, **kwargs: saved.append(kwargs))
+    request = Request(User(1))
+    serializer = PersonDocSerializer(data={'id': 1, 'first_name': 'Zofia'})
+    serializer.is_valid(raise_exception=True)
+
+    ElasticWriteOverlay(wait_for=True).save(request, serializer)
+    assert saved[-1]['refresh'] == 'wait_for'
+    assert ElasticWriteOverlay().get_writes(request) == {}
+
+    ElasticWriteOverlay().save(request, serializer)
+    assert 'refresh' not in saved[-1]
+    assert list(ElasticWriteOverlay().get_writes(request)['test']) == ['1']
+
+
+def test_list_view(es_data_client):
+    overlay = ElasticWriteOverlay()
+
+    class View(ReadYourWritesElasticMixin, ListElasticMixin, ElasticAPIView):
+        es_client = es_data_client
+        es_model = DataDocType
+        es_overlay = overlay
+        es_excludes_fields = ('id',)
+
+    request = rf.get('/test/')
+    request.query_params = {}
+    request.user = User(1)
+    serializer = PersonDocSerializer(data={'id': 1, 'first_name': 'Eldon'})
+    serializer.is_valid(raise_exception=True)
+    DataDocType._index.put_settings(body={'index': {'refresh_interval': '-1'}})
+    try:
+        overlay.save(request, serializer, using=es_data_client)
+        view = View()
+        view.request = request
+        response = view.list(request)
+        names = dict((item.get('first_name'), item) for item in response.data)
+        assert 'Eldon' in names
+        assert 'Zofia' not in names
+        # The realtime version is filtered like the hits
+        assert 'id' not in names['Eldon']
+    finally:
+        DataDocType._index.put_settings(body={'index': {'refresh_interval': None}})
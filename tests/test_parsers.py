@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import io
+import types
+
+from rest_framework_elasticsearch.es_parsers import NDJSONParser
+
+
+def test_parse():
+    stream = io.BytesIO(
+        b'{"id": 1, "first_name": "Zofia"}\n'
+        b'\n'
+        b'{"id": 2, "first_name": "Fran\xc3\xa7ois"}\n'
+        b'{"id": 3\n'
+        b'[1, 2]\n'
+        b'{"id": 4}'
+    )
+    result = NDJSONParser().parse(stream)
+    assert isinstance(result, types.GeneratorType)
+    result = list(result)
+    assert result[:2] == [
+        (1, {'id': 1, 'first_name': 'Zofia'}, None),
+        (3, {'id': 2, 'first_name': 'Fran\xe7ois'}, None),
+    ]
+    assert result[2][:2] == (4, None)
+    assert result[2][2].startswith('JSON parse error')
+    assert result[3] == (5, None, 'Expected a JSON object')
+    assert result[4] == (6, {'id': 4}, None)
+
+
+def test_parse_lazily():
+    lines = iter([b'{"id": 1}\n', b'{"id": 2}\n'])
+    result = NDJSONParser().parse(lines)
+    assert next(result) == (1, {'id': 1}, None)
+    assert next(lines) == b'{"id": 2}\n'
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import pytest
+from rest_framework.pagination import (
+    LimitOffsetPagination, PageNumberPagination)
+from rest_framework.test import APIRequestFactory
+
+from rest_framework_elasticsearch.es_pagination import get_page_window
+from rest_framework_elasticsearch.es_queryset import ElasticQuerySet
+from .test_data import DATA
+
+
+rf = APIRequestFactory()
+
+
+def create_queryset(search, **kwargs):
+    """Create and return the ElasticQuerySet with the stable ordering"""
+    return ElasticQuerySet(search.sort('first_name'), **kwargs)
+
+
+def test_count(search):
+    queryset = create_queryset(search)
+    assert queryset.count() == len(DATA)
+    assert len(queryset) == len(DATA)
+
+
+def test_count_with_prefetch(search):
+    queryset = create_queryset(search).prefetch(0, 5)
+    assert queryset.count() == len(DATA)
+    assert list(queryset._windows) == [(0, 5)]
+
+
+@pytest.mark.parametrize('start, stop, expected', [
+    (0, 5, 5),
+    (5, 10, 5),
+    (10, 20, 4),
+    (50, 60, 0),
+    (5, 5, 0),
+])
+def test_slicing(search, start, stop, expected):
+    queryset = create_queryset(search)
+    result = queryset[start:stop]
+    assert len(result) == expected
+    assert result == [item.to_dict() for item in search.sort('first_name')[start:stop]]
+
+
+def test_slicing_memoization(search):
+    queryset = create_queryset(search)
+    page = queryset[0:10]
+    assert queryset[2:5] == page[2:5]
+    assert queryset[3] == page[3]
+    assert list(queryset._windows) == [(0, 10)]
+    # total is taken from the executed search
+    assert queryset._count == len(DATA)
+
+
+def test_negative_slicing(search):
+    queryset = create_queryset(search)
+    with pytest.raises(ValueError):
+        queryset[-1:]
+    with pytest.raises(ValueError):
+        queryset[-1]
+
+
+def test_index_error(search):
+    queryset = create_queryset(search)
+    with pytest.raises(IndexError):
+        queryset[len(DATA)]
+
+
+def test_iteration_in_batches(search):
+    queryset = create_queryset(search, batch_size=4)
+    result = list(queryset)
+    assert len(result) == len(DATA)
+    assert sorted(queryset._windows) == [(0, 4), (4, 8), (8, 12), (12, 16)]
+
+
+def test_iterator(search):
+    queryset = create_queryset(search, batch_size=4)
+    result = list(queryset.iterator())
+    assert len(result) == len(DATA)
+    assert queryset._windows == {}
+
+
+def test_representation(search):
+    queryset = create_queryset(
+        search, representation=lambda hits: [hit.meta.id for hit in hits])
+    assert queryset[0:3] == [hit.meta.id for hit in search.sort('first_name')[0:3]]
+
+
+@pytest.mark.parametrize('paginator, query_params, expected', [
+    (LimitOffsetPagination(), {'limit': 5, 'offset': 10}, (10, 15)),
+    (LimitOffsetPagination(), {}, None),
+    (PageNumberPagination(), {'page': 3}, (20, 30)),
+    (PageNumberPagination(), {'page': 'last'}, None),
+    (None, {}, None),
+])
+def test_get_page_window(paginator, query_params, expected):
+    if isinstance(paginator, PageNumberPagination):
+        paginator.page_size = 10
+    request = rf.get('/test/')
+    request.query_params = query_params
+    assert get_page_window(paginator, request) == expected
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import re
+
+import pytest
+from django.core.management import call_command
+
+from rest_framework_elasticsearch.es_reindex import (
+    ElasticAliasReindexer, ElasticReindexer, ReindexProgress)
+from .models import Person
+from .test_data import DataDocType
+from .utils import PersonSerializer
+
+
+class AliasDocType(DataDocType):
+
+    class Index:
+        name = 'test-alias'
+        settings = {'number_of_shards': 1}
+
+
+class AliasPersonSerializer(PersonSerializer):
+
+    class Meta(PersonSerializer.Meta):
+        es_model = AliasDocType
+
+
+@pytest.fixture
+def people(db):
+    return [Person.objects.create(first_name='name %d' % i, score=i)
+            for i in range(25)]
+
+
+@pytest.fixture
+def state_file(tmpdir):
+    return str(tmpdir.join('reindex.json'))
+
+
+def test_get_ranges(people):
+    reindexer = ElasticReindexer(PersonSerializer, range_size=10)
+    first = people[0].pk - people[0].pk % 10
+    ranges = reindexer.get_ranges()
+    assert ranges[0] == (first, first + 10)
+    assert ranges[-1][0] <= people[-1].pk < ranges[-1][1]
+    assert sum(Person.objects.filter(pk__gte=start, pk__lt=stop).count()
+               for start, stop in ranges) == len(people)
+
+
+def test_get_ranges_empty(db):
+    assert ElasticReindexer(PersonSerializer).get_ranges() == []
+
+
+def test_state(state_file):
+    reindexer = ElasticReindexer(PersonSerializer, state_file=state_file)
+    assert reindexer.load_state() == []
+    reindexer.save_state({(10, 20), (0, 10)})
+    assert reindexer.load_state() == [(0, 10), (10, 20)]
+    reindexer.clear_state()
+    assert not os.path.exists(state_file)
+
+
+def test_progress():
+    progress = ReindexProgress(100, done=10)
+    progress.add(20, 5)
+    assert progress.done == 35
+    assert progress.errors == 5
+    assert '35/100 documents, 5 errors' in str(progress)
+
+
+def test_run(people, es_data_client, state_file):
+    reindexer = ElasticReindexer(PersonSerializer, state_file=state_file,
+                                 range_size=10, processes=2)
+    progress = reindexer.run()
+    assert progress.done == len(people)
+    assert progress.errors == 0
+    assert sorted(reindexer.load_state()) == sorted(reindexer.get_ranges())
+
+    DataDocType._index.refresh()
+    assert DataDocType.get(id=people[3].pk).to_dict() == {
+        'first_name': 'name 3', 'last_name': '', 'score': 3}
+
+
+def test_run_resume(people, es_data_client, state_file):
+    reindexer = ElasticReindexer(PersonSerializer, state_file=state_file,
+                                 range_size=10, processes=1)
+    ranges = reindexer.get_ranges()
+    reindexer.save_state(ranges[:-1])
+
+    progress = reindexer.run(resume=True)
+    done = Person.objects.filter(pk__gte=ranges[-1][0]).count()
+    assert progress.done == len(people)
+    assert progress.done - progress.initial == done
+
+
+def test_command(people, es_data_client, state_file):
+    call_command('rebuild_es_index', 'tests.utils.PersonSerializer',
+                 '--range-size', '10', '--processes', '1',
+                 '--state-file', state_file)
+    assert os.path.exists(state_file)
+    DataDocType._index.refresh()
+    assert DataDocType.get(id=people[0].pk).first_name == 'name 0'
+
+
+def test_alias_index_name():
+    reindexer = ElasticAliasReindexer(AliasPersonSerializer)
+    assert reindexer.get_alias() == 'test-alias'
+    assert re.match(r'^test-alias-\d{20}$', reindexer.get_index_name('test-alias'))
+    assert ElasticAliasReindexer(AliasPersonSerializer, alias='people').get_alias() == 'people'
+
+
+def test_alias_load_settings():
+    reindexer = ElasticAliasReindexer(AliasPersonSerializer)
+    index = reindexer.get_index('test-alias-1')
+    index.settings(**reindexer.load_settings)
+    assert index.to_dict()['settings'] == {
+        'number_of_shards': 1, 'number_of_replicas': 0, 'refresh_interval': '-1'}
+    assert AliasDocType._index.to_dict()['settings'] == {'number_of_shards': 1}
+
+
+@pytest.fixture
+def es_alias_client(es_client):
+    yield es_client
+    es_client.indices.delete(index='test-alias*', ignore=404)
+
+
+def test_alias_run(people, es_alias_client, state_file):
+    reindexer = ElasticAliasReindexer(AliasPersonSerializer, state_file=state_file,
+                                      range_size=10, processes=1)
+    progress = reindexer.run()
+    assert progress.done == len(people)
+    assert not os.path.exists(state_file)
+
+    indices = es_alias_client.indices.get_alias(name='test-alias')
+    assert list(indices) == [reindexer.index]
+    settings = es_alias_client.indices.get_settings(index=reindexer.index)
+    assert 'refresh_interval' not in settings[reindexer.index]['settings']['index']
+    assert settings[reindexer.index]['settings']['index']['number_of_replicas'] == '1'
+    assert AliasDocType.search().count() == len(people)
+
+
+def test_alias_prune(people, es_alias_client):
+    names = []
+    for _ in range(3):
+        reindexer = ElasticAliasReindexer(AliasPersonSerializer, processes=1, keep=1)
+        reindexer.run()
+        names.append(reindexer.index)
+
+    assert reindexer.get_versioned_indices('test-alias') == names[1:]
+    assert reindexer.get_alias_indices('test-alias') == names[2:]
+
+
+def test_alias_replace_index(people, es_alias_client):
+    es_alias_client.indices.create(index='test-alias')
+    reindexer = ElasticAliasReindexer(AliasPersonSerializer, processes=1)
+    with pytest.raises(ValueError):
+        reindexer.run()
+
+    reindexer.replace_index = True
+    reindexer.run()
+    assert reindexer.get_alias_indices('test-alias') == [reindexer.index]
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime
+import json
+from collections import OrderedDict
+
+import pytest
+
+from rest_framework_elasticsearch.es_renderers import (
+    to_columnar, ColumnarJSONRenderer, MessagePackRenderer, CBORRenderer)
+from rest_framework_elasticsearch.es_views import ListElasticAPIView
+
+
+HITS = [
+    {'first_name': 'Zofia', 'score': 100},
+    {'first_name': 'Callisto', 'city': 'San Jose'},
+    {'score': 300, 'first_name': 'Eldon'},
+]
+
+
+def test_to_columnar():
+    assert to_columnar(HITS) == {
+        'fields': ['first_name', 'score', 'city'],
+        'columns': [
+            ['Zofia', 'Callisto', 'Eldon'],
+            [100, None, 300],
+            [None, 'San Jose', None],
+        ]
+    }
+
+
+def test_to_columnar_empty():
+    assert to_columnar([]) == {'fields': [], 'columns': []}
+
+
+def test_columnar_renderer_list():
+    result = json.loads(ColumnarJSONRenderer().render(HITS).decode('utf-8'))
+    assert result == to_columnar(HITS)
+
+
+def test_columnar_renderer_paginated():
+    data = OrderedDict([
+        ('count', 3),
+        ('next', None),
+        ('previous', None),
+        ('results', HITS)
+    ])
+    result = json.loads(ColumnarJSONRenderer().render(data).decode('utf-8'))
+    assert result['count'] == 3
+    assert result['results'] == to_columnar(HITS)
+    # The original envelope is not modified
+    assert data['results'] is HITS
+
+
+def test_columnar_renderer_error():
+    data = {'detail': 'Not found.'}
+    result = json.loads(ColumnarJSONRenderer().render(data).decode('utf-8'))
+    assert result == data
+
+
+def test_msgpack_renderer():
+    msgpack = pytest.importorskip('msgpack')
+    data = [{'first_name': 'Zofia',
+             'birthday': datetime.datetime(1985, 3, 17, 12, 20, 9)}]
+    result = msgpack.unpackb(MessagePackRenderer().render(data), raw=False)
+    assert result == [{'first_name': 'Zofia',
+                       'birthday': '1985-03-17T12:20:09'}]
+
+
+def test_cbor_renderer():
+    cbor2 = pytest.importorskip('cbor2')
+    data = {'count': 1, 'results': [{'first_name': 'Zofia', 'score': 1.5}]}
+    assert cbor2.loads(CBORRenderer().render(data)) == data
+
+
+def test_list_view_renderers():
+    assert ColumnarJSONRenderer in ListElasticAPIView.renderer_classes
@@ -2,12 +2,16 @@
 from __future__ import unicode_literals
 
 import copy
+import datetime
 
 import pytest
 from django.db import models
+from django.utils import timezone
+from rest_framework import serializers
 
 from rest_framework_elasticsearch.es_serializer import (
-    BaseElasticSerializer, ElasticSerializer, ElasticModelSerializer)
+    BaseElasticSerializer, ElasticSerializer, ElasticModelSerializer,
+    ElasticHitSerializer, ElasticListSerializer, get_version_number)
 from .test_data import DataDocType, DATA
 
 
@@ -82,6 +86,56 @@ class TestElasticSerializer:
         assert model.to_dict() == data
 
 
+class TestElasticListSerializer:
+
+    def create_serializer(self, *args, **kwargs):
+        class Serializer(ElasticSerializer):
+            id = serializers.IntegerField()
+            first_name = serializers.CharField()
+
+            class Meta:
+                es_model = DataDocType
+                es_bulk_options = {'chunk_size': 2}
+
+        return Serializer(*args, **kwargs)
+
+    def test_many_init(self):
+        serializer = self.create_serializer(data=[], many=True)
+        assert isinstance(serializer, ElasticListSerializer)
+        assert serializer.get_bulk_indexer().chunk_size == 2
+        assert serializer.get_bulk_indexer(chunk_size=10).chunk_size == 10
+
+    def test_pop_bulk_options(self):
+        serializer = self.create_serializer(data=[], many=True)
+        kwargs = {'chunk_size': 10, 'refresh': True}
+        assert serializer.pop_bulk_options(kwargs) == {'chunk_size': 10}
+        assert kwargs == {'refresh': True}
+
+    def test_es_instances(self):
+        data = [{'id': 1, 'first_name': 'Zofia'}, {'id': 2, 'first_name': 'Eldon'}]
+        serializer = self.create_serializer(data=data, many=True)
+        result = list(serializer.es_instances())
+        assert [item.meta.id for item in result] == [1, 2]
+        assert [item.first_name for item in result] == ['Zofia', 'Eldon']
+
+    def test_es_instances_invalid(self):
+        serializer = self.create_serializer(data=[{'id': 'x'}], many=True)
+        with pytest.raises(serializers.ValidationError):
+            list(serializer.es_instances())
+
+    def test_save_and_delete(self, es_client):
+        data = [{'id': pk, 'first_name': 'name %d' % pk} for pk in range(100, 105)]
+        serializer = self.create_serializer(data=data, many=True)
+
+        result = serializer.save(refresh=True)
+        assert result.success == 5
+        assert DataDocType.get(id=103).first_name == 'name 103'
+
+        result = serializer.delete(refresh=True)
+        assert result.success == 5
+        assert DataDocType.get(id=103, ignore=404) is None
+
+
 class TestElasticModelSerializer:
 
     def setup_method(self):
@@ -104,3 +158,170 @@ class TestElasticModelSerializer:
 
         model = self.serializer.es_repr(instance)
         assert model.to_dict() == {'first_name': 'test'}
+
+    def test_many_es_instances(self):
+        class Serializer(ElasticModelSerializer):
+            class Meta:
+                model = DjangoModel
+                es_model = DataDocType
+                fields = ['first_name']
+
+        instances = [DjangoModel(pk=pk, first_name='test') for pk in (1, 2)]
+        serializer = Serializer(instances, many=True)
+        assert isinstance(serializer, ElasticListSerializer)
+
+        result = list(serializer.es_instances())
+        assert [item.meta.id for item in result] == [1, 2]
+        assert [item.first_name for item in result] == ['test', 'test']
+
+
+@pytest.mark.parametrize('value,expected', [
+    (5, 5),
+    ('7', 7),
+    (datetime.datetime(1970, 1, 1, 0, 0, 1, 5), 1000005),
+    (datetime.datetime(1970, 1, 1, 1, 0, 1, tzinfo=timezone.get_fixed_timezone(60)),
+     1000000),
+    ('1970-01-01T00:00:02.000003Z', 2000003),
+    (datetime.date(1970, 1, 2), 86400000000),
+])
+def test_get_version_number(value, expected):
+    assert get_version_number(value) == expected
+
+
+class TestVersioning:
+
+    def create_serializer(self, *args, **kwargs):
+        class Serializer(ElasticSerializer):
+            id = serializers.IntegerField()
+            first_name = serializers.CharField()
+            version = serializers.IntegerField()
+
+            class Meta:
+                es_model = DataDocType
+                es_version_field = 'version'
+
+        return Serializer(*args, **kwargs)
+
+    def test_es_repr(self):
+        serializer = self.create_serializer()
+        document = serializer.es_repr({'id': 1, 'first_name': 'Zofia', 'version': 3})
+        assert document.meta.to_dict() == {
+            'id': 1, 'version': 3, 'version_type': 'external'}
+
+        serializer.Meta.es_version_type = 'external_gte'
+        document = serializer.es_repr({'id': 1, 'first_name': 'Zofia', 'version': 3})
+        assert document.meta.version_type == 'external_gte'
+
+        document = serializer.es_repr({'id': 1, 'first_name': 'Zofia', 'version': None})
+        assert document.meta.to_dict() == {'id': 1}
+
+    def test_model_es_repr(self):
+        class Serializer(ElasticModelSerializer):
+            class Meta:
+                model = DjangoModel
+                es_model = DataDocType
+                fields = ['first_name']
+                es_version_field = 'pk'
+
+        document = Serializer().es_repr(DjangoModel(pk=4, first_name='test'))
+        assert document.meta.version == 4
+        assert document.to_dict() == {'first_name': 'test'}
+
+    def test_bulk_indexer(self):
+        serializer = self.create_serializer(data=[], many=True)
+        assert serializer.get_bulk_indexer().skip_conflicts is True
+        assert serializer.get_bulk_indexer(skip_conflicts=False).skip_conflicts is False
+
+    def test_save(self, es_client):
+        data = [{'id': pk, 'first_name': 'name %d' % pk, 'version': 10}
+                for pk in range(100, 103)]
+        serializer = self.create_serializer(data=data, many=True)
+        assert serializer.save(refresh=True).success == 3
+
+        # Stale versions are skipped
+        data = [{'id': 100, 'first_name': 'stale', 'version': 9},
+                {'id': 101, 'first_name': 'newer', 'version': 11}]
+        result = self.create_serializer(data=data, many=True).save(refresh=True)
+        assert result.success == 2
+        assert result.conflicts == ['100']
+        assert DataDocType.get(id=100).first_name == 'name 100'
+        assert DataDocType.get(id=101).first_name == 'newer'
+        assert DataDocType.get(id=101).meta.version == 11
+
+        serializer = self.create_serializer(
+            data={'id': 102, 'first_name': 'stale', 'version': 10})
+        serializer.save(refresh=True)
+        assert DataDocType.get(id=102).first_name == 'name 102'
+
+        assert serializer.delete(refresh=True) is None
+        assert DataDocType.get(id=102, ignore=404) is None
+
+
+HIT_FIELDS = dict(
+    name=serializers.CharField(source='first_name'),
+    last_name=serializers.CharField(),
+    score=serializers.IntegerField(),
+    rating=serializers.FloatField(source='score'),
+    is_active=serializers.BooleanField(),
+    birthday=serializers.DateTimeField(format='%Y-%m-%d'),
+    city=serializers.ReadOnlyField(),
+    country=serializers.CharField(default='Unknown'),
+    lat=serializers.FloatField(source='location.lat'),
+    skills=serializers.ListField(child=serializers.CharField()),
+    full_name=serializers.SerializerMethodField(),
+    description=serializers.CharField(write_only=True),
+)
+
+
+def get_full_name(self, obj):
+    return '%s %s' % (obj['first_name'], obj['last_name'])
+
+
+HitSerializer = type(str('HitSerializer'), (ElasticHitSerializer,),
+                     dict(copy.deepcopy(HIT_FIELDS), get_full_name=get_full_name))
+DRFHitSerializer = type(str('DRFHitSerializer'), (serializers.Serializer,),
+                        dict(copy.deepcopy(HIT_FIELDS), get_full_name=get_full_name))
+
+
+class TestElasticHitSerializer:
+
+    def get_hits(self):
+        hits = []
+        for item in DATA:
+            hit = copy.deepcopy(item['_source'])
+            hit['birthday'] = datetime.datetime.strptime(
+                hit['birthday'], '%Y-%m-%dT%H:%M:%S')
+            hits.append(hit)
+        # Missing values
+        del hits[0]['city']
+        hits[1]['city'] = None
+        hits[2]['country'] = 'Poland'
+        return hits
+
+    def test_compile_fields(self):
+        compiled = dict((name, (key, converter))
+                        for name, key, converter in HitSerializer().get_compiled_fields())
+        assert compiled['name'] == ('first_name', type(''))
+        assert compiled['score'] == ('score', int)
+        assert compiled['rating'] == ('score', float)
+        assert compiled['city'] == ('city', None)
+        assert compiled['lat'][0] is None
+        assert compiled['full_name'][0] is None
+        assert 'description' not in compiled
+        # The field list is compiled once per class
+        assert HitSerializer().get_compiled_fields() is HitSerializer._compiled_fields
+
+    def test_to_representation(self):
+        hits = self.get_hits()
+        expected = DRFHitSerializer(hits, many=True).data
+        assert HitSerializer(hits, many=True).data == expected
+        assert expected[0]['name'] == 'Zofia'
+        assert expected[0]['birthday'] == '1985-03-17'
+        assert 'city' not in expected[0]
+        assert expected[1]['city'] is None
+        assert expected[0]['country'] == 'Unknown'
+        assert expected[2]['country'] == 'Poland'
+
+    def test_to_representation_object(self):
+        instance = DataDocType(**DATA[0]['_source'])
+        assert HitSerializer(instance).data == DRFHitSerializer(instance).data
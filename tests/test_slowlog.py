@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+
+import pytest
+from django.core.cache import cache
+from django.core.management import call_command
+from elasticsearch_dsl import Search
+
+from rest_framework_elasticsearch.es_slowlog import (
+    ElasticSlowQueryLog, get_fingerprint, normalize_query, slow_query_log)
+from rest_framework_elasticsearch.es_timing import RequestTimer, TimedSearch
+from .test_data import DataDocType
+from .utils import StubElasticsearch
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def test_normalize_query():
+    body = Search().filter('terms', skills=['python', 'sql']) \
+        .filter('range', score={'gte': 10}).sort('-score').source(['first_name'])[:10].to_dict()
+    assert normalize_query(body) == {
+        'query': {'bool': {'filter': [
+            {'terms': {'skills': ['?']}},
+            {'range': {'score': {'gte': '?'}}},
+        ]}},
+        'sort': [{'score': {'order': 'desc'}}],
+        '_source': ['first_name'],
+        'from': '?',
+        'size': '?',
+    }
+
+
+def test_fingerprint():
+    first, _ = get_fingerprint(Search().filter('terms', skills=['python']).to_dict())
+    second, _ = get_fingerprint(Search().filter('terms', skills=['sql', 'js']).to_dict())
+    other, _ = get_fingerprint(Search().filter('terms', city=['Warsaw']).to_dict())
+    assert first == second
+    assert first != other
+
+
+def test_slow_query(caplog):
+    log = ElasticSlowQueryLog(threshold=0, top_size=1)
+    log.connect()
+    try:
+        with caplog.at_level(logging.WARNING, logger='rest_framework_elasticsearch.es_slowlog'):
+            timer = RequestTimer('BlogView', {'skills': 'python', 'search': 'x'})
+            search = TimedSearch(using=StubElasticsearch(), index='test', doc_type=DataDocType)
+            search.timer(timer).filter('term', skills='python').execute()
+            search.timer(timer).filter('term', skills='sql').execute()
+            search.filter('term', city='Warsaw').execute()
+    finally:
+        log.disconnect()
+
+    assert len(caplog.records) == 3
+    record = caplog.records[0]
+    assert record.es_slow_query['view'] == 'BlogView'
+    assert record.es_slow_query['took'] == 3
+    assert record.es_slow_query['hits'] == 1
+    assert record.es_slow_query['params'] == {'skills': 'python', 'search': 'x'}
+    assert 'python' not in str(record.es_slow_query['query'])
+
+    # Only the slowest fingerprint is kept
+    top = log.get_top()
+    assert len(top) == 1
+
+
+def test_record_and_command(capsys):
+    slow_query_log.record('a', {'query': '?'}, 'search', 100, 'BlogView', {'skills': 'x'})
+    slow_query_log.record('a', {'query': '?'}, 'search', 300, 'BlogView', {'skills': 'y'})
+    slow_query_log.record('b', {'size': '?'}, 'count', 200)
+    top = slow_query_log.get_top()
+    assert [entry['fingerprint'] for entry in top] == ['a', 'b']
+    assert top[0]['count'] == 2
+    assert top[0]['total'] == 400
+    assert top[0]['params'] == [['skills']]
+    assert [entry['fingerprint'] for entry in slow_query_log.get_top('total', 1)] == ['a']
+
+    call_command('es_slow_queries', '--sort', 'count')
+    out = capsys.readouterr().out
+    assert 'a search count=2 max=300.0ms avg=200.0ms views=BlogView' in out
+    assert 'params: skills' in out
+
+    call_command('es_slow_queries', '--clear')
+    assert slow_query_log.get_top() == []
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime
+
+import pytest
+from django.core.management import call_command
+from django.utils import timezone
+
+from rest_framework_elasticsearch.es_serializer import ElasticListSerializer
+from rest_framework_elasticsearch.es_sync import ElasticWatermarkSync
+from .models import Person
+from .test_data import DataDocType
+from .utils import PersonSerializer
+
+
+class RecordingListSerializer(ElasticListSerializer):
+    """List serializer which records saved pks instead of sending them"""
+    saved = []
+
+    def save(self, using=None, index=None, **kwargs):
+        self.saved.append([instance.pk for instance in self.instance])
+
+
+class RecordingPersonSerializer(PersonSerializer):
+    class Meta(PersonSerializer.Meta):
+        list_serializer_class = RecordingListSerializer
+
+
+@pytest.fixture
+def saved():
+    RecordingListSerializer.saved = []
+    return RecordingListSerializer.saved
+
+
+@pytest.fixture
+def people(db):
+    people = [Person.objects.create(first_name='name %d' % i) for i in range(5)]
+    # Objects changed at the same time are ordered by pk
+    updated_at = timezone.now() - datetime.timedelta(minutes=5)
+    Person.objects.update(updated_at=updated_at)
+    return [person.pk for person in people]
+
+
+def test_name():
+    sync = ElasticWatermarkSync(PersonSerializer)
+    assert sync.name == 'tests.utils.PersonSerializer:updated_at'
+
+
+def test_run(people, saved):
+    sync = ElasticWatermarkSync(RecordingPersonSerializer, chunk_size=2)
+    assert sync.get_watermark() == (None, None)
+    assert sync.run() == 5
+    assert saved == [people[:2], people[2:4], people[4:]]
+    assert sync.get_watermark() == (Person.objects.get(pk=people[4]).updated_at, people[4])
+
+    # Nothing changed
+    assert sync.run() == 0
+
+    person = Person.objects.get(pk=people[1])
+    person.save()
+    # The latest changes are synced after the lag
+    assert sync.run() == 0
+    Person.objects.filter(pk=person.pk).update(
+        updated_at=timezone.now() - datetime.timedelta(seconds=sync.lag))
+    assert sync.run() == 1
+    assert saved[-1] == [people[1]]
+
+    sync.reset()
+    assert sync.run() == 5
+
+
+def test_resume(people, saved):
+    sync = ElasticWatermarkSync(RecordingPersonSerializer, chunk_size=3)
+    assert sync.sync_chunk() == 3
+
+    sync = ElasticWatermarkSync(RecordingPersonSerializer, chunk_size=3)
+    assert sync.sync_chunk() == 2
+    assert saved == [people[:3], people[3:]]
+
+
+def test_lag(people, saved):
+    Person.objects.filter(pk=people[4]).update(updated_at=timezone.now())
+    sync = ElasticWatermarkSync(RecordingPersonSerializer, lag=60)
+    assert sync.run() == 4
+    assert saved == [people[:4]]
+
+
+def test_late_commit(people, saved, monkeypatch):
+    now = timezone.now()
+    early = Person.objects.create(first_name='early')
+    Person.objects.filter(pk=early.pk).update(updated_at=now - datetime.timedelta(seconds=1))
+    sync = ElasticWatermarkSync(RecordingPersonSerializer)
+    assert sync.run() == 5
+
+    # The row of a transaction which started before the previous run
+    # is committed with an older timestamp than the synced rows
+    late = Person.objects.create(first_name='late')
+    Person.objects.filter(pk=late.pk).update(updated_at=now - datetime.timedelta(seconds=2))
+    monkeypatch.setattr(timezone, 'now', lambda: now + datetime.timedelta(seconds=sync.lag))
+    assert sync.run() == 2
+    assert saved[-1] == [late.pk, early.pk]
+
+
+def test_command(people, saved):
+    call_command('sync_es_index', 'tests.test_sync.RecordingPersonSerializer',
+                 '--chunk-size', '10')
+    assert saved == [people]
+    call_command('sync_es_index', 'tests.test_sync.RecordingPersonSerializer')
+    assert len(saved) == 1
+    call_command('sync_es_index', 'tests.test_sync.RecordingPersonSerializer', '--reset')
+    assert len(saved) == 2
+
+
+def test_sync_index(people, es_data_client):
+    ElasticWatermarkSync(PersonSerializer).run()
+    DataDocType._index.refresh()
+    assert DataDocType.get(id=people[0]).first_name == 'name 0'
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+
+import pytest
+from rest_framework.test import force_authenticate
+
+from rest_framework_elasticsearch.es_signals import (
+    es_query_executed, es_request_timed)
+from rest_framework_elasticsearch.es_timing import RequestTimer, TimedSearch
+from rest_framework_elasticsearch.es_views import ListElasticAPIView
+from .test_data import DataDocType
+from .utils import StubElasticsearch, rf
+
+
+@pytest.fixture
+def executed():
+    calls = []
+
+    def receiver(sender, **kwargs):
+        calls.append(kwargs)
+
+    es_query_executed.connect(receiver, weak=False, dispatch_uid='test_timing')
+    yield calls
+    es_query_executed.disconnect(dispatch_uid='test_timing')
+
+
+def test_timer():
+    timer = RequestTimer()
+    timer.add('es', 10.0, method='search', took=4)
+    timer.add('es', 5.0, method='count', took=None)
+    with timer.phase('render'):
+        pass
+    assert list(timer.get_totals()) == ['es', 'es-took', 'render']
+    assert timer.get_totals()['es'] == 15.0
+    assert timer.to_header().startswith('es;dur=15.0, es-took;dur=4.0, render;dur=')
+    assert 'total;dur=' in timer.to_header()
+    assert [phase['name'] for phase in timer.to_dict()['phases']] == ['es', 'es', 'render']
+
+
+def test_timed_search(executed):
+    timer = RequestTimer()
+    search = TimedSearch(using=StubElasticsearch(), index='test', doc_type=DataDocType)
+    search = search.timer(timer).filter('term', first_name='Zofia')
+    response = search.execute()
+    assert response.hits[0].first_name == 'Zofia'
+    # Cached response is not measured again
+    search.execute()
+    assert search.count() == 1
+    assert search._clone().count() == 1
+
+    assert [phase['name'] for phase in timer.phases] == ['es', 'hydrate', 'es']
+    assert timer.phases[0]['took'] == 3
+    assert [call['method'] for call in executed] == ['search', 'count']
+
+
+def test_timed_search_without_timer(executed):
+    search = TimedSearch(using=StubElasticsearch(), index='test')
+    search.execute()
+    assert executed[0]['took'] == 3
+
+
+def test_server_timing_header():
+    timings = []
+
+    def receiver(sender, **kwargs):
+        timings.append(kwargs['timings'])
+
+    class View(ListElasticAPIView):
+        es_client = StubElasticsearch()
+        es_model = DataDocType
+        es_server_timing = True
+
+    es_request_timed.connect(receiver, sender=View, weak=False)
+    try:
+        response = View.as_view()(rf.get('/test/'))
+        # The timings are sent when the handler renders the response
+        assert timings == []
+        response.data = {'changed': True}
+        response.render()
+    finally:
+        es_request_timed.disconnect(receiver, sender=View)
+
+    assert response.status_code == 200
+    assert json.loads(response.content.decode('utf-8')) == {'changed': True}
+    header = response['Server-Timing']
+    for name in ('filter', 'es', 'es-took', 'hydrate', 'representation', 'render', 'total'):
+        assert '%s;dur=' % name in header
+    names = [phase['name'] for phase in timings[0]['phases']]
+    assert names[0] == 'filter'
+    assert names[-1] == 'render'
+    assert len(timings) == 1
+
+    # The header is opt-in
+    response = ListElasticAPIView.as_view(es_client=StubElasticsearch(),
+                                          es_model=DataDocType)(rf.get('/test/'))
+    response.render()
+    assert not response.has_header('Server-Timing')
+
+
+class ProfileElasticsearch(StubElasticsearch):
+    """Client which returns the profile of the profiled searches"""
+    bodies = []
+
+    def search(self, index=None, doc_type=None, body=None, **params):
+        self.bodies.append(body)
+        response = super(ProfileElasticsearch, self).search(index, doc_type, body, **params)
+        if body.get('profile'):
+            response['profile'] = {'shards': [{'id': '[node][test][0]', 'searches': []}]}
+        return response
+
+
+class Staff(object):
+    is_authenticated = True
+
+    def __init__(self, is_staff):
+        self.is_staff = is_staff
+
+
+@pytest.mark.parametrize('user, es_profile, profiled', [
+    (Staff(True), True, True),
+    (Staff(False), True, False),
+    (Staff(True), False, False),
+])
+def test_profile(user, es_profile, profiled, executed):
+    timings = []
+
+    def receiver(sender, **kwargs):
+        timings.append(kwargs['timings'])
+
+    class View(ListElasticAPIView):
+        es_client = ProfileElasticsearch()
+        es_model = DataDocType
+
+    View.es_profile = es_profile
+    ProfileElasticsearch.bodies = []
+    request = rf.get('/test/', {'__profile': '1'})
+    force_authenticate(request, user=user)
+    es_request_timed.connect(receiver, sender=View, weak=False)
+    try:
+        response = View.as_view()(request)
+        response.render()
+    finally:
+        es_request_timed.disconnect(receiver, sender=View)
+    # The profiled search is not recorded
+    assert [call['method'] for call in executed] == ['count', 'search']
+    assert [phase['name'] for phase in timings[0]['phases']].count('es') == 2
+
+    assert response.status_code == 200
+    assert ('es_profile' in response.data) is profiled
+    if profiled:
+        assert response.data['es_profile']['profile']['shards'][0]['id'] == '[node][test][0]'
+        body = response.data['es_profile']['request']
+        assert body == ProfileElasticsearch.bodies[0]
+        assert 'profile' not in body
+        assert ProfileElasticsearch.bodies[-1] == dict(body, profile=True)
+        assert len(response.data['results']) == 1
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+import os
+
+import pytest
+from django.core.management import call_command
+from django.utils.six import StringIO
+
+from rest_framework_elasticsearch.es_pagination import ElasticLimitOffsetPagination
+from rest_framework_elasticsearch.es_traffic import (
+    REDACTED, ElasticTrafficRecorder, ElasticTrafficReplayer, TrafficReport,
+    get_percentile, load_traffic)
+from rest_framework_elasticsearch.es_views import ListElasticAPIView
+from .test_data import DataDocType
+from .utils import rf
+
+
+class TrafficView(ListElasticAPIView):
+    es_model = DataDocType
+    es_pagination_class = ElasticLimitOffsetPagination
+    es_search_fields = ('first_name',)
+
+
+@pytest.fixture
+def recorder(tmpdir):
+    recorder = ElasticTrafficRecorder(path=str(tmpdir.join('traffic.ndjson')))
+    recorder.connect()
+    yield recorder
+    recorder.disconnect()
+
+
+def test_strip_params():
+    recorder = ElasticTrafficRecorder()
+    params = {
+        'search': ['mail zofia@example.com'],
+        'phone': ['+48 600 100 200'],
+        'access_token': ['secret'],
+        'q': ['call +48 600 100 200'],
+        'created': ['2017-01-01'],
+    }
+    assert recorder.strip_params(params) == {
+        'search': ['mail %s' % REDACTED],
+        'q': ['call %s' % REDACTED],
+        'created': ['2017-01-01'],
+    }
+    recorder = ElasticTrafficRecorder(include_params=('search',))
+    assert list(recorder.strip_params(params)) == ['search']
+
+
+def test_record_path(es_data_client, recorder):
+    view = TrafficView.as_view(es_client=es_data_client)
+    view(rf.get('/users/zofia@example.com/'), user='zofia@example.com',
+         token='secret', page='2').render()
+
+    entry, = load_traffic(recorder.path)
+    assert entry['path'] == '/users/%s/' % REDACTED
+    assert entry['kwargs'] == {'user': REDACTED, 'token': REDACTED, 'page': '2'}
+
+
+def test_get_percentile():
+    values = list(range(1, 101))
+    assert get_percentile(values, 50) == 50
+    assert get_percentile(values, 99) == 99
+    assert get_percentile(values, 100) == 100
+    assert get_percentile([5], 90) == 5
+    assert get_percentile([], 90) is None
+
+
+def test_report():
+    report = TrafficReport()
+    report.add(10, 200)
+    report.add(30, 400)
+    report.add(20, error=ValueError())
+    report.elapsed = 2
+    report.cache_hits, report.cache_misses = 1, 3
+    data = report.to_dict()
+    assert data['requests'] == 3
+    assert data['errors'] == 2
+    assert data['throughput'] == 1.5
+    assert data['latency']['p50'] == 20
+    assert data['latency']['max'] == 30
+    assert data['exceptions'] == {'ValueError': 1}
+    assert data['cache_hit_ratio'] == 0.25
+
+
+def test_record(es_data_client, recorder):
+    view = TrafficView.as_view(es_client=es_data_client)
+    view(rf.get('/test/', {'search': 'Zofia', 'email': 'zofia@example.com', 'limit': 5})).render()
+    view(rf.post('/test/', {})).render()
+    unsampled = ElasticTrafficRecorder(path=recorder.path + '.unsampled', sample_rate=0)
+    unsampled.connect()
+    try:
+        view(rf.get('/test/')).render()
+    finally:
+        unsampled.disconnect()
+    assert not os.path.exists(unsampled.path)
+
+    entries = load_traffic(recorder.path)
+    # The POST is not recorded
+    assert len(entries) == 2
+    assert entries[0]['view'] == 'tests.test_traffic.TrafficView'
+    assert entries[0]['path'] == '/test/'
+    assert entries[0]['params'] == {'search': ['Zofia'], 'limit': ['5']}
+    assert entries[0]['status'] == 200
+    assert entries[0]['duration'] > 0
+    assert entries[1]['params'] == {}
+
+
+def test_replay(es_data_client, recorder):
+    TrafficView.as_view(es_client=es_data_client)(rf.get('/test/', {'limit': 5})).render()
+    entries = load_traffic(recorder.path)
+
+    report = ElasticTrafficReplayer(es_client=es_data_client, concurrency=2,
+                                    repeat=3).run(entries)
+    data = report.to_dict()
+    assert data['requests'] == 3
+    assert data['statuses'] == {200: 3}
+    assert data['es_queries'] >= 3
+    assert data['throughput'] > 0
+    # The replayed requests are not recorded
+    assert len(load_traffic(recorder.path)) == 1
+
+    # Overridden query parameters and view attributes
+    replayer = ElasticTrafficReplayer(es_client=es_data_client, params={'limit': 'x'})
+    assert replayer.get_request(entries[0]).GET['limit'] == 'x'
+    replayer = ElasticTrafficReplayer(view_options={'es_search_fields': ('last_name',)})
+    assert replayer.get_view(entries[0]['view']).view_initkwargs == {
+        'es_search_fields': ('last_name',)}
+    with pytest.raises(TypeError):
+        ElasticTrafficReplayer(view_options={'page_size': 10}).get_view(entries[0]['view'])
+
+
+def test_replay_command(es_data_client, recorder, monkeypatch):
+    TrafficView.as_view(es_client=es_data_client)(rf.get('/test/')).render()
+    monkeypatch.setattr(TrafficView, 'es_client', es_data_client)
+    out = StringIO()
+    call_command('replay_es_traffic', recorder.path, '--repeat', '2', '--param', 'limit=1',
+                 '--json', stdout=out)
+    data = json.loads(out.getvalue())
+    assert data['requests'] == 2
+    assert data['statuses'] == {'200': 2}
+
+    out = StringIO()
+    call_command('replay_es_traffic', recorder.path, stdout=out)
+    assert out.getvalue().startswith('requests=1 errors=0')
+    assert 'status 200: 1' in out.getvalue()
@@ -3,20 +3,71 @@ from __future__ import unicode_literals
 
 import pytest
 from django.core.exceptions import ImproperlyConfigured
+from rest_framework import generics, serializers
+from rest_framework.pagination import LimitOffsetPagination, PageNumberPagination
 from rest_framework.test import APIRequestFactory
 from elasticsearch_dsl import Search
 
 from rest_framework_elasticsearch.es_filters import (
     ESFieldFilter, ElasticOrderingFilter, ElasticFieldsFilter,
     ElasticFieldsRangeFilter, ElasticSearchFilter)
+from rest_framework_elasticsearch.es_serializer import ElasticHitSerializer
 from rest_framework_elasticsearch.es_views import ElasticAPIView
 from .test_data import DataDocType, DATA
-from .utils import get_search_ids
+from .utils import StubElasticsearch, get_search_ids
 
 
 rf = APIRequestFactory()
 
 
+class RecordingElasticsearch(StubElasticsearch):
+    """Client which records the search and count requests"""
+
+    def __init__(self, *args, **kwargs):
+        super(RecordingElasticsearch, self).__init__(*args, **kwargs)
+        self.requests = []
+
+    def search(self, index=None, doc_type=None, body=None, **params):
+        self.requests.append(('search', body))
+        response = super(RecordingElasticsearch, self).search(index, doc_type, body, **params)
+        response['hits']['total'] = 10
+        return response
+
+    def count(self, index=None, doc_type=None, body=None, **params):
+        self.requests.append(('count', body))
+        return {'count': 10}
+
+
+class PageNumberSizePagination(PageNumberPagination):
+    page_size = 2
+
+
+@pytest.mark.parametrize('pagination_class,query_params', [
+    (LimitOffsetPagination, {'limit': 2, 'offset': 2}),
+    (PageNumberSizePagination, {'page': 2}),
+])
+def test_generic_view_pagination(pagination_class, query_params):
+    es_client = RecordingElasticsearch()
+
+    class GenericView(ElasticAPIView, generics.ListAPIView):
+        es_model = DataDocType
+
+        def list(self, request, *args, **kwargs):
+            page = self.paginate_queryset(self.get_queryset())
+            return self.get_paginated_response(page)
+
+    GenericView.es_client = es_client
+    GenericView.pagination_class = pagination_class
+    response = GenericView.as_view()(rf.get('/test/', query_params))
+    assert response.status_code == 200
+    assert response.data['count'] == 10
+    # The count and the page are answered by one bounded search
+    assert len(es_client.requests) == 1
+    method, body = es_client.requests[0]
+    assert method == 'search'
+    assert (body['from'], body['size']) == (2, 2)
+
+
 class TestElasticAPIView:
     """ElasticAPIView tests class"""
 
@@ -163,6 +214,21 @@ class TestElasticAPIView:
         expected = [item.to_dict() for item in result]
         assert view.es_representation(result) == expected
 
+    def test_es_representation_with_serializer(self, search, es_client):
+        class HitSerializer(ElasticHitSerializer):
+            name = serializers.CharField(source='first_name')
+            score = serializers.IntegerField()
+
+        view = self.create_view(es_client)
+        view.es_serializer_class = HitSerializer
+        view.request = rf.get('/test/')
+
+        result = search[:len(DATA)].execute()
+        expected = [
+            {'name': item.first_name, 'score': item.score} for item in result
+        ]
+        assert view.es_representation(result) == expected
+
     def test_excludes_respond_fields(self, search, es_client):
         view = self.create_view(es_client)
         view.es_excludes_fields = (
@@ -225,7 +291,7 @@ class TestElasticAPIView:
         }
 
         result = view.get_queryset()
-        assert result == [
+        assert list(result) == [
             {
                 'city': 'Manila',
                 'first_name': 'Samantha',
@@ -1,7 +1,15 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from .test_data import DATA
+from elasticsearch import Elasticsearch
+from rest_framework.test import APIRequestFactory
+
+from rest_framework_elasticsearch.es_bulk import BulkResult, ElasticBulkIndexer
+from rest_framework_elasticsearch.es_serializer import ElasticModelSerializer
+from .models import Person
+from .test_data import DATA, DataDocType
+
+rf = APIRequestFactory()
 
 
 def get_search_ids(search):
@@ -13,3 +21,54 @@ def get_search_ids(search):
         [int]: list of items ids
     """
     return [int(item.meta.id) for item in search[:len(DATA)].execute()]
+
+
+class PersonSerializer(ElasticModelSerializer):
+    class Meta:
+        model = Person
+        es_model = DataDocType
+        fields = ('first_name', 'last_name', 'score')
+
+
+class AuthorPersonSerializer(PersonSerializer):
+    class Meta(PersonSerializer.Meta):
+        es_dependencies = {'tests.Author': 'author'}
+        es_select_related = ('author',)
+
+
+class RecordingIndexer(ElasticBulkIndexer):
+    """Indexer which records actions instead of sending them"""
+
+    def __init__(self, *args, **kwargs):
+        self.missing = kwargs.pop('missing', ())
+        super(RecordingIndexer, self).__init__(*args, **kwargs)
+        self.sent = []
+
+    def send(self, actions, **kwargs):
+        result = BulkResult()
+        for action in actions:
+            self.sent.append(action)
+            op_type = action.get('_op_type', 'index')
+            if op_type == 'update' and action['_id'] in self.missing:
+                result.errors.append({op_type: {'_id': action['_id'], 'status': 404}})
+            else:
+                result.success += 1
+        return result
+
+
+class StubElasticsearch(Elasticsearch):
+    """Client which answers searches without a cluster"""
+
+    def search(self, index=None, doc_type=None, body=None, **params):
+        return {
+            'took': 3,
+            'timed_out': False,
+            '_shards': {'total': 1, 'successful': 1, 'failed': 0},
+            'hits': {'total': 1, 'max_score': 1.0, 'hits': [
+                {'_index': 'test', '_type': 'doc', '_id': '1', '_score': 1.0,
+                 '_source': {'first_name': 'Zofia'}},
+            ]},
+        }
+
+    def count(self, index=None, doc_type=None, body=None, **params):
+        return {'count': 1}